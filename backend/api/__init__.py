@@ -2,10 +2,20 @@ from flask import Blueprint
 from .feeds import feeds_api 
 from .dashboard import dashboard_api
 from .camera import camera_api
+from .scheduler import scheduler_api
+from .metrics import metrics_api
+from .profiler import profiler_api
+from .plates import plates_api
+from .events import events_api
 
 api_bp = Blueprint("api", __name__)
 
 api_bp.register_blueprint(feeds_api)
 api_bp.register_blueprint(dashboard_api)
 api_bp.register_blueprint(camera_api) 
+api_bp.register_blueprint(scheduler_api)
+api_bp.register_blueprint(metrics_api)
+api_bp.register_blueprint(profiler_api)
+api_bp.register_blueprint(plates_api)
+api_bp.register_blueprint(events_api)
 
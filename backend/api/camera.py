@@ -15,6 +15,14 @@ def get_camera_summary_route():
 def get_camera_config_route():
     return jsonify(camera_service.get_camera_config())
 
+@camera_api.route("/api/camera/capture", methods=["GET"])
+def get_capture_status_route():
+    return jsonify(camera_service.get_capture_status())
+
+@camera_api.route("/api/camera/memory", methods=["GET"])
+def get_memory_report_route():
+    return jsonify(camera_service.get_memory_report())
+
 @camera_api.route("/api/camera/toggle", methods=["POST"])
 def toggle_camera_status():
     data = request.json
@@ -0,0 +1,58 @@
+import json
+
+from flask import Blueprint, request, jsonify, Response
+from services.events import event_bus, event_history, event_dict, EVENT_TYPES
+
+events_api = Blueprint("events_api", __name__)
+
+# Recent events are kept from the moment the API is loaded
+event_history.start()
+
+MAX_HISTORY = 1000
+# Events an SSE client may fall behind by before its oldest are dropped
+SSE_QUEUE_SIZE = 256
+# Seconds between keep-alive comments on an idle stream
+SSE_KEEPALIVE = 15.0
+
+
+def _kinds():
+    """Event types from a comma separated `kinds` argument, or None for all"""
+    kinds = [kind for kind in request.args.get("kinds", "").split(",") if kind]
+    unknown = [kind for kind in kinds if kind not in EVENT_TYPES]
+    if unknown:
+        raise ValueError(f"Unknown event kinds: {', '.join(unknown)} (known: {', '.join(EVENT_TYPES)})")
+    return tuple(EVENT_TYPES[kind] for kind in kinds) or None
+
+
+@events_api.route("/api/events/history", methods=["GET"])
+def event_history_route():
+    """Recent crossing, count, occupancy and plate events, newest first; filter with kind"""
+    kind = request.args.get("kind")
+    limit = min(request.args.get("limit", 100, type=int), MAX_HISTORY)
+    return jsonify([event_dict(event) for event in event_history.recent(kind, limit)])
+
+
+@events_api.route("/api/events/stream", methods=["GET"])
+def event_stream_route():
+    """Server-sent events as they are published; filter with kinds=crossing,plate,..."""
+    try:
+        types = _kinds()
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    subscription = event_bus.subscribe("sse", types=types, max_queue=SSE_QUEUE_SIZE, policy="drop_oldest",
+                                       batch_size=50, max_wait=0)
+
+    def stream():
+        try:
+            yield ": connected\n\n"
+            while True:
+                batch = subscription.get_batch(timeout=SSE_KEEPALIVE)
+                if not batch:
+                    yield ": keep-alive\n\n"
+                for event in batch:
+                    yield f"event: {event.kind}\ndata: {json.dumps(event_dict(event))}\n\n"
+        finally:
+            event_bus.unsubscribe(subscription)
+
+    return Response(stream(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
@@ -0,0 +1,8 @@
+from flask import Blueprint, Response
+from services.metrics import render, CONTENT_TYPE
+
+metrics_api = Blueprint("metrics_api", __name__)
+
+@metrics_api.route("/metrics", methods=["GET"])
+def get_metrics_route():
+    return Response(render(), content_type=CONTENT_TYPE)
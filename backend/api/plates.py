@@ -0,0 +1,85 @@
+import csv
+import io
+import json
+import sqlite3
+
+from flask import Blueprint, request, jsonify, Response
+from services.plate_store import plate_store, parse_time, MATCH_MODES
+
+plates_api = Blueprint("plates_api", __name__)
+
+MAX_PAGE_SIZE = 1000
+
+
+def _filters():
+    """The search filters of the request; ValueError for a bad one, before any query runs"""
+    match = request.args.get("match", "prefix")
+    if match not in MATCH_MODES:
+        raise ValueError(f"match must be one of {', '.join(MATCH_MODES)}")
+    return {
+        "plate": request.args.get("plate"),
+        "match": match,
+        "location": request.args.get("location"),
+        "direction": request.args.get("direction"),
+        "since": parse_time(request.args.get("since")),
+        "until": parse_time(request.args.get("until")),
+    }
+
+
+@plates_api.route("/api/plates", methods=["GET"])
+def search_plates_route():
+    """
+    Plate events, newest first. Filters: plate with match=prefix (default), exact or
+    fuzzy; location; direction; since and until as ISO 8601 or unix seconds. Pages
+    through the results with limit and the next_cursor of the previous page.
+    """
+    try:
+        filters = _filters()
+        limit = int(request.args.get("limit", 100))
+        if limit < 1:
+            raise ValueError("limit must be at least 1")
+        limit = min(limit, MAX_PAGE_SIZE)
+        events, next_cursor = plate_store.search(limit=limit, cursor=request.args.get("cursor"), **filters)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"events": events, "next_cursor": next_cursor})
+
+
+@plates_api.route("/api/plates/<plate>/last", methods=["GET"])
+def last_seen_route(plate):
+    event = plate_store.last_seen(plate, direction=request.args.get("direction"),
+                                  location=request.args.get("location"))
+    if event is None:
+        return jsonify({"error": f"{plate.upper()} has not been seen"}), 404
+    return jsonify(event)
+
+
+@plates_api.route("/api/plates/export", methods=["GET"])
+def export_plates_route():
+    """Every matching event, oldest first, streamed as NDJSON (or CSV with format=csv)"""
+    output_format = request.args.get("format", "ndjson")
+    if output_format not in ["ndjson", "csv"]:
+        return jsonify({"error": "format must be 'ndjson' or 'csv'"}), 400
+    # The query runs here, before the response starts, so its errors still get a status
+    try:
+        events = plate_store.iter_events(**_filters())
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except sqlite3.Error as e:
+        return jsonify({"error": f"Could not read plate events: {e}"}), 500
+
+    if output_format == "csv":
+        def generate():
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(["timestamp", "license_plate", "location", "direction", "confidence", "image"])
+            for e in events:
+                writer.writerow([e['time'], e['plate'], e['location'], e['direction'], e['confidence'], e['image']])
+                if buffer.tell() > 65536:
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+            yield buffer.getvalue()
+        return Response(generate(), mimetype="text/csv",
+                        headers={"Content-Disposition": "attachment; filename=plates.csv"})
+    return Response((json.dumps(e) + "\n" for e in events), mimetype="application/x-ndjson")
@@ -0,0 +1,39 @@
+import math
+
+from flask import Blueprint, request, jsonify, Response
+from services.profiler import profile, ProfilerBusy, PIPELINE_THREAD_PREFIXES
+
+profiler_api = Blueprint("profiler_api", __name__)
+
+@profiler_api.route("/api/admin/profile", methods=["POST"])
+def run_profiler_route():
+    try:
+        duration = float(request.args.get("duration", 10))
+        interval = float(request.args.get("interval_ms", 5)) / 1000
+    except ValueError:
+        return jsonify({"error": "duration and interval_ms must be numbers"}), 400
+    if not (math.isfinite(duration) and math.isfinite(interval)):
+        return jsonify({"error": "duration and interval_ms must be finite"}), 400
+    output_format = request.args.get("format", "collapsed")
+    if output_format not in ["collapsed", "pstats"]:
+        return jsonify({"error": "format must be 'collapsed' or 'pstats'"}), 400
+
+    # "all" profiles every thread, otherwise a comma separated list of thread name prefixes
+    threads = request.args.get("threads")
+    if threads == "all":
+        prefixes = ()
+    elif threads:
+        prefixes = tuple(p for p in threads.split(",") if p)
+    else:
+        prefixes = PIPELINE_THREAD_PREFIXES
+
+    try:
+        profiler = profile(duration, max(interval, 0.001), prefixes)
+    except ProfilerBusy as e:
+        return jsonify({"error": str(e)}), 409
+
+    headers = {"X-Profile-Samples": str(profiler.sample_count), "X-Profile-Duration": f"{profiler.duration:.2f}"}
+    if output_format == "pstats":
+        headers["Content-Disposition"] = "attachment; filename=profile.pstats"
+        return Response(profiler.pstats(), mimetype="application/octet-stream", headers=headers)
+    return Response(profiler.collapsed(), mimetype="text/plain", headers=headers)
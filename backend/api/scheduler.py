@@ -0,0 +1,8 @@
+from flask import Blueprint, jsonify
+from services.scheduler import inference_scheduler
+
+scheduler_api = Blueprint("scheduler_api", __name__)
+
+@scheduler_api.route("/api/scheduler", methods=["GET"])
+def get_scheduler_status_route():
+    return jsonify(inference_scheduler.status())
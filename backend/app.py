@@ -1,10 +1,6 @@
 from flask import Flask
 from flask_cors import CORS
 from api import api_bp
-from services.multicam import main as multicam_main
-import threading
-import subprocess
-import sys
 
 def create_app():
     app = Flask(__name__)
@@ -14,26 +10,11 @@ def create_app():
 
     return app
 
-def run_anpr():
-    try:
-        # Use sys.executable to ensure the correct Python interpreter is used
-        # Adjust the path to anpr.py as needed
-        subprocess.Popen([sys.executable, 'services/anpr.py'])
-    except Exception as e:
-        print(f"Error starting anpr.py: {e}")
-
 if __name__ == "__main__":
     app = create_app()
-    multicam_thread = threading.Thread(target=multicam_main)
-    multicam_thread.daemon = True
-    multicam_thread.start()
-
-    # Start car_counter processing in a separate thread
-    from services.car_counter import main as car_counter_main
-    car_counter_thread = threading.Thread(target=car_counter_main)
-    car_counter_thread.daemon = True
-    car_counter_thread.start()
 
-    # anpr.py is now run separately.
+    # The multicam and counter pipelines of every active feed are started once each by
+    # the camera service when the API is imported. ANPR runs inside the counter pipeline
+    # for feeds with "anpr": true, or for every counter feed with python -m services.anpr
 
     app.run(debug=True, host='0.0.0.0', port=5000)
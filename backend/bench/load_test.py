@@ -0,0 +1,221 @@
+"""
+Capacity test: runs the full backend against N synthetic cameras and records how
+throughput and latency change as N grows. Run from the backend directory:
+
+    python -m bench.load_test --feeds 1 2 4 8 16 --width 1920 --height 1080 --fps 15 --out reports/load.json
+
+Every level runs in a fresh process with its own feeds config (FEEDS_CONFIG), the real
+Flask app and one or more MJPEG clients per feed reading the streams over HTTP.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from datetime import datetime
+
+
+def write_config(directory, n_feeds, options):
+    feeds = []
+    for i in range(n_feeds):
+        feed_type = options['type'] if options['type'] != 'mixed' else ('counter' if i % 2 == 0 else 'multicam')
+        source = (f"synthetic://load{i}?width={options['width']}&height={options['height']}"
+                  f"&fps={options['fps']}&density={options['density']}&seed={i}")
+        feed = {"name": f"Load {i}", "video_source": source, "type": feed_type, "status": "active", "id": i}
+        if feed_type == 'multicam':
+            feed.update({"totalSlots": 100, "availableSlots": 50})
+        feeds.append(feed)
+    path = os.path.join(directory, "feeds_config.json")
+    with open(path, 'w') as f:
+        json.dump({"feeds": feeds, "global_car_count": 0}, f, indent=4)
+    return path, feeds
+
+
+class StreamClient(threading.Thread):
+    """Reads an MJPEG stream and records when each frame arrives"""
+    def __init__(self, url):
+        super().__init__(daemon=True)
+        self.url = url
+        self.arrivals = []
+        self.bytes = 0
+        self.error = None
+        self.running = True
+
+    def run(self):
+        try:
+            with urllib.request.urlopen(self.url, timeout=30) as response:
+                while self.running:
+                    chunk = response.read1(65536)
+                    if not chunk:
+                        break
+                    self.bytes += len(chunk)
+                    now = time.monotonic()
+                    for _ in range(chunk.count(b"--frame")):
+                        self.arrivals.append(now)
+        except Exception as e:
+            self.error = str(e)
+
+
+def snapshot_histograms(metric):
+    return {key: series.snapshot()[0] for key, series in metric.series()}
+
+
+def diff_quantiles(metric, before, quantiles=(0.5, 0.99)):
+    """Quantiles over the observations made since `before`, merged across series"""
+    from services.metrics import quantile_from_counts
+    merged = None
+    for key, series in metric.series():
+        counts = series.snapshot()[0]
+        old = before.get(key, [0] * len(counts))
+        delta = [c - o for c, o in zip(counts, old)]
+        merged = delta if merged is None else [m + d for m, d in zip(merged, delta)]
+    if merged is None:
+        return {f"p{int(q * 100)}_ms": None for q in quantiles}
+    result = {}
+    for q in quantiles:
+        value = quantile_from_counts(metric.buckets, merged, q)
+        result[f"p{int(q * 100)}_ms"] = round(value * 1000, 2) if value is not None else None
+    return result
+
+
+def run_level(n_feeds, options):
+    """Run one load level in this (fresh) process and return its measurements"""
+    directory = tempfile.mkdtemp(prefix="load_test_")
+    config_path, feeds = write_config(directory, n_feeds, options)
+    # Must be set before any service module is imported
+    os.environ["FEEDS_CONFIG"] = config_path
+
+    from werkzeug.serving import make_server
+    from app import create_app
+    from services.metrics import STAGE_SECONDS, END_TO_END_SECONDS, FRAMES_PROCESSED
+    from services.scheduler import inference_scheduler
+
+    app = create_app()
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+
+    clients = []
+    for feed in feeds:
+        route = "video_feed" if feed['type'] == 'multicam' else "car_counter_video_feed"
+        for _ in range(options['clients_per_feed']):
+            client = StreamClient(f"{base_url}/{route}/{feed['id']}")
+            client.start()
+            clients.append(client)
+
+    time.sleep(options['warmup'])
+
+    processed_before = {key: series.value for key, series in FRAMES_PROCESSED.series()}
+    stage_before = snapshot_histograms(STAGE_SECONDS)
+    e2e_before = snapshot_histograms(END_TO_END_SECONDS)
+    arrivals_before = [len(c.arrivals) for c in clients]
+    cpu_before = os.times()
+    started = time.monotonic()
+
+    time.sleep(options['duration'])
+
+    wall = time.monotonic() - started
+    cpu_after = os.times()
+    processed = sum(series.value - processed_before.get(key, 0) for key, series in FRAMES_PROCESSED.series())
+    received = sum(len(c.arrivals) - before for c, before in zip(clients, arrivals_before))
+    cpu_seconds = (cpu_after.user - cpu_before.user) + (cpu_after.system - cpu_before.system)
+
+    inference_stage = {key: counts for key, counts in stage_before.items() if key[1] == "inference"}
+    scheduler = inference_scheduler.status()
+    for client in clients:
+        client.running = False
+    server.shutdown()
+
+    return {
+        "feeds": n_feeds,
+        "clients": len(clients),
+        "processed_fps": round(processed / wall, 2),
+        "processed_fps_per_feed": round(processed / wall / n_feeds, 2),
+        "client_fps_per_stream": round(received / wall / len(clients), 2) if clients else 0.0,
+        "end_to_end": diff_quantiles(END_TO_END_SECONDS, e2e_before),
+        "inference": diff_quantiles(_StageView(STAGE_SECONDS, "inference"), inference_stage),
+        "cpu_percent": round(cpu_seconds / wall * 100, 1),
+        "cpu_cores": os.cpu_count(),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "shed_feeds": sum(1 for f in scheduler['feeds'] if f['shedLevel'] > 0),
+        "client_errors": sorted({c.error for c in clients if c.error}),
+    }
+
+
+class _StageView:
+    """View of a metric restricted to the series of one stage"""
+    def __init__(self, metric, stage):
+        self.metric = metric
+        self.stage = stage
+        self.buckets = metric.buckets
+
+    def series(self):
+        return [(key, series) for key, series in self.metric.series() if key[1] == self.stage]
+
+
+def run_level_isolated(n_feeds, options):
+    with multiprocessing.get_context("spawn").Pool(1) as pool:
+        return pool.apply(run_level, (n_feeds, options))
+
+
+def print_row(row):
+    print(f"{row['feeds']:>5} {row['processed_fps']:>10.1f} {row['processed_fps_per_feed']:>9.1f} "
+          f"{row['client_fps_per_stream']:>9.1f} {str(row['end_to_end']['p50_ms']):>9} "
+          f"{str(row['end_to_end']['p99_ms']):>9} {row['cpu_percent']:>7.0f}% {row['peak_rss_mb']:>8.0f} {row['shed_feeds']:>5}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Measure backend throughput and latency against N synthetic cameras.")
+    parser.add_argument("--feeds", type=int, nargs="+", default=[1, 2, 4, 8], help="Feed counts to test, in order")
+    parser.add_argument("--type", choices=["counter", "multicam", "mixed"], default="mixed")
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--fps", type=float, default=15)
+    parser.add_argument("--density", type=float, default=0.5, help="Vehicles per second per camera")
+    parser.add_argument("--clients-per-feed", type=int, default=1)
+    parser.add_argument("--warmup", type=float, default=15, help="Seconds to let models load and settle")
+    parser.add_argument("--duration", type=float, default=30, help="Measured seconds per level")
+    parser.add_argument("--stop-below", type=float, default=0.0,
+                        help="Stop once per-feed processed FPS drops below this fraction of --fps")
+    parser.add_argument("--out", help="Write the JSON results here")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    options = {
+        "type": args.type, "width": args.width, "height": args.height, "fps": args.fps,
+        "density": args.density, "clients_per_feed": args.clients_per_feed,
+        "warmup": args.warmup, "duration": args.duration,
+    }
+
+    print(f"{'feeds':>5} {'proc fps':>10} {'per feed':>9} {'client':>9} {'e2e p50':>9} {'e2e p99':>9} {'cpu':>8} {'rss MB':>8} {'shed':>5}")
+    rows = []
+    for n_feeds in args.feeds:
+        row = run_level_isolated(n_feeds, options)
+        rows.append(row)
+        print_row(row)
+        sys.stdout.flush()
+        if args.stop_below and row['processed_fps_per_feed'] < args.stop_below * args.fps:
+            print(f"Stopping: per-feed throughput fell below {args.stop_below:.0%} of {args.fps} FPS")
+            break
+
+    result = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "options": options,
+        "levels": rows,
+    }
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, 'w') as f:
+            json.dump(result, f, indent=2, sort_keys=True)
+    return result
+
+
+if __name__ == "__main__":
+    main()
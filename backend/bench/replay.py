@@ -0,0 +1,258 @@
+"""
+Headless replay benchmark for the car_counter and multicam pipelines.
+
+Replays recorded clips through the per-frame pipeline logic as fast as possible and
+writes a JSON report with throughput, per-stage latency percentiles, peak RSS and
+count accuracy against annotated ground truth. Run from the backend directory:
+
+    python -m bench.replay bench/clips.json --out reports/run.json --baseline reports/prev.json
+
+The manifest lists the clips, with paths relative to the manifest:
+
+    {"clips": [{"name": "gate2", "path": "gate2.mp4", "pipeline": "counter",
+                "ground_truth": "gate2.crossings.json"}]}
+
+A ground truth file lists the annotated crossings by frame index, or just the totals:
+
+    {"crossings": [{"frame": 120, "direction": "towards"}, ...]}
+    {"towards": 12, "away": 9}
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import time
+from datetime import datetime
+
+from services.detector import CarDetector
+from services.offline import OfflinePipeline, DEFAULT_FRAME_SKIP
+from services.trace import TraceWriter, EXTENSION
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def load_manifest(path):
+    with open(path, 'r') as f:
+        manifest = json.load(f)
+    base_dir = os.path.dirname(os.path.abspath(path))
+    clips = []
+    for clip in manifest.get('clips', []):
+        clip = dict(clip)
+        clip['path'] = os.path.join(base_dir, clip['path'])
+        if clip.get('ground_truth'):
+            clip['ground_truth'] = os.path.join(base_dir, clip['ground_truth'])
+        clip.setdefault('name', os.path.splitext(os.path.basename(clip['path']))[0])
+        clip.setdefault('pipeline', 'counter')
+        clips.append(clip)
+    return clips
+
+
+def load_ground_truth(path):
+    with open(path, 'r') as f:
+        truth = json.load(f)
+    crossings = truth.get('crossings')
+    if crossings is not None:
+        counts = {"towards": 0, "away": 0}
+        for crossing in crossings:
+            counts[crossing['direction']] += 1
+    else:
+        counts = {"towards": truth.get('towards', 0), "away": truth.get('away', 0)}
+    return counts, crossings
+
+
+def match_events(events, crossings, tolerance):
+    """Greedily match detected events to annotated crossings of the same direction within `tolerance` frames"""
+    unmatched = sorted(crossings, key=lambda c: c['frame'])
+    matched = 0
+    for event in sorted(events, key=lambda e: e['frame']):
+        for i, crossing in enumerate(unmatched):
+            if crossing['direction'] == event['direction'] and abs(crossing['frame'] - event['frame']) <= tolerance:
+                del unmatched[i]
+                matched += 1
+                break
+    precision = matched / len(events) if events else 1.0
+    recall = matched / len(crossings) if crossings else 1.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return {"matched": matched, "precision": round(precision, 4), "recall": round(recall, 4), "f1": round(f1, 4)}
+
+
+def score_counts(counts, truth_counts):
+    errors = {d: counts[d] - truth_counts[d] for d in ("towards", "away")}
+    total_truth = sum(truth_counts.values())
+    abs_error = sum(abs(e) for e in errors.values())
+    return {
+        "expected": truth_counts,
+        "count_error": errors,
+        "count_accuracy": round(max(0.0, 1 - abs_error / total_truth) if total_truth else float(abs_error == 0), 4),
+    }
+
+
+def run_clip(clip, options):
+    detector = CarDetector(options['model'])
+    detector.load_model()
+    detector.imgsz = options['imgsz']
+    if options.get('conf') is not None:
+        detector.conf = options['conf']
+
+    pipeline = OfflinePipeline(
+        clip['pipeline'],
+        detector,
+        frame_skip=clip.get('frame_skip', options.get('frame_skip')),
+        process_size=tuple(options['process_size']),
+        total_slots=clip.get('totalSlots', 0),
+        available_slots=clip.get('availableSlots', 0),
+    )
+
+    if options.get('record_traces'):
+        detector.trace = TraceWriter(os.path.join(options['record_traces'], clip['name'] + EXTENSION), {
+            "pipeline": clip['pipeline'],
+            "source": clip['path'],
+            "frame_size": list(options['process_size']),
+        })
+
+    started = time.perf_counter()
+    try:
+        pipeline.run(clip['path'], end_frame=options.get('max_frames'))
+    finally:
+        if detector.trace is not None:
+            detector.trace.close()
+    wall = time.perf_counter() - started
+
+    result = {
+        "name": clip['name'],
+        "pipeline": clip['pipeline'],
+        "path": clip['path'],
+        "frame_skip": pipeline.frame_skip,
+        "frames_decoded": pipeline.frames_decoded,
+        "frames_processed": pipeline.frames_processed,
+        "wall_seconds": round(wall, 3),
+        "decode_fps": round(pipeline.frames_decoded / wall, 2) if wall else 0.0,
+        "processed_fps": round(pipeline.frames_processed / wall, 2) if wall else 0.0,
+        "stages": pipeline.recorder.summary(),
+        "peak_rss_mb": peak_rss_mb(),
+        "counts": pipeline.counts(),
+        "events": pipeline.events,
+    }
+    if clip.get('ground_truth'):
+        truth_counts, crossings = load_ground_truth(clip['ground_truth'])
+        accuracy = score_counts(result['counts'], truth_counts)
+        if crossings is not None:
+            accuracy.update(match_events(pipeline.events, crossings, options['tolerance']))
+        result['accuracy'] = accuracy
+    return result
+
+
+def run_clip_isolated(clip, options):
+    """Run one clip in a fresh interpreter so its peak RSS is not inflated by earlier clips"""
+    with multiprocessing.get_context("spawn").Pool(1) as pool:
+        return pool.apply(run_clip, (clip, options))
+
+
+def summarize(results):
+    frames = sum(r['frames_processed'] for r in results)
+    wall = sum(r['wall_seconds'] for r in results)
+    scored = [r['accuracy']['count_accuracy'] for r in results if 'accuracy' in r]
+    return {
+        "clips": len(results),
+        "frames_processed": frames,
+        "processed_fps": round(frames / wall, 2) if wall else 0.0,
+        "peak_rss_mb": max((r['peak_rss_mb'] for r in results), default=0.0),
+        "mean_count_accuracy": round(sum(scored) / len(scored), 4) if scored else None,
+    }
+
+
+def compare(report, baseline):
+    """Print per-clip FPS and accuracy changes against a previous report"""
+    previous = {r['name']: r for r in baseline.get('clips', [])}
+    print(f"{'clip':24} {'fps':>10} {'Δfps':>8} {'accuracy':>9} {'Δacc':>8}")
+    for result in report['clips']:
+        old = previous.get(result['name'])
+        accuracy = result.get('accuracy', {}).get('count_accuracy')
+        line = f"{result['name']:24} {result['processed_fps']:>10.2f}"
+        if old:
+            fps_change = (result['processed_fps'] / old['processed_fps'] - 1) * 100 if old['processed_fps'] else 0.0
+            line += f" {fps_change:>+7.1f}%"
+        else:
+            line += f" {'new':>8}"
+        line += f" {accuracy:>9.4f}" if accuracy is not None else f" {'-':>9}"
+        old_accuracy = old.get('accuracy', {}).get('count_accuracy') if old else None
+        if accuracy is not None and old_accuracy is not None:
+            line += f" {accuracy - old_accuracy:>+8.4f}"
+        print(line)
+
+
+def build_report(results, options):
+    return {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "host": {
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "cpu_count": os.cpu_count(),
+        },
+        "options": options,
+        "summary": summarize(results),
+        "clips": results,
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Replay recorded clips through the counting pipelines and report performance.")
+    parser.add_argument("manifest", help="JSON manifest listing the clips")
+    parser.add_argument("--out", help="Write the JSON report here (default: stdout)")
+    parser.add_argument("--baseline", help="Previous report to compare against")
+    parser.add_argument("--model", default="yolov8n.pt")
+    parser.add_argument("--imgsz", type=int, default=640, help="YOLO input size")
+    parser.add_argument("--conf", type=float, default=None, help="Detection confidence threshold")
+    parser.add_argument("--process-size", type=int, nargs=2, default=[640, 480], metavar=("W", "H"))
+    parser.add_argument("--frame-skip", type=int, default=None,
+                        help=f"Process 1 in N frames (default per pipeline: {DEFAULT_FRAME_SKIP})")
+    parser.add_argument("--max-frames", type=int, default=None, help="Stop each clip after this many frames")
+    parser.add_argument("--tolerance", type=int, default=15, help="Frames an event may be off from the ground truth")
+    parser.add_argument("--record-traces", metavar="DIR", help="Also write a detection trace per clip into DIR")
+    parser.add_argument("--isolate", action="store_true", help="Run every clip in its own process for clean RSS numbers")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    options = {
+        "model": args.model,
+        "imgsz": args.imgsz,
+        "conf": args.conf,
+        "process_size": args.process_size,
+        "frame_skip": args.frame_skip,
+        "max_frames": args.max_frames,
+        "tolerance": args.tolerance,
+        "record_traces": args.record_traces,
+    }
+
+    results = []
+    for clip in load_manifest(args.manifest):
+        print(f"Replaying {clip['name']} ({clip['pipeline']})...", file=sys.stderr)
+        result = run_clip_isolated(clip, options) if args.isolate else run_clip(clip, options)
+        print(f"  {result['processed_fps']:.1f} processed FPS, counts {result['counts']}", file=sys.stderr)
+        results.append(result)
+
+    report = build_report(results, options)
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, 'w') as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            compare(report, json.load(f))
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+Replays recorded detection traces through tracking and counting, with no decoding or
+inference, so tracker and counter changes can be checked in seconds. Run from the
+backend directory:
+
+    python -m bench.trace_replay traces/gate2.dtrc --ground-truth bench/gate2.crossings.json \\
+        --variant max_distance=50 --variant max_distance=80 max_disappeared=5
+
+Traces are recorded by setting `record_trace` on a feed in feeds_config.json, or with
+`python -m bench.replay ... --record-traces DIR`. Every variant is a set of tracker
+parameters; all variants replay the same detections, so their results compare directly.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+from services import car_counter
+from services import multicam
+from services.offline import RecordingCounterState, RecordingParkingCounter
+from services.trace import read_trace
+from services.tracker import TRACKERS, make_tracker
+from services.zones import ZoneSet
+from bench.replay import load_ground_truth, match_events, score_counts
+
+
+def replay(trace, pipeline=None, tracker=None, min_confidence=None, total_slots=0, available_slots=0):
+    """
+    Feed a trace through tracking and counting exactly as the live pipeline would.
+    Returns the crossing events, counts and replay speed.
+    """
+    pipeline = pipeline or trace.metadata.get("pipeline", "counter")
+    tracker = tracker or make_tracker()
+    # The counting lines and zones of the feed when it was recorded
+    zones = ZoneSet.from_config(trace.metadata.get("zones"), trace.frame_size)
+    events = []
+
+    started = time.perf_counter()
+    if pipeline == "counter":
+        state = RecordingCounterState(events)
+        parking_counter = car_counter.ParkingCounter(0, 0)
+        for frame_index, boxes in trace.iter_boxes(min_confidence):
+            state.frame_index = frame_index
+            car_counter.update_counts(boxes, tracker, parking_counter, state, zones)
+    elif pipeline == "multicam":
+        parking_counter = RecordingParkingCounter(total_slots, available_slots, events)
+        for frame_index, boxes in trace.iter_boxes(min_confidence):
+            parking_counter.frame_index = frame_index
+            multicam.update_counts(boxes, tracker, parking_counter, zones)
+    else:
+        raise ValueError(f"Unknown pipeline: {pipeline}")
+    seconds = time.perf_counter() - started
+
+    counts = {"towards": 0, "away": 0}
+    for event in events:
+        counts[event["direction"]] += 1
+    return {
+        "pipeline": pipeline,
+        "frames": len(trace),
+        "detections": trace.detections,
+        "seconds": round(seconds, 6),
+        "detections_per_second": round(trace.detections / seconds, 1) if seconds else None,
+        "counts": counts,
+        "events": events,
+    }
+
+
+def parse_variant(items):
+    """["max_distance=50", "max_disappeared=5"] -> {"max_distance": 50, "max_disappeared": 5}"""
+    params = {}
+    for item in items:
+        name, _, value = item.partition("=")
+        if not value:
+            raise ValueError(f"Variant parameters look like name=value, got {item!r}")
+        params[name] = json.loads(value)
+    return params
+
+
+def variant_name(tracker, params):
+    return tracker + "".join(f" {k}={v}" for k, v in sorted(params.items()))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Replay detection traces through tracking and counting.")
+    parser.add_argument("traces", nargs="+", help="Trace files (.dtrc)")
+    parser.add_argument("--pipeline", choices=["counter", "multicam"], help="Override the pipeline stored in the trace")
+    parser.add_argument("--tracker", choices=sorted(TRACKERS), default="centroid")
+    parser.add_argument("--variant", nargs="+", action="append", default=[], metavar="NAME=VALUE",
+                        help="Tracker parameters of one variant; repeat to compare several")
+    parser.add_argument("--min-confidence", type=float, default=None, help="Drop detections at or below this confidence")
+    parser.add_argument("--ground-truth", help="Crossings file to score against (single trace only)")
+    parser.add_argument("--tolerance", type=int, default=15, help="Frames an event may be off from the ground truth")
+    parser.add_argument("--out", help="Write the JSON results here")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.ground_truth and len(args.traces) > 1:
+        raise SystemExit("--ground-truth needs a single trace")
+    variants = [parse_variant(items) for items in args.variant] or [{}]
+    truth = load_ground_truth(args.ground_truth) if args.ground_truth else None
+
+    results = []
+    print(f"{'trace':24} {'variant':40} {'towards':>8} {'away':>6} {'det/s':>12} {'f1':>6}", file=sys.stderr)
+    for path in args.traces:
+        trace = read_trace(path)
+        for params in variants:
+            result = replay(trace, args.pipeline, make_tracker(args.tracker, **params), args.min_confidence)
+            result.update({"trace": path, "variant": variant_name(args.tracker, params)})
+            if truth:
+                truth_counts, crossings = truth
+                accuracy = score_counts(result['counts'], truth_counts)
+                if crossings is not None:
+                    accuracy.update(match_events(result['events'], crossings, args.tolerance))
+                result['accuracy'] = accuracy
+            results.append(result)
+            f1 = result.get('accuracy', {}).get('f1')
+            print(f"{os.path.basename(path):24} {result['variant']:40} {result['counts']['towards']:>8} "
+                  f"{result['counts']['away']:>6} {result['detections_per_second'] or 0:>12.0f} "
+                  f"{f1 if f1 is not None else '-':>6}", file=sys.stderr)
+
+    text = json.dumps({"results": results}, indent=2, sort_keys=True)
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, 'w') as f:
+            f.write(text + "\n")
+    return results
+
+
+if __name__ == "__main__":
+    main()
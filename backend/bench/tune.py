@@ -0,0 +1,326 @@
+"""
+Per-feed auto-tuner. Finds the detector model, YOLO input size, frame sampling and
+confidence threshold that count a feed's cars most accurately while keeping up with its
+target FPS on this machine, and writes them into the feed's `tuning` block in the feeds
+config, which car_counter and multicam read on start. Run from the backend directory:
+
+    python -m bench.tune 1 --seconds 60
+    python -m bench.tune 1 --sample bench/gate2.mp4 --ground-truth bench/gate2.crossings.json
+
+A short sample is recorded from the feed's camera, unless one is given, and every model
+runs over it once per input size, on every frame at the lowest threshold, timing each
+inference. Thresholds and sampling rates do not change what the model sees, so they are
+searched by replaying those detections through tracking and counting, as trace_replay
+does, in milliseconds per setting instead of a pass of the model each.
+
+Crossings are scored against annotated ground truth, with frame indices of the sample,
+or without one against the most thorough setting: the last model at the largest input
+size on every frame. A setting meets the target when the inferences per second it needs,
+its sampled frame rate capped at the target FPS, fit in what this machine measured for
+it. Of the Pareto-optimal settings, those no other setting beats on both speed and
+accuracy, the most accurate one that meets the target is written.
+"""
+import argparse
+import json
+import math
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+from services import car_counter
+from services import multicam
+from services import feeds_service
+from services.counter import ParkingCounter
+from services.detector import CarDetector
+from services.offline import RecordingCounterState, RecordingParkingCounter, iter_frames, percentiles, PROCESS_SIZE
+from services.scheduler import DEFAULT_TARGET_FPS
+from services.synthetic import open_capture
+from services.tracker import CentroidTracker
+from services.zones import ZoneSet
+from bench.replay import load_ground_truth, match_events, score_counts
+
+# Inferences timed before the measured ones, so model warm-up does not count against a setting
+WARMUP_FRAMES = 3
+
+
+def find_feed(feed_id):
+    for feed in feeds_service.get_all_feeds()['feeds']:
+        if feed.get('id') == feed_id:
+            return feed
+    raise SystemExit(f"No feed with id {feed_id}")
+
+
+def record_sample(source, path, seconds):
+    """Record `seconds` of a camera to a video file; returns its frame rate"""
+    cap = open_capture(source)
+    if not cap.isOpened():
+        raise SystemExit(f"Could not open video source: {source}")
+    fps = cap.get(cv2.CAP_PROP_FPS) or 15.0
+    writer = None
+    try:
+        for _ in range(int(seconds * fps)):
+            ret, frame = cap.read()
+            if not ret:
+                break
+            if writer is None:
+                writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), fps, frame.shape[1::-1])
+            writer.write(frame)
+    finally:
+        cap.release()
+        if writer is not None:
+            writer.release()
+    if writer is None:
+        raise SystemExit(f"No frames could be read from {source}")
+    return fps
+
+
+def sample_fps(path):
+    cap = open_capture(path)
+    try:
+        return cap.get(cv2.CAP_PROP_FPS) or 15.0
+    finally:
+        cap.release()
+
+
+def detect_sample(path, detector, max_frames=None):
+    """
+    Detections of every frame of the sample, as (frame index, boxes, confidences), and
+    the seconds each inference took, warm-up excluded
+    """
+    width, height = PROCESS_SIZE
+    work = np.empty((height, width, 3), np.uint8)
+    detections = []
+    seconds = []
+    for index, frame in iter_frames(path, end_frame=max_frames):
+        frame = cv2.resize(frame, PROCESS_SIZE, dst=work)
+        started = time.perf_counter()
+        boxes, scores = detector.detect_cars_with_scores(frame)
+        seconds.append(time.perf_counter() - started)
+        detections.append((index, boxes, scores))
+    return detections, seconds[WARMUP_FRAMES:] or seconds
+
+
+def count_crossings(detections, pipeline, zones, conf, stride):
+    """
+    Crossing events when the detections at or below `conf` are dropped and only every
+    `stride`th frame is processed, and the mean seconds tracking and counting took per frame
+    """
+    events = []
+    tracker = CentroidTracker(max_disappeared=10)
+    if pipeline == "counter":
+        state = RecordingCounterState(events)
+        parking_counter = ParkingCounter(0, 0)
+    else:
+        parking_counter = RecordingParkingCounter(0, 0, events)
+    frames = 0
+    started = time.perf_counter()
+    for index, boxes, scores in detections:
+        if (index + 1) % stride != 0:
+            continue
+        detected_cars = [box for box, score in zip(boxes, scores) if score > conf]
+        if pipeline == "counter":
+            state.frame_index = index
+            car_counter.update_counts(detected_cars, tracker, parking_counter, state, zones)
+        else:
+            parking_counter.frame_index = index
+            multicam.update_counts(detected_cars, tracker, parking_counter, zones)
+        frames += 1
+    return events, (time.perf_counter() - started) / max(frames, 1)
+
+
+def count_events(events):
+    counts = {"towards": 0, "away": 0}
+    for event in events:
+        counts[event["direction"]] += 1
+    return counts
+
+
+def score(events, truth_counts, crossings, tolerance):
+    counts = count_events(events)
+    accuracy = score_counts(counts, truth_counts)
+    if crossings is not None:
+        accuracy.update(match_events(events, crossings, tolerance))
+    # Crossings matched in time when they are known, the totals otherwise
+    accuracy["score"] = accuracy.get("f1", accuracy["count_accuracy"])
+    return counts, accuracy
+
+
+def pareto_front(settings):
+    """The settings no other setting is at least as fast and as accurate as, and better at one"""
+    front = []
+    for setting in settings:
+        dominated = any(
+            other["capacity_fps"] >= setting["capacity_fps"] and other["accuracy"]["score"] >= setting["accuracy"]["score"]
+            and (other["capacity_fps"] > setting["capacity_fps"] or other["accuracy"]["score"] > setting["accuracy"]["score"])
+            for other in settings)
+        if not dominated:
+            front.append(setting)
+    return sorted(front, key=lambda s: s["capacity_fps"])
+
+
+def tune(feed, sample, source_fps, options):
+    pipeline = feed['type']
+    zones = ZoneSet.from_config(feed.get('zones'), PROCESS_SIZE)
+    target_fps = options['target_fps'] or feed.get('target_fps', DEFAULT_TARGET_FPS.get(pipeline, 5))
+    lowest_conf = min(options['confs'])
+
+    # One pass of the model per model and input size, keeping every detection above the lowest threshold
+    passes = []
+    for model in options['models']:
+        detector = CarDetector(model)
+        detector.load_model()
+        detector.conf = min(lowest_conf, options['reference_conf'])
+        for imgsz in options['imgsz']:
+            detector.imgsz = imgsz
+            print(f"Detecting with {model} at {imgsz}px...", file=sys.stderr)
+            detections, seconds = detect_sample(sample, detector, options['max_frames'])
+            passes.append({"model": model, "imgsz": imgsz, "detections": detections, "seconds": seconds})
+
+    if options['ground_truth']:
+        truth_counts, crossings = load_ground_truth(options['ground_truth'])
+    else:
+        reference = max(passes[-len(options['imgsz']):], key=lambda p: p["imgsz"])
+        events, _ = count_crossings(reference["detections"], pipeline, zones, options['reference_conf'], 1)
+        truth_counts, crossings = count_events(events), events
+        print(f"Reference {reference['model']} at {reference['imgsz']}px on every frame counted {truth_counts}",
+              file=sys.stderr)
+
+    settings = []
+    seen = set()
+    for run in passes:
+        inference = float(np.mean(run["seconds"])) if run["seconds"] else 0.0
+        for frame_skip in options['frame_skips']:
+            # Live, a feed takes a frame once `frame_skip` new ones arrived and it is due at its target FPS
+            stride = max(frame_skip, int(round(source_fps / target_fps)))
+            for conf in options['confs']:
+                key = (run["model"], run["imgsz"], stride, conf)
+                if key in seen:
+                    continue
+                seen.add(key)
+                events, tracking = count_crossings(run["detections"], pipeline, zones, conf, stride)
+                counts, accuracy = score(events, truth_counts, crossings, options['tolerance'])
+                capacity = 1 / (inference + tracking) if inference + tracking else float("inf")
+                required = source_fps / stride
+                settings.append({
+                    "model": run["model"],
+                    "imgsz": run["imgsz"],
+                    "frame_skip": frame_skip,
+                    "conf": conf,
+                    "required_fps": round(required, 2),
+                    "capacity_fps": round(capacity, 2),
+                    "meets_target": capacity >= required,
+                    "inference": percentiles(run["seconds"]),
+                    "counts": counts,
+                    "accuracy": accuracy,
+                })
+
+    front = pareto_front(settings)
+    eligible = [s for s in front if s["meets_target"]]
+    best = max(eligible, key=lambda s: (s["accuracy"]["score"], s["capacity_fps"])) if eligible else None
+    return {
+        "feed_id": feed['id'],
+        "pipeline": pipeline,
+        "sample": sample,
+        "source_fps": source_fps,
+        "target_fps": target_fps,
+        "ground_truth": options['ground_truth'],
+        "expected": truth_counts,
+        "settings": settings,
+        "pareto": front,
+        "best": best,
+    }
+
+
+def tuning_block(result):
+    best = result["best"]
+    return {
+        "model": best["model"],
+        "imgsz": best["imgsz"],
+        "frame_skip": best["frame_skip"],
+        "conf": best["conf"],
+        "target_fps": result["target_fps"],
+        "capacity_fps": best["capacity_fps"],
+        "accuracy": best["accuracy"]["score"],
+        "scored_against": "ground_truth" if result["ground_truth"] else "reference",
+        "tuned_at": datetime.now().isoformat(timespec="seconds"),
+    }
+
+
+def print_front(result):
+    print(f"{'model':14} {'imgsz':>5} {'skip':>4} {'conf':>5} {'fps':>8} {'needs':>6} {'score':>6}", file=sys.stderr)
+    for s in result["pareto"]:
+        mark = " *" if s is result["best"] else ("" if s["meets_target"] else "  too slow")
+        print(f"{s['model']:14} {s['imgsz']:>5} {s['frame_skip']:>4} {s['conf']:>5.2f} {s['capacity_fps']:>8.1f} "
+              f"{s['required_fps']:>6.1f} {s['accuracy']['score']:>6.3f}{mark}", file=sys.stderr)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Tune a feed's detector and sampling for accuracy at its target FPS.")
+    parser.add_argument("feed_id", type=int, help="Feed to tune, by its id in the feeds config")
+    parser.add_argument("--sample", help="Recorded clip of the feed to tune on, instead of recording one")
+    parser.add_argument("--seconds", type=float, default=30, help="Length of the sample to record, or to use of --sample")
+    parser.add_argument("--ground-truth", help="Crossings of the sample to score against (default: the reference setting)")
+    parser.add_argument("--target-fps", type=float, default=None,
+                        help="Inferences per second the feed must sustain (default: the feed's target_fps)")
+    parser.add_argument("--models", nargs="+", default=["yolov8n.pt", "yolov8s.pt", "yolov8m.pt"],
+                        help="Candidate models, smallest first; the last is the reference")
+    parser.add_argument("--imgsz", type=int, nargs="+", default=[320, 416, 512, 640], help="Candidate YOLO input sizes")
+    parser.add_argument("--frame-skip", type=int, nargs="+", default=[1, 2, 3, 4, 6], help="Candidate sampling rates")
+    parser.add_argument("--conf", type=float, nargs="+", default=[0.3, 0.4, 0.5, 0.6],
+                        help="Candidate confidence thresholds")
+    parser.add_argument("--reference-conf", type=float, default=0.5, help="Confidence threshold of the reference setting")
+    parser.add_argument("--tolerance", type=int, default=15, help="Frames an event may be off from the ground truth")
+    parser.add_argument("--out", help="Write the JSON report here")
+    parser.add_argument("--dry-run", action="store_true", help="Report the best setting without writing it to the config")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    feed = find_feed(args.feed_id)
+    if feed.get('occupancy') or feed.get('tiling'):
+        raise SystemExit(f"Feed {args.feed_id} uses slot occupancy or tiling, which counting accuracy cannot score")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.sample:
+            sample = args.sample
+            source_fps = sample_fps(sample)
+        else:
+            sample = os.path.join(tmp, f"feed{args.feed_id}.mp4")
+            print(f"Recording {args.seconds:g}s of {feed['video_source']}...", file=sys.stderr)
+            source_fps = record_sample(feed['video_source'], sample, args.seconds)
+        options = {
+            "models": args.models,
+            "imgsz": sorted(args.imgsz),
+            "frame_skips": sorted(args.frame_skip),
+            "confs": sorted(args.conf),
+            "reference_conf": args.reference_conf,
+            "target_fps": args.target_fps,
+            "ground_truth": args.ground_truth,
+            "tolerance": args.tolerance,
+            "max_frames": int(math.ceil(args.seconds * source_fps)),
+        }
+        result = tune(feed, sample, source_fps, options)
+
+    print_front(result)
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, 'w') as f:
+            f.write(json.dumps(result, indent=2, sort_keys=True) + "\n")
+    if result["best"] is None:
+        raise SystemExit(f"No setting reaches {result['target_fps']:g} FPS on this machine; "
+                         "try smaller models or input sizes, or a lower --target-fps")
+    if not args.dry_run:
+        tuning = tuning_block(result)
+        feeds_service.update_existing_feed(args.feed_id, {"tuning": tuning})
+        print(f"Wrote the tuning of feed {args.feed_id}: {tuning}", file=sys.stderr)
+    return result
+
+
+if __name__ == "__main__":
+    main()
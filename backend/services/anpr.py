@@ -1,20 +1,37 @@
 import cv2
-import easyocr
 import numpy as np
 from datetime import datetime
 from ultralytics import YOLO
 import os
 import csv
+import heapq
+import itertools
 import json
-import queue
+import multiprocessing
 import threading
 import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from threading import Lock
-from detector import CarDetector  # Assumes this file exists with detect_cars()
-from google_sheets import update_google_sheet  # Your custom Google Sheets module
-
-# Load configuration for video feeds
-CONFIG_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__),'..', 'config', 'feeds_config.json'))
+from .google_sheets import update_google_sheet  # Your custom Google Sheets module
+from .plate_consensus import PlateDedupeIndex, fuse_reads
+from .ocr_backends import ocr_settings_key, share_remote_limits, tiered_ocr_from_settings
+from .plate_cache import plate_cache_from_settings, plate_hash
+from .plate_images import PlateImageStore
+from .plate_store import plate_store
+from .events import event_bus, PlateEvent
+from .metrics import (registry, observe_stage, start_http_server, QUEUE_DEPTH, ANPR_DROPPED, ANPR_SPILLED,
+                      ANPR_PROCESSED, ANPR_BATCH_SIZE)
+
+# Plate images and the plate log live next to this module
+SERVICE_DIR = os.path.dirname(os.path.abspath(__file__))
+OUTPUT_DIR = os.path.join(SERVICE_DIR, "plates_detected")
+LOG_FILE = os.path.join(SERVICE_DIR, "plates_log.csv")
+SPOOL_DIR = os.path.join(SERVICE_DIR, "anpr_spool")
+CONFIG_PATH = os.environ.get('FEEDS_CONFIG', os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'config', 'feeds_config.json')))
+
+# Crossing directions of the counter pipeline as ANPR directions
+DIRECTIONS = {"towards": "enter", "away": "exit"}
 
 
 class PlateDetector:
@@ -26,41 +43,19 @@ class PlateDetector:
         self.model = YOLO(absolute_model_path)
 
     def detect_plates(self, car_crop):
-        results = self.model(car_crop, verbose=False)
-        plates = []
+        return self.detect_plates_batch([car_crop])[0]
+
+    def detect_plates_batch(self, car_crops):
+        """Plate boxes for each of several car crops, from a single model call"""
+        results = self.model(list(car_crops), verbose=False)
+        batch = []
         for result in results:
+            plates = []
             for box in result.boxes.xyxy.cpu().numpy():
                 x1, y1, x2, y2 = map(int, box)
                 plates.append((x1, y1, x2, y2))
-        return plates
-
-class SimpleTracker:
-    """A simple object tracker to assign and maintain IDs for detected cars."""
-    def __init__(self):
-        self.next_id = 0
-        self.objects = {}
-
-    def update(self, detections):
-        updated = {}
-        for (x1, y1, x2, y2) in detections:
-            cx, cy = (x1 + x2) // 2, (y1 + y2) // 2
-            matched_id = None
-            min_dist = float('inf')
-            for obj_id, (px, py, *_) in self.objects.items():
-                dist = np.sqrt((cx - px)**2 + (cy - py)**2)
-                if dist < min_dist and dist < 50: # Using the original distance threshold
-                    min_dist = dist
-                    matched_id = obj_id
-
-            if matched_id is None:
-                matched_id = self.next_id
-                self.next_id += 1
-
-            prev_cy = self.objects[matched_id][1] if matched_id in self.objects else cy
-            updated[matched_id] = (cx, cy, x1, y1, x2, y2, prev_cy)
-
-        self.objects = updated
-        return self.objects
+            batch.append(plates)
+        return batch
 
 def scale_plate_image(plate_image):
     """
@@ -77,202 +72,583 @@ def scale_plate_image(plate_image):
     interpolation = cv2.INTER_CUBIC
     return cv2.resize(plate_image, (target_width, target_height), interpolation=interpolation)
 
-def ocr_and_clean_plate(image, reader):
+
+class PlateRecognizer:
     """
-    Performs OCR on an image using EasyOCR and cleans the result.
-    This version is lenient and will try to find at least 4 digits.
+    Plate detection and OCR over micro-batches of car crops. Every crop can name its own
+    OCR settings (see ocr_backends.py); crops that share settings are read together.
+    Plates that look like one read recently are answered from `cache` without OCR.
     """
-    try:
-        result = reader.readtext(image)
-        if result:
-            # Take the most confident reading
-            text = result[0][1]
-            cleaned = ''.join(filter(str.isalnum, text)).strip().upper()
-            
-            # Reverted to more lenient 4-character logic
-            if len(cleaned) >= 4:
-                return cleaned
-            else:
-                # Fallback for very short or messy reads: find the last 4 digits
-                digits = ''.join(filter(str.isdigit, cleaned))
-                return digits[-4:] if len(digits) >= 4 else ""
-        return ""
-    except Exception as e:
-        print(f"⚠️ [Worker] EasyOCR error: {e}")
-        return ""
-
-def processing_worker(q, plate_detector_worker, reader_worker, output_dir_worker, log_file_worker):
+    def __init__(self, cache=None):
+        self.plate_detector = PlateDetector()
+        self.cache = cache
+        self._ocr = {}  # settings key -> TieredOcr
+
+    def ocr_for(self, settings):
+        key = ocr_settings_key(settings)
+        if key not in self._ocr:
+            self._ocr[key] = tiered_ocr_from_settings(settings)
+        return self._ocr[key]
+
+    def recognize(self, car_crops, ocr_settings=None):
+        """For every car crop, the [(plate_text, confidence, scaled plate image)] of the plates in it"""
+        started = time.monotonic()
+        plate_boxes = self.plate_detector.detect_plates_batch(car_crops)
+        detected = time.monotonic()
+        observe_stage("anpr", "plate_detect", detected - started)
+
+        owners = []
+        scaled_plates = []
+        for i, (car_crop, boxes) in enumerate(zip(car_crops, plate_boxes)):
+            for (px1, py1, px2, py2) in boxes:
+                plate_crop = car_crop[py1:py2, px1:px2]
+                if plate_crop.size == 0:
+                    continue
+                scaled_plate = scale_plate_image(plate_crop)
+                if scaled_plate is None:
+                    continue
+                owners.append(i)
+                scaled_plates.append(scaled_plate)
+
+        # Answer near-identical plates from the cache, then read the rest of the plates
+        # of all crops that use the same OCR settings in one go
+        texts = [None] * len(scaled_plates)
+        hashes = [None] * len(scaled_plates)
+        if self.cache is not None:
+            for n, scaled_plate in enumerate(scaled_plates):
+                hashes[n] = plate_hash(scaled_plate)
+                texts[n] = self.cache.get(hashes[n])
+        ocr_settings = ocr_settings or [None] * len(car_crops)
+        groups = {}
+        for n, i in enumerate(owners):
+            if texts[n] is None:
+                groups.setdefault(ocr_settings_key(ocr_settings[i]), []).append(n)
+        for members in groups.values():
+            ocr = self.ocr_for(ocr_settings[owners[members[0]]])
+            for n, read in zip(members, ocr.read_batch([scaled_plates[n] for n in members])):
+                texts[n] = read
+                # Unreadable plates are not cached, so a better view can still be read
+                if self.cache is not None and read[0]:
+                    self.cache.put(hashes[n], read)
+        observe_stage("anpr", "ocr", time.monotonic() - detected)
+        reads = [[] for _ in car_crops]
+        for i, (text, confidence), scaled_plate in zip(owners, texts, scaled_plates):
+            reads[i].append((text, confidence, scaled_plate))
+        return reads
+
+
+# In process mode every worker process holds its own recognizer
+_process_recognizer = None
+
+
+def _init_process_recognizer(cache_settings, processes):
+    global _process_recognizer
+    share_remote_limits(processes)
+    _process_recognizer = PlateRecognizer(plate_cache_from_settings(cache_settings))
+
+
+def _recognize_in_process(car_crops, ocr_settings):
+    return _process_recognizer.recognize(car_crops, ocr_settings)
+
+
+def consensus_read(crop_reads):
     """
-    Worker function to handle all slow operations in the background.
-    This prevents the main video feed from freezing.
+    The one (plate_text, confidence, scaled plate image) to record for a car, fused from
+    the reads of all its crops, best crop first. The image is the most confident read
+    that agrees with the fused text, else the first unreadable plate so it can be
+    reviewed. None if no crop showed a plate.
     """
-    while True:
+    plates = [plate for reads in crop_reads for plate in reads]
+    if not plates:
+        return None
+    text, confidence = fuse_reads([(plate[0], plate[1]) for plate in plates])
+    if not text:
+        return "", 0.0, plates[0][2]
+    agreeing = [plate for plate in plates if plate[0] == text]
+    image = max(agreeing or plates, key=lambda plate: plate[1])[2]
+    return text, confidence, image
+
+
+def record_plate(task, plate_text, confidence, scaled_plate, images):
+    """
+    Queue the plate image for saving, then publish the read; the plate store, Google
+    Sheets and the CSV log pick it up from the event bus
+    """
+    location_name = task['location']
+    timestamp = task['timestamp']
+
+    # Only queued here; the image store's thread encodes and writes it
+    image_name = images.save(scaled_plate, timestamp)
+
+    if not plate_text:
+        print(f"ℹ️ [Worker] Plate at {location_name} was unreadable. Image {image_name} kept for review.")
+        return
+
+    print(f"✅ [Worker] Recognized: {plate_text}")
+    event_bus.publish(PlateEvent(task['feed_id'], plate_text, location_name, task['direction'],
+                                 confidence=confidence, image=image_name, at=timestamp))
+
+
+def store_plates(events):
+    for event in events:
+        plate_store.add(event.plate, event.location, event.direction, when=event.at, confidence=event.confidence,
+                        feed_id=event.feed_id, image=event.image)
+
+
+def send_plates_to_sheet(events):
+    for event in events:
         try:
-            car_crop, direction, location_name = q.get()
-            
-            # --- Step A: Detect Plate (Local YOLO model) ---
-            plates = plate_detector_worker.detect_plates(car_crop)
-            for (px1, py1, px2, py2) in plates:
-                plate_crop = car_crop[py1:py2, px1:px2]
-                if plate_crop.size == 0: continue
-                
-                scaled_plate = scale_plate_image(plate_crop)
-                if scaled_plate is None: continue
-
-                # --- Step B: Save Image First for Resilience ---
-                timestamp = datetime.now()
-                ts_str_file = timestamp.strftime("%Y%m%d_%H%M%S_%f")
-                temp_img_name = f"plate_{location_name}_{ts_str_file}.jpg"
-                img_path = os.path.join(output_dir_worker, temp_img_name)
-                cv2.imwrite(img_path, scaled_plate)
-                print(f"📸 [Worker] Plate image saved to {img_path}")
-
-                # --- Step C: Recognize Plate (Slow Local OCR) ---
-                plate_text = ocr_and_clean_plate(scaled_plate, reader_worker)
-                
-                # --- Step D: Log and Finalize ---
-                if plate_text:
-                    print(f"✅ [Worker] EasyOCR recognized: {plate_text}")
-                    ts_str_log = timestamp.strftime("%Y-%m-%d %H:%M:%S")
-
-                    with open(log_file_worker, 'a', newline='') as f:
-                        writer = csv.writer(f)
-                        writer.writerow([ts_str_log, plate_text, location_name, direction])
-                    
-                    final_img_name = f"{plate_text}_{ts_str_file}.jpg"
-                    final_img_path = os.path.join(output_dir_worker, final_img_name)
-                    try:
-                        os.rename(img_path, final_img_path)
-                        print(f"📝 [Worker] Renamed image to {final_img_path}")
-                    except OSError as e:
-                        print(f"⚠️ [Worker] Could not rename image: {e}")
-
-                    try:
-                        update_google_sheet(plate_text, status=direction, location=location_name)
-                    except Exception as e:
-                        print(f"⚠️ [Worker] Google Sheet update failed: {e}")
+            update_google_sheet(event.plate, status=event.direction, location=event.location, when=event.at)
+        except Exception as e:
+            print(f"⚠️ [Worker] Google Sheet update failed: {e}")
+
+
+def plate_log_writer(log_file):
+    """Event sink appending plate reads to a CSV log, one open per batch"""
+    def write(events):
+        with open(log_file, 'a', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerows([event.at.strftime("%Y-%m-%d %H:%M:%S"), event.plate, event.location, event.direction]
+                             for event in events)
+    return write
+
+
+class PlateQueue:
+    """
+    Bounded priority queue of ANPR tasks: higher priority feeds first, then older
+    crossings first. When the in-memory part is full, tasks are spilled to disk instead
+    of being dropped and come back into memory as workers free up space. Spilled tasks
+    left over from a previous run are picked up again on start.
+
+    Disk is only touched by the queue's spool thread, which writes tasks waiting to be
+    spilled and reads spilled ones back; `put` and `get_batch` only move tasks in
+    memory, so a counter frame loop submitting a car never waits on a PNG encode or
+    on a refill. Up to `spill_backlog` tasks may wait to be written before new ones are
+    dropped.
+    """
+    def __init__(self, capacity, spool_dir, spill_backlog=500):
+        self.capacity = capacity
+        self.spill_backlog = spill_backlog
+        self.spool_dir = spool_dir
+        self._heap = []
+        self._to_spill = deque()  # tasks waiting for the spool thread to write them
+        self._spilled = deque()  # paths of tasks on disk, oldest first
+        self._in_flight = 0  # tasks the spool thread is writing or reading
+        self._order = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stop_event = None
+
+    def __len__(self):
+        with self._cond:
+            return len(self._heap) + self._waiting()
+
+    def _waiting(self):
+        return len(self._to_spill) + len(self._spilled) + self._in_flight
+
+    def depth(self):
+        """(tasks in memory, tasks spilled or on their way to disk)"""
+        with self._cond:
+            return len(self._heap), self._waiting()
+
+    def start(self):
+        with self._cond:
+            if self._thread is None:
+                self._stop_event = threading.Event()
+                self._thread = threading.Thread(target=self._spool, args=(self._stop_event,), name="anpr-spool",
+                                                daemon=True)
+                self._thread.start()
+
+    def stop(self, timeout=10):
+        """Stop the spool thread once it has written the tasks waiting to be spilled"""
+        with self._cond:
+            thread, self._thread = self._thread, None
+            if thread is None:
+                return
+            self._stop_event.set()
+            self._cond.notify_all()
+        thread.join(timeout)
+
+    def recover(self):
+        """Queue the tasks spilled by a previous run that did not get to them"""
+        if not os.path.isdir(self.spool_dir):
+            return 0
+        names = sorted(name for name in os.listdir(self.spool_dir) if name.endswith(".json"))
+        with self._cond:
+            known = set(self._spilled)
+            paths = [os.path.join(self.spool_dir, name) for name in names]
+            paths = [path for path in paths if path not in known]
+            self._spilled.extendleft(reversed(paths))
+            self._cond.notify_all()
+        return len(paths)
+
+    def put(self, task):
+        """Queue a task; returns "queued", "spilled", or "dropped" if too many wait to be spilled"""
+        with self._cond:
+            if len(self._heap) < self.capacity and not self._waiting():
+                self._push(task)
+                return "queued"
+            if len(self._to_spill) >= self.spill_backlog:
+                return "dropped"
+            self._to_spill.append(task)
+            self._cond.notify_all()
+            return "spilled"
+
+    def _push(self, task):
+        heapq.heappush(self._heap, (-task['priority'], next(self._order), task))
+        self._cond.notify_all()
+
+    def _spool(self, stop_event):
+        """The spool thread: read spilled tasks back while memory has room, write the others out"""
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: stop_event.is_set() or self._to_spill
+                                    or (self._spilled and len(self._heap) < self.capacity))
+                if stop_event.is_set():
+                    pending = list(self._to_spill)
+                    self._to_spill.clear()
+                    self._in_flight += len(pending)
+                    break
+                reading = bool(self._spilled) and len(self._heap) < self.capacity
+                if reading:
+                    path = self._spilled.popleft()
+                elif not self._spilled and not self._in_flight and len(self._heap) < self.capacity:
+                    # Room again before the task reached disk: skip the round trip
+                    self._push(self._to_spill.popleft())
+                    continue
                 else:
-                    print(f"ℹ️ [Worker] Plate at {img_path} was unreadable. Image kept for review.")
+                    task = self._to_spill.popleft()
+                self._in_flight += 1
 
-        except queue.Empty:
-            continue
-        except Exception as e:
-            print(f"💥 [Worker] Error processing task: {e}")
-        finally:
-            q.task_done()
-
-# ---- Main Execution ----
-car_detector = CarDetector()
-car_detector.load_model()
-plate_detector = PlateDetector()
-# Initialize EasyOCR reader once
-reader = easyocr.Reader(['en'])
-
-output_dir = "plates_detected"
-os.makedirs(output_dir, exist_ok=True)
-log_file = "plates_log.csv"
-if not os.path.isfile(log_file):
-    with open(log_file, 'w', newline='') as f:
-        writer = csv.writer(f)
-        writer.writerow(['timestamp', 'license_plate', 'location', 'direction'])
-
-# --- Setup for worker thread ---
-# The queue acts as a buffer between the fast main loop and the slow worker.
-processing_queue = queue.Queue(maxsize=50)
-worker_args = (plate_detector, reader, output_dir, log_file)
-processing_thread = threading.Thread(target=processing_worker, args=(processing_queue,) + worker_args, daemon=True)
-processing_thread.start()
-print("🚀 Processing worker thread started.")
-
-with open(CONFIG_PATH, 'r') as f:
-    anpr_config = json.load(f)
-
-counter_feeds = [feed for feed in anpr_config['feeds'] if feed['type'] == 'counter']
-caps = []
-feed_info = []
-for feed in counter_feeds:
-    source = feed['video_source']
-    if isinstance(source, str) and not source.isnumeric():
-        source = os.path.abspath(os.path.join(os.path.dirname(CONFIG_PATH), '..', source))
-    else:
-        source = int(source)
-
-    cap = cv2.VideoCapture(source)
-    if not cap.isOpened():
-        print(f"❌ Error: Could not open video source '{source}'")
-        continue
-    caps.append(cap)
-    feed_info.append({
-        'id': feed['id'], 'name': feed['name'],
-        'frame_width': int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
-        'frame_height': int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
-        'line_y': int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)) // 2,
-        'tracker': SimpleTracker(), # Each feed gets its own tracker
-        'processed_car_ids': set()
-    })
-
-if not caps:
-    print("No video feeds to process. Exiting.")
-    exit()
-
-print("🟢 Starting video feeds... Press 'q' or Ctrl+C to exit.")
-while True:
-    try:
-        active_feeds_count = 0
-        for i, cap in enumerate(caps):
-            ret, frame = cap.read()
-            if not ret:
-                if cap.get(cv2.CAP_PROP_POS_FRAMES) > 0 and cap.get(cv2.CAP_PROP_POS_FRAMES) >= cap.get(cv2.CAP_PROP_FRAME_COUNT):
-                    cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            if reading:
+                task = self._unspill(path)
+            else:
+                path = self._spill(task)
+            with self._cond:
+                self._in_flight -= 1
+                if reading or path is None:
+                    # Read back, or could not be written: kept in memory rather than losing the car
+                    if task is not None:
+                        self._push(task)
+                else:
+                    self._spilled.append(path)
+                self._cond.notify_all()
+
+        # Stopping: nothing drains memory any more, so write out what waits to be spilled
+        # for a restart, or the next run's recover(), to pick up
+        for task in pending:
+            path = self._spill(task)
+            with self._cond:
+                self._in_flight -= 1
+                if path is None:
+                    self._push(task)
+                else:
+                    self._spilled.append(path)
+                self._cond.notify_all()
+
+    def _spill(self, task):
+        try:
+            os.makedirs(self.spool_dir, exist_ok=True)
+            stem = os.path.join(self.spool_dir, f"{time.time_ns()}_{task['feed_id']}")
+            for i, crop in enumerate(task['car_crops']):
+                # Fast compression: spilled crops live briefly, and the spool thread must keep up
+                if not cv2.imwrite(f"{stem}_{i}.png", crop, [cv2.IMWRITE_PNG_COMPRESSION, 1]):
+                    return None
+            meta = {k: v for k, v in task.items() if k != 'car_crops'}
+            meta['crops'] = len(task['car_crops'])
+            meta['timestamp'] = task['timestamp'].isoformat()
+            with open(stem + ".json", 'w') as f:
+                json.dump(meta, f)
+            return stem + ".json"
+        except (OSError, cv2.error) as e:
+            print(f"⚠️ Could not spill ANPR task to disk, keeping it in memory: {e}")
+            return None
+
+    def _unspill(self, path):
+        """Load a spilled task and remove its files; None if it could not be read"""
+        stem = path[:-len(".json")]
+        try:
+            with open(path, 'r') as f:
+                task = json.load(f)
+            images = [f"{stem}_{i}.png" for i in range(task.pop('crops'))]
+            task['car_crops'] = [crop for crop in map(cv2.imread, images) if crop is not None]
+            task['timestamp'] = datetime.fromisoformat(task['timestamp'])
+        except (OSError, ValueError, KeyError) as e:
+            print(f"⚠️ Could not read spilled ANPR task {path}: {e}")
+            task, images = None, []
+        for leftover in [path] + images:
+            try:
+                os.remove(leftover)
+            except OSError:
+                pass
+        return task if task is not None and task['car_crops'] else None
+
+    def get_batch(self, max_items, max_wait, timeout=1.0):
+        """
+        Wait up to `timeout` for a task, then keep collecting for up to `max_wait`
+        seconds or until `max_items` are gathered. Returns a possibly empty list.
+        """
+        batch = []
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._heap, timeout=timeout):
+                return batch
+            deadline = time.monotonic() + max_wait
+            while len(batch) < max_items:
+                if not self._heap:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0 or not self._cond.wait_for(lambda: self._heap, timeout=remaining):
+                        break
+                batch.append(heapq.heappop(self._heap)[2])
+            # Room in memory again: wake the spool thread to read spilled tasks back
+            self._cond.notify_all()
+        return batch
+
+
+class AnprService:
+    """
+    Reads the plates of cars crossing the counting line of counter feeds that have
+    `"anpr": true` in the feeds config. The counter pipeline hands over the best few full
+    resolution crops of every counted car once it leaves (see best_shot.py), so ANPR
+    needs no capture or car detection of its own. The pipeline only enqueues; a pool of
+    workers takes micro-batches of cars through plate detection and OCR, on threads or in
+    worker processes, and records one plate per car.
+
+    Optional settings under `anpr` in the feeds config:
+        workers        number of workers (default 2)
+        mode           "thread" or "process" (default "thread")
+        batch_size     most car crops per batch (default 8)
+        batch_wait_ms  how long a worker waits to fill a batch (default 50)
+        queue_size     cars held in memory before spilling to disk (default 200)
+        spill_backlog  cars waiting to be written to disk before new ones are dropped (default 500)
+        best_shots     crops kept per car for OCR (default 2)
+        dedupe_window_s  seconds within which a plate is logged once per location and
+                         direction (default 300; 0 logs every read)
+        dedupe_distance  characters two plates may differ by and still be the same car (default 1)
+        ocr            OCR tiers and escalation thresholds, see ocr_backends.py (default
+                       EasyOCR only); a feed can override it with an `ocr` block of its own
+        cache          reads of recent plates reused for near-identical crops, see
+                       plate_cache.py: {"max_entries", "ttl_s", "max_distance", "enabled"}
+        log_csv        also append every read to plates_log.csv (default false; reads are
+                       always kept in the plate store, see plate_store.py)
+        images         plate image retention, see plate_images.py: {"max_mb" (default 2048),
+                       "max_age_days" (default 30), "thumb_width" (default 160)}
+    """
+    def __init__(self, workers=2, mode="thread", batch_size=8, batch_wait_ms=50, queue_size=200, spill_backlog=500,
+                 best_shots=2, dedupe_window_s=300, dedupe_distance=1, ocr=None, cache=None, log_csv=False,
+                 images=None, output_dir=OUTPUT_DIR, log_file=LOG_FILE, spool_dir=SPOOL_DIR):
+        if mode not in ("thread", "process"):
+            raise ValueError(f"Unknown ANPR worker mode: {mode}")
+        self.workers = max(1, workers)
+        self.mode = mode
+        self.batch_size = max(1, batch_size)
+        self.batch_wait = batch_wait_ms / 1000.0
+        self.best_shots = max(1, best_shots)
+        self.dedupe = PlateDedupeIndex(dedupe_window_s, dedupe_distance) if dedupe_window_s > 0 else None
+        self.ocr = ocr
+        # Worker threads share one plate read cache; worker processes have one each
+        self.cache_settings = cache
+        self.cache = None
+        self.images = PlateImageStore.from_settings(output_dir, images)
+        self.log_file = log_file if log_csv else None
+        self.queue = PlateQueue(queue_size, spool_dir, spill_backlog)
+        self.feeds = {}  # feed_id -> {"location": name, "priority": priority, "ocr": settings}
+        self.threads = []
+        self.sinks = []
+        self.executor = None
+        self.running = False
+        self._lock = Lock()
+
+    @classmethod
+    def from_config(cls, config_path=CONFIG_PATH):
+        try:
+            with open(config_path, 'r') as f:
+                settings = json.load(f).get('anpr', {})
+        except (OSError, ValueError):
+            settings = {}
+        return cls(
+            workers=settings.get('workers', 2),
+            mode=settings.get('mode', "thread"),
+            batch_size=settings.get('batch_size', 8),
+            batch_wait_ms=settings.get('batch_wait_ms', 50),
+            queue_size=settings.get('queue_size', 200),
+            spill_backlog=settings.get('spill_backlog', 500),
+            best_shots=settings.get('best_shots', 2),
+            dedupe_window_s=settings.get('dedupe_window_s', 300),
+            dedupe_distance=settings.get('dedupe_distance', 1),
+            ocr=settings.get('ocr'),
+            cache=settings.get('cache'),
+            log_csv=settings.get('log_csv', False),
+            images=settings.get('images'),
+        )
+
+    def enable(self, feed):
+        """Start reading plates for a feed, loading the models on first use"""
+        self.feeds[feed['id']] = {
+            "location": feed['name'],
+            "priority": feed.get('priority', 0),
+            "ocr": feed.get('ocr', self.ocr),
+        }
+        self.start()
+
+    def disable(self, feed_id):
+        self.feeds.pop(feed_id, None)
+
+    def is_enabled(self, feed_id):
+        return feed_id in self.feeds
+
+    def start(self):
+        with self._lock:
+            if self.running:
+                return
+            self.images.start()
+            if self.log_file and not os.path.isfile(self.log_file):
+                with open(self.log_file, 'w', newline='') as f:
+                    writer = csv.writer(f)
+                    writer.writerow(['timestamp', 'license_plate', 'location', 'direction'])
+            if not self.sinks:
+                self._subscribe_sinks()
+
+            if self.mode == "thread":
+                self.cache = plate_cache_from_settings(self.cache_settings)
+            else:
+                # Spawned so the workers do not inherit the pipelines' threads and models
+                self.executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_process_recognizer,
+                    initargs=(self.cache_settings, self.workers),
+                )
+            self.queue.start()
+            recovered = self.queue.recover()
+            if recovered:
+                print(f"♻️ Recovered {recovered} spilled ANPR tasks.")
+
+            self.running = True
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._worker, name=f"anpr-worker-{i}", daemon=True)
+                thread.start()
+                self.threads.append(thread)
+            registry.add_collector(self._collect_metrics)
+            print(f"🚀 {self.workers} ANPR workers started ({self.mode} mode).")
+
+    def _subscribe_sinks(self):
+        """
+        Plate reads reach their sinks through the event bus. Workers may wait briefly
+        for a full sink queue, as dropping a read loses it for good.
+        """
+        sinks = {"plate-store": store_plates, "sheets": send_plates_to_sheet}
+        if self.log_file:
+            sinks["plates-csv"] = plate_log_writer(self.log_file)
+        for name, sink in sinks.items():
+            self.sinks.append(event_bus.subscribe(name, sink, types=(PlateEvent,), policy="block", block_timeout=5.0))
+
+    def stop(self):
+        self.running = False
+        for thread in self.threads:
+            thread.join(timeout=2)
+        self.threads = []
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+        self.queue.stop()
+        self.images.stop()
+
+    def submit(self, feed_id, car_crops, direction, crossed_at=None):
+        """
+        Queue the crops of one car that crossed the line, best first; a single crop is
+        fine too. Never blocks on a full queue: the car is spilled to disk instead.
+        Returns False only if it could not be kept at all.
+        """
+        feed = self.feeds.get(feed_id)
+        if isinstance(car_crops, np.ndarray):
+            car_crops = [car_crops]
+        car_crops = [crop for crop in car_crops if crop.size]
+        if feed is None or not car_crops:
+            return False
+        task = {
+            "feed_id": feed_id,
+            "location": feed['location'],
+            "priority": feed['priority'],
+            "direction": DIRECTIONS.get(direction, direction),
+            "timestamp": crossed_at or datetime.now(),
+            "car_crops": car_crops,
+            "ocr": feed['ocr'],
+        }
+        result = self.queue.put(task)
+        if result == "spilled":
+            ANPR_SPILLED.labels(feed_id).inc()
+        elif result == "dropped":
+            ANPR_DROPPED.labels(feed_id).inc()
+            print(f"⚠️ ANPR could not queue or spill a car from {feed['location']}.")
+            return False
+        return True
+
+    def _collect_metrics(self):
+        in_memory, spilled = self.queue.depth()
+        QUEUE_DEPTH.labels("anpr", "processing_queue").set(in_memory)
+        QUEUE_DEPTH.labels("anpr", "spilled").set(spilled)
+
+    def _worker(self):
+        """Take micro-batches off the queue and run them through the plate recognizer"""
+        recognizer = None
+        while self.running:
+            batch = self.queue.get_batch(self.batch_size, self.batch_wait)
+            if not batch:
+                continue
+            crops = [crop for task in batch for crop in task['car_crops']]
+            ocr_settings = [task.get('ocr') for task in batch for _ in task['car_crops']]
+            ANPR_BATCH_SIZE.labels().observe(len(crops))
+            try:
+                if self.executor is not None:
+                    reads = self.executor.submit(_recognize_in_process, crops, ocr_settings).result()
+                else:
+                    if recognizer is None:
+                        recognizer = PlateRecognizer(self.cache)
+                    reads = recognizer.recognize(crops, ocr_settings)
+            except Exception as e:
+                print(f"💥 [Worker] Error processing batch of {len(batch)}: {e}")
+                for task in batch:
+                    ANPR_PROCESSED.labels(task['feed_id'], "error").inc()
                 continue
-            
-            active_feeds_count += 1
-            current_feed_info = feed_info[i]
-            line_y = current_feed_info['line_y']
-            tracker = current_feed_info['tracker']
-            
-            # These are fast, local operations that don't block the video feed.
-            car_detections = car_detector.detect_cars(frame)
-            formatted_detections = [[x1, y1, x1 + w, y1 + h] for x1, y1, w, h in car_detections]
-            tracked_cars = tracker.update(formatted_detections)
-
-            for car_id, (cx, cy, x1, y1, x2, y2, prev_cy) in tracked_cars.items():
-                cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
-                cv2.putText(frame, f"ID: {car_id}", (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 2)
-
-                # --- FIX: Precise line-crossing logic to prevent multiple triggers ---
-                is_crossing_down = prev_cy < line_y and cy >= line_y
-                is_crossing_up = prev_cy > line_y and cy <= line_y
-
-                # This ensures a car ID is only processed ONCE per crossing.
-                if (is_crossing_down or is_crossing_up) and car_id not in current_feed_info['processed_car_ids']:
-                    direction = "enter" if is_crossing_down else "exit"
-                    current_feed_info['processed_car_ids'].add(car_id)
-                    
-                    car_crop = frame[y1:y2, x1:x2].copy()
-                    if car_crop.size > 0:
-                        try:
-                            # The only task here is to quickly add the job to the queue.
-                            task = (car_crop, direction, current_feed_info['name'])
-                            processing_queue.put_nowait(task)
-                            print(f"🚗 Car {car_id} *crossed line*. Queued for background processing from {current_feed_info['name']}.")
-                        except queue.Full:
-                            print(f"⚠️ Processing buffer is full. Dropping detection for car {car_id}.")
-
-            cv2.line(frame, (0, line_y), (current_feed_info['frame_width'], line_y), (255, 0, 0), 2)
-            cv2.imshow(f"License Plate Recognition - {current_feed_info['name']}", frame)
-
-        if active_feeds_count == 0 and len(caps) > 0:
-            print("All video feeds appear to have ended. Exiting.")
-            break
-
-        if cv2.waitKey(1) & 0xFF == ord('q'):
-            break
-    except KeyboardInterrupt:
-        print("\n🛑 Shutting down due to user interrupt.")
-        break
-
-for cap in caps:
-    cap.release()
-cv2.destroyAllWindows()
-print("Program finished.")
+
+            offset = 0
+            for task in batch:
+                count = len(task['car_crops'])
+                best = consensus_read(reads[offset:offset + count])
+                offset += count
+                if best is None:
+                    ANPR_PROCESSED.labels(task['feed_id'], "no_plate").inc()
+                    continue
+                plate_text, confidence, scaled_plate = best
+                if plate_text and self.dedupe is not None:
+                    duplicate_of = self.dedupe.check(plate_text, task['location'], task['direction'])
+                    if duplicate_of is not None:
+                        print(f"🔁 [Worker] {plate_text} at {task['location']} is a repeat of {duplicate_of}; not logged again.")
+                        ANPR_PROCESSED.labels(task['feed_id'], "duplicate").inc()
+                        continue
+                try:
+                    record_plate(task, plate_text, confidence, scaled_plate, self.images)
+                except Exception as e:
+                    print(f"💥 [Worker] Error recording plate: {e}")
+                ANPR_PROCESSED.labels(task['feed_id'], "read" if plate_text else "unread").inc()
+
+
+# This single service is shared by every counter feed with ANPR enabled
+anpr_service = AnprService.from_config()
+
+
+def main():
+    """
+    Run the counter pipelines headless with their ANPR stage and a /metrics endpoint of
+    their own, without the Flask app. Run from the backend directory: python -m services.anpr
+    Every counter feed reads plates here unless its config sets "anpr": false.
+    """
+    from . import car_counter
+    metrics_port = int(os.environ.get("ANPR_METRICS_PORT", "9101"))
+    start_http_server(metrics_port)
+    print(f"📈 Metrics available at http://localhost:{metrics_port}/metrics")
+    car_counter.main(anpr_default=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,711 @@
+"""
+Offline batch processing of archived recordings: no display, no pacing, and videos are
+spread over a pool of worker processes. Run from the backend directory:
+
+    python -m services.batch archive/2025-08-07/*.mp4 --out batch_out --workers 4 --plates
+
+Every video gets its own directory under --out with
+    events.csv     every line crossing (frame, seconds, direction)
+    occupancy.csv  the running count sampled every --occupancy-interval seconds
+                   (net cars counted for counter, available slots for multicam)
+    plates.csv     plate reads of crossing cars, with --plates
+    summary.json   written when the video is finished
+
+Progress is checkpointed every --checkpoint-interval seconds of video. An interrupted
+run started again with the same arguments skips finished videos and resumes the others
+from their last checkpoint, with no duplicated or missing rows.
+
+With --segments N every video is instead split at keyframes into N parts that the
+workers process in parallel, which is how a single long recording uses many cores:
+
+    python -m services.batch archive/gate2-24h.mp4 --out batch_out --workers 32 --segments 32
+
+Each part warms up its tracker over the --overlap seconds before it. The parts are
+stitched by comparing tracker states at every boundary and redoing any part whose
+warm-up did not converge, so the outputs equal those of a sequential run.
+"""
+import argparse
+import csv
+import hashlib
+import json
+import multiprocessing
+import os
+import pickle
+import re
+import shutil
+import subprocess
+import sys
+import time
+
+import cv2
+
+from .counter import ParkingCounter
+from .detector import CarDetector
+from .offline import OfflinePipeline, StageRecorder, iter_frames, DEFAULT_FRAME_SKIP, PROCESS_SIZE
+from .scheduler import configure_threads
+from .synthetic import open_capture
+from .utils import scale_box
+
+OUTPUT_HEADERS = {
+    "events": ["frame", "seconds", "direction"],
+    "plates": ["frame", "seconds", "direction", "license_plate", "image"],
+}
+OCCUPANCY_COLUMN = {"counter": "cars_counted", "multicam": "available_slots"}
+CHECKPOINT_FILE = "checkpoint.pkl"
+CONFIG_PATH = os.environ.get('FEEDS_CONFIG', os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'config', 'feeds_config.json')))
+SUMMARY_FILE = "summary.json"
+
+
+def full_path(path):
+    """Absolute path of a video file; URLs such as rtsp:// or synthetic:// are kept as they are"""
+    return path if "://" in path else os.path.abspath(path)
+
+
+def output_dir_for(out_dir, path):
+    """One directory per input video, unique even when two videos share a file name"""
+    stem = re.sub(r"[^\w.-]+", "_", os.path.splitext(os.path.basename(path.split("?")[0]))[0])
+    digest = hashlib.sha1(full_path(path).encode()).hexdigest()[:8]
+    return os.path.join(out_dir, f"{stem}-{digest}")
+
+
+class BatchOutputs:
+    """
+    The CSV outputs of one video. Rows are buffered in memory and only reach disk in
+    `flush()`, right before a checkpoint records the resulting file sizes; resuming
+    truncates the files back to those sizes, dropping rows written after it.
+    """
+    def __init__(self, directory, headers, sizes=None):
+        self.directory = directory
+        self.headers = headers
+        self._rows = {name: [] for name in headers}
+        for name, header in headers.items():
+            path = self.path(name)
+            if sizes and name in sizes:
+                with open(path, 'r+b') as f:
+                    f.truncate(sizes[name])
+            else:
+                with open(path, 'w', newline='') as f:
+                    csv.writer(f).writerow(header)
+
+    def path(self, name):
+        return os.path.join(self.directory, f"{name}.csv")
+
+    def add(self, name, row):
+        self._rows[name].append(row)
+
+    def flush(self):
+        """Append the buffered rows and return the size of every file"""
+        sizes = {}
+        for name, rows in self._rows.items():
+            path = self.path(name)
+            if rows:
+                with open(path, 'a', newline='') as f:
+                    csv.writer(f).writerows(rows)
+                    f.flush()
+                    os.fsync(f.fileno())
+                rows.clear()
+            sizes[name] = os.path.getsize(path)
+        return sizes
+
+
+def load_ocr_settings(feed_id=None, config_path=CONFIG_PATH):
+    """
+    The `ocr` block plates are read with: that of a feed in the feeds config, or of its
+    `anpr` block; None, the EasyOCR default, if neither sets one
+    """
+    try:
+        with open(config_path, 'r') as f:
+            config = json.load(f)
+    except (OSError, ValueError):
+        config = {}
+    settings = config.get('anpr', {}).get('ocr')
+    if feed_id is not None:
+        feed = next((feed for feed in config.get('feeds', []) if feed.get('id') == feed_id), None)
+        if feed is None:
+            raise ValueError(f"No feed with id {feed_id} in {config_path}")
+        settings = feed.get('ocr', settings)
+    return settings
+
+
+class PlateReader:
+    """
+    Plate detection and OCR for batch runs, loaded only when plates are requested. Reads
+    go through the same recognizer, OCR tiers and backends as live ANPR.
+    """
+    def __init__(self, directory, ocr_settings=None):
+        from .anpr import PlateRecognizer
+        self.recognizer = PlateRecognizer()
+        self.ocr_settings = ocr_settings
+        self.image_dir = os.path.join(directory, "plates")
+        os.makedirs(self.image_dir, exist_ok=True)
+
+    def read(self, car_crop, frame_index):
+        results = []
+        reads = self.recognizer.recognize([car_crop], [self.ocr_settings])[0]
+        for i, (text, _, plate_image) in enumerate(reads):
+            name = f"{frame_index:08d}_{i}_{text or 'unread'}.jpg"
+            cv2.imwrite(os.path.join(self.image_dir, name), plate_image)
+            results.append((text, name))
+        return results
+
+
+def write_json_atomic(path, data):
+    tmp = path + ".tmp"
+    with open(tmp, 'w') as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def write_pickle_atomic(path, data):
+    tmp = path + ".tmp"
+    with open(tmp, 'wb') as f:
+        pickle.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def write_checkpoint(directory, checkpoint):
+    write_pickle_atomic(os.path.join(directory, CHECKPOINT_FILE), checkpoint)
+
+
+def load_checkpoint(directory):
+    try:
+        with open(os.path.join(directory, CHECKPOINT_FILE), 'rb') as f:
+            return pickle.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def video_info(path):
+    cap = open_capture(path)
+    if not cap.isOpened():
+        raise ValueError(f"Could not open video source: {path}")
+    try:
+        fps = cap.get(cv2.CAP_PROP_FPS) or 25.0
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+        return fps, frame_count
+    finally:
+        cap.release()
+
+
+class VideoProcessor:
+    """
+    Detection, tracking, counting and plate reading over the frames of one video, or one
+    segment of it. `step()` returns the event and plate rows of a processed frame.
+    """
+    def __init__(self, options, fps, plate_reader=None):
+        self.fps = fps
+        self.frame_skip = options.get('frame_skip') or DEFAULT_FRAME_SKIP[options['pipeline']]
+        self.plate_reader = plate_reader
+        self.frames_processed = 0
+
+        detector = CarDetector(options['model'])
+        detector.load_model()
+        detector.imgsz = options['imgsz']
+        if options.get('conf') is not None:
+            detector.conf = options['conf']
+
+        self.recorder = StageRecorder()
+        self.pipeline = OfflinePipeline(
+            options['pipeline'], detector,
+            frame_skip=self.frame_skip,
+            process_size=tuple(options['process_size']),
+            total_slots=options.get('total_slots', 0),
+            available_slots=options.get('available_slots', 0),
+            recorder=self.recorder,
+            draw=False,
+        )
+
+    @property
+    def tracker(self):
+        return self.pipeline.tracker
+
+    def occupancy(self):
+        """Net cars counted (counter) or available slots (multicam) after the last frame"""
+        if self.pipeline.state is not None:
+            return self.pipeline.state.total_cars_counted
+        return self.pipeline.parking_counter.available_slots
+
+    def step(self, index, frame, record=True):
+        """
+        Process one sampled frame. With `record=False` the frame only advances the tracker,
+        e.g. while warming up a segment, and no rows are returned.
+        """
+        self.pipeline.process(index, frame)
+        self.frames_processed += 1
+        seconds = round(index / self.fps, 3)
+        events = []
+        if record:
+            events = [[event['frame'], seconds, event['direction']] for event in self.pipeline.events]
+        self.pipeline.events.clear()
+
+        plates = []
+        if record and self.plate_reader and self.pipeline.crossings:
+            scale_x = frame.shape[1] / self.pipeline.process_size[0]
+            scale_y = frame.shape[0] / self.pipeline.process_size[1]
+            for _, direction, box in self.pipeline.crossings:
+                x1, y1, x2, y2 = scale_box(box, scale_x, scale_y, frame.shape)
+                car_crop = frame[y1:y2, x1:x2]
+                if car_crop.size == 0:
+                    continue
+                for text, image_name in self.plate_reader.read(car_crop, index):
+                    plates.append([index, seconds, direction, text, image_name])
+        return events, plates
+
+
+def output_headers(options):
+    headers = dict(OUTPUT_HEADERS)
+    headers["occupancy"] = ["frame", "seconds", OCCUPANCY_COLUMN[options['pipeline']]]
+    if not options.get('plates'):
+        del headers["plates"]
+    return headers
+
+
+def finished_summary(directory, options):
+    """The summary of an already finished video, unless --force asks to redo it"""
+    summary_path = os.path.join(directory, SUMMARY_FILE)
+    if options.get('force') or not os.path.exists(summary_path):
+        return None
+    with open(summary_path, 'r') as f:
+        summary = json.load(f)
+    summary['skipped'] = True
+    return summary
+
+
+def process_video(path, out_dir, options):
+    """Process one video to completion, resuming from its checkpoint; returns its summary"""
+    directory = output_dir_for(out_dir, path)
+    os.makedirs(directory, exist_ok=True)
+    summary = finished_summary(directory, options)
+    if summary:
+        return summary
+
+    configure_threads(options['threads'])
+    fps, frame_count = video_info(path)
+    plate_reader = PlateReader(directory, options.get('ocr')) if options.get('plates') else None
+    processor = VideoProcessor(options, fps, plate_reader)
+    pipeline = processor.pipeline
+
+    checkpoint = None if options.get('force') else load_checkpoint(directory)
+    if checkpoint:
+        pipeline.tracker = checkpoint['tracker']
+        pipeline.parking_counter.available_slots = checkpoint['available_slots']
+        if pipeline.state is not None:
+            pipeline.state.total_cars_counted = checkpoint['cars_counted']
+        totals = checkpoint['totals']
+        start_frame = checkpoint['next_frame']
+        processing_seconds = checkpoint['processing_seconds']
+        print(f"Resuming {path} at frame {start_frame}", file=sys.stderr)
+    else:
+        totals = {"towards": 0, "away": 0, "plates": 0, "frames_processed": 0}
+        start_frame = 0
+        processing_seconds = 0.0
+    outputs = BatchOutputs(directory, output_headers(options), checkpoint['sizes'] if checkpoint else None)
+
+    occupancy_every = max(1, int(round(options['occupancy_interval'] * fps)))
+    checkpoint_every = max(1, int(round(options['checkpoint_interval'] * fps)))
+    next_occupancy = start_frame
+    next_checkpoint = start_frame + checkpoint_every
+    index = start_frame - 1
+
+    def save_checkpoint(next_frame):
+        write_checkpoint(directory, {
+            "next_frame": next_frame,
+            "sizes": outputs.flush(),
+            "tracker": pipeline.tracker,
+            "available_slots": pipeline.parking_counter.available_slots,
+            "cars_counted": pipeline.state.total_cars_counted if pipeline.state is not None else 0,
+            "totals": totals,
+            "processing_seconds": processing_seconds + time.perf_counter() - started,
+        })
+
+    started = time.perf_counter()
+    for index, frame in iter_frames(path, start_frame, options.get('max_frames'), sample_every=processor.frame_skip):
+        events, plates = processor.step(index, frame)
+        totals['frames_processed'] += 1
+        for row in events:
+            outputs.add("events", row)
+            totals[row[2]] += 1
+        for row in plates:
+            outputs.add("plates", row)
+            totals['plates'] += 1
+
+        if index >= next_occupancy:
+            outputs.add("occupancy", [index, round(index / fps, 3), processor.occupancy()])
+            next_occupancy = index + occupancy_every
+
+        if index >= next_checkpoint:
+            save_checkpoint(index + 1)
+            next_checkpoint = index + checkpoint_every
+
+    save_checkpoint(index + 1)
+    processing_seconds += time.perf_counter() - started
+    summary = build_summary(path, options, fps, frame_count, index + 1, processor.frame_skip, totals,
+                            processing_seconds, processor.recorder.summary())
+    summary["resumed"] = checkpoint is not None
+    write_json_atomic(os.path.join(directory, SUMMARY_FILE), summary)
+    os.remove(os.path.join(directory, CHECKPOINT_FILE))
+    return summary
+
+
+def build_summary(path, options, fps, frame_count, frames, frame_skip, totals, processing_seconds, stages):
+    video_seconds = frames / fps
+    return {
+        "path": full_path(path),
+        "pipeline": options['pipeline'],
+        "fps": fps,
+        "frames": frames,
+        "frame_count": frame_count,
+        "frame_skip": frame_skip,
+        "frames_processed": totals['frames_processed'],
+        "counts": {"towards": totals['towards'], "away": totals['away']},
+        "plates": totals['plates'] if options.get('plates') else None,
+        "video_seconds": round(video_seconds, 1),
+        "processing_seconds": round(processing_seconds, 1),
+        "speedup": round(video_seconds / processing_seconds, 1) if processing_seconds else None,
+        "stages": stages,
+    }
+
+
+def keyframe_indices(path, fps):
+    """
+    Frame indices of the keyframes of a video file, from ffprobe when it is installed.
+    Returns None when they cannot be listed; segments then start at arbitrary frames,
+    which is still exact but makes each worker decode forward from the previous keyframe.
+    """
+    if "://" in path or shutil.which("ffprobe") is None:
+        return None
+    command = ["ffprobe", "-v", "error", "-select_streams", "v:0", "-skip_frame", "nokey",
+               "-show_entries", "frame=pts_time", "-of", "csv=p=0", path]
+    try:
+        output = subprocess.run(command, capture_output=True, text=True, timeout=600, check=True).stdout
+    except (OSError, subprocess.SubprocessError):
+        return None
+    times = [float(line.split(",")[0]) for line in output.split() if line.strip()]
+    return sorted({int(round(t * fps)) for t in times}) or None
+
+
+def plan_segments(frame_count, segments, overlap_frames, keyframes=None):
+    """
+    Split [0, frame_count) into up to `segments` contiguous parts, each boundary moved to
+    the nearest keyframe at or before it. Every part but the first starts decoding
+    `overlap_frames` early to warm up its tracker. Returns [(start, end, warmup_start)].
+    """
+    bounds = [0]
+    for i in range(1, segments):
+        bound = frame_count * i // segments
+        if keyframes:
+            earlier = [k for k in keyframes if k <= bound]
+            bound = earlier[-1] if earlier else 0
+        if bound > bounds[-1]:
+            bounds.append(bound)
+    bounds.append(frame_count)
+    return [(start, end, max(0, start - overlap_frames)) for start, end in zip(bounds, bounds[1:])]
+
+
+def tracker_signature(tracker):
+    """
+    Everything about a tracker's state that affects later counting, without the object
+    ids or their order. Two trackers with equal signatures produce the same crossings
+    from then on, so a segment whose warmed-up state matches the previous segment's
+    final state continues the sequential run.
+    """
+    return sorted(
+        (tuple(int(v) for v in centroid), tracker.last_direction.get(object_id) or "", tracker.disappeared[object_id])
+        for object_id, centroid in tracker.objects.items()
+    )
+
+
+def process_segment(path, options, fps, segment, plate_dir=None, seed_tracker=None):
+    """
+    Process frames [start, end) of a video. Frames from `warmup_start` on only advance
+    the tracker, unless `seed_tracker` gives the exact state at `start` to continue from.
+    """
+    configure_threads(options['threads'])
+    start, end, warmup_start = segment
+    plate_reader = PlateReader(plate_dir, options.get('ocr')) if options.get('plates') else None
+    processor = VideoProcessor(options, fps, plate_reader)
+    if seed_tracker is not None:
+        processor.pipeline.tracker = seed_tracker
+        warmup_start = start
+
+    started = time.perf_counter()
+    start_signature = tracker_signature(processor.tracker) if warmup_start == start else None
+    events, plates = [], []
+    for index, frame in iter_frames(path, warmup_start, end, sample_every=processor.frame_skip):
+        if start_signature is None and index >= start:
+            start_signature = tracker_signature(processor.tracker)
+        frame_events, frame_plates = processor.step(index, frame, record=index >= start)
+        events.extend(frame_events)
+        plates.extend(frame_plates)
+    if start_signature is None:
+        start_signature = tracker_signature(processor.tracker)
+
+    return {
+        "segment": segment,
+        "seeded": seed_tracker is not None,
+        "events": events,
+        "plates": plates,
+        "start_signature": start_signature,
+        "end_signature": tracker_signature(processor.tracker),
+        "end_tracker": processor.tracker,
+        "frames_processed": processor.frames_processed,
+        "seconds": time.perf_counter() - started,
+        "durations": dict(processor.recorder.durations),
+    }
+
+
+def _process_segment_task(args):
+    return process_segment(*args)
+
+
+def occupancy_rows(events, options, fps, frames, frame_skip):
+    """
+    Rebuild the sampled occupancy series of a sequential run from the stitched events,
+    replaying them through the same counters so clamping at 0 and total slots matches.
+    """
+    every = max(1, int(round(options['occupancy_interval'] * fps)))
+    parking_counter = ParkingCounter(options.get('total_slots', 0), options.get('available_slots', 0))
+    cars_counted = 0
+    rows = []
+    position = 0
+    next_occupancy = 0
+    while True:
+        # First sampled frame at or after next_occupancy
+        index = next_occupancy + (-(next_occupancy + 1)) % frame_skip
+        if index >= frames:
+            break
+        while position < len(events) and events[position][0] <= index:
+            if events[position][2] == "towards":
+                cars_counted += 1
+                parking_counter.decrement_count()
+            else:
+                cars_counted -= 1
+                parking_counter.increment_count()
+            position += 1
+        value = cars_counted if options['pipeline'] == "counter" else parking_counter.available_slots
+        rows.append([index, round(index / fps, 3), value])
+        next_occupancy = index + every
+    return rows
+
+
+def process_video_segmented(path, out_dir, options, pool=None):
+    """
+    Process one video as parallel segments and stitch the results. Each segment's tracker
+    is warmed up over the overlap window before it; where its state at the boundary does
+    not match the previous segment's final state, the segment is redone continuing from
+    that state, so counts always equal a sequential run. Finished segments are kept on
+    disk, so an interrupted run resumes with the segments that were still missing.
+    """
+    directory = output_dir_for(out_dir, path)
+    os.makedirs(directory, exist_ok=True)
+    summary = finished_summary(directory, options)
+    if summary:
+        return summary
+
+    fps, frame_count = video_info(path)
+    frames = min(frame_count, options['max_frames']) if options.get('max_frames') else frame_count
+    if frames <= 0:
+        # Unknown length (e.g. a stream), so there is nothing to split
+        return process_video(path, out_dir, options)
+    frame_skip = options.get('frame_skip') or DEFAULT_FRAME_SKIP[options['pipeline']]
+    overlap_frames = int(round(options['overlap'] * fps))
+    plan = plan_segments(frames, options['segments'], overlap_frames, keyframe_indices(path, fps))
+
+    segment_dir = os.path.join(directory, "segments")
+    os.makedirs(segment_dir, exist_ok=True)
+    plate_dir = directory if options.get('plates') else None
+
+    def segment_path(i):
+        return os.path.join(segment_dir, f"segment-{i:04d}.pkl")
+
+    def save_segment(i, result):
+        write_pickle_atomic(segment_path(i), result)
+
+    results = {}
+    for i, segment in enumerate(plan):
+        if options.get('force'):
+            break
+        try:
+            with open(segment_path(i), 'rb') as f:
+                result = pickle.load(f)
+        except FileNotFoundError:
+            continue
+        if result['segment'] == segment:
+            results[i] = result
+
+    started = time.perf_counter()
+    missing = [i for i in range(len(plan)) if i not in results]
+    tasks = [(path, options, fps, plan[i], plate_dir) for i in missing]
+    finished = pool.imap(_process_segment_task, tasks) if pool else map(_process_segment_task, tasks)
+    for i, result in zip(missing, finished):
+        save_segment(i, result)
+        results[i] = result
+    print(f"Segments of {path} done, stitching", file=sys.stderr)
+
+    # Walk the boundaries in order; a mismatch means the warm-up window was too short
+    # for some track, so that segment is redone from the previous segment's exact state
+    ordered = [results[i] for i in range(len(plan))]
+    reruns = 0
+    for i in range(1, len(ordered)):
+        previous = ordered[i - 1]
+        if ordered[i]['start_signature'] == previous['end_signature']:
+            continue
+        task = (path, options, fps, plan[i], plate_dir, previous['end_tracker'])
+        ordered[i] = pool.apply(_process_segment_task, (task,)) if pool else _process_segment_task(task)
+        save_segment(i, ordered[i])
+        reruns += 1
+    wall = time.perf_counter() - started
+
+    events = [row for result in ordered for row in result['events']]
+    plates = [row for result in ordered for row in result['plates']]
+    outputs = BatchOutputs(directory, output_headers(options))
+    for row in events:
+        outputs.add("events", row)
+    for row in plates:
+        outputs.add("plates", row)
+    for row in occupancy_rows(events, options, fps, frames, frame_skip):
+        outputs.add("occupancy", row)
+    outputs.flush()
+
+    recorder = StageRecorder()
+    for result in ordered:
+        for stage, values in result['durations'].items():
+            recorder.durations[stage].extend(values)
+    totals = {
+        "towards": sum(1 for row in events if row[2] == "towards"),
+        "away": sum(1 for row in events if row[2] == "away"),
+        "plates": len(plates),
+        "frames_processed": sum(result['frames_processed'] for result in ordered),
+    }
+    summary = build_summary(path, options, fps, frame_count, frames, frame_skip, totals, wall, recorder.summary())
+    summary.update({
+        "processing_seconds": round(wall, 1),
+        "segments": [
+            {"start": r['segment'][0], "end": r['segment'][1], "warmup_start": r['segment'][2],
+             "seconds": round(r['seconds'], 1), "frames_processed": r['frames_processed'], "seeded": r['seeded']}
+            for r in ordered
+        ],
+        "reruns": reruns,
+    })
+    write_json_atomic(os.path.join(directory, SUMMARY_FILE), summary)
+    shutil.rmtree(segment_dir, ignore_errors=True)
+    return summary
+
+
+def _process_video_task(args):
+    path, out_dir, options = args
+    try:
+        return process_video(path, out_dir, options)
+    except Exception as e:
+        return {"path": full_path(path), "error": str(e)}
+
+
+def run_batch(paths, out_dir, options, workers):
+    """Process all videos, `workers` at a time, yielding each summary as its video finishes"""
+    if options.get('segments', 1) > 1:
+        # One video at a time, its segments spread over the workers
+        pool = multiprocessing.get_context("spawn").Pool(workers) if workers > 1 else None
+        try:
+            for path in paths:
+                try:
+                    yield process_video_segmented(path, out_dir, options, pool)
+                except Exception as e:
+                    yield {"path": full_path(path), "error": str(e)}
+        finally:
+            if pool:
+                pool.terminate()
+        return
+
+    tasks = [(path, out_dir, options) for path in paths]
+    if workers <= 1:
+        for task in tasks:
+            yield _process_video_task(task)
+        return
+    # Spawned workers start clean instead of inheriting model and thread-pool state
+    with multiprocessing.get_context("spawn").Pool(workers) as pool:
+        yield from pool.imap_unordered(_process_video_task, tasks)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Count crossings and read plates in recorded videos, without display or pacing.")
+    parser.add_argument("videos", nargs="+", help="Video files to process")
+    parser.add_argument("--out", required=True, help="Output directory; one subdirectory per video")
+    parser.add_argument("--pipeline", choices=sorted(DEFAULT_FRAME_SKIP), default="counter")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 1) // 2),
+                        help="Videos processed in parallel, one process each")
+    parser.add_argument("--threads", type=int, default=None,
+                        help="Intra-op threads per worker (default: cores divided by workers)")
+    parser.add_argument("--model", default="yolov8n.pt")
+    parser.add_argument("--imgsz", type=int, default=640, help="YOLO input size")
+    parser.add_argument("--conf", type=float, default=None, help="Detection confidence threshold")
+    parser.add_argument("--process-size", type=int, nargs=2, default=list(PROCESS_SIZE), metavar=("W", "H"))
+    parser.add_argument("--frame-skip", type=int, default=None,
+                        help=f"Process 1 in N frames (default per pipeline: {DEFAULT_FRAME_SKIP})")
+    parser.add_argument("--total-slots", type=int, default=0, help="Parking slots, for multicam")
+    parser.add_argument("--available-slots", type=int, default=0, help="Slots free at the start, for multicam")
+    parser.add_argument("--plates", action="store_true", help="Read the plates of crossing cars")
+    parser.add_argument("--ocr-feed", type=int, default=None,
+                        help="Read plates with the OCR settings of this feed (default: those of the anpr block)")
+    parser.add_argument("--occupancy-interval", type=float, default=60.0, help="Seconds of video between occupancy samples")
+    parser.add_argument("--checkpoint-interval", type=float, default=300.0, help="Seconds of video between checkpoints")
+    parser.add_argument("--segments", type=int, default=1,
+                        help="Split each video into this many segments processed in parallel")
+    parser.add_argument("--overlap", type=float, default=10.0,
+                        help="Seconds of video each segment decodes ahead of its start to warm up tracking")
+    parser.add_argument("--max-frames", type=int, default=None, help="Stop each video after this many frames")
+    parser.add_argument("--force", action="store_true", help="Reprocess finished videos and ignore checkpoints")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    workers = max(1, min(args.workers, len(args.videos) * args.segments))
+    options = {
+        "pipeline": args.pipeline,
+        "threads": args.threads or max(1, (os.cpu_count() or 1) // workers),
+        "model": args.model,
+        "imgsz": args.imgsz,
+        "conf": args.conf,
+        "process_size": args.process_size,
+        "frame_skip": args.frame_skip,
+        "total_slots": args.total_slots,
+        "available_slots": args.available_slots,
+        "plates": args.plates,
+        "ocr": load_ocr_settings(args.ocr_feed) if args.plates else None,
+        "occupancy_interval": args.occupancy_interval,
+        "checkpoint_interval": args.checkpoint_interval,
+        "segments": args.segments,
+        "overlap": args.overlap,
+        "max_frames": args.max_frames,
+        "force": args.force,
+    }
+    os.makedirs(args.out, exist_ok=True)
+
+    started = time.perf_counter()
+    summaries = []
+    for summary in run_batch(args.videos, args.out, options, workers):
+        summaries.append(summary)
+        if 'error' in summary:
+            print(f"❌ {summary['path']}: {summary['error']}", file=sys.stderr)
+        elif summary.get('skipped'):
+            print(f"⏭️ {summary['path']}: already done", file=sys.stderr)
+        else:
+            print(f"✅ {summary['path']}: {summary['counts']} in {summary['processing_seconds']}s "
+                  f"({summary['speedup']}x real time)", file=sys.stderr)
+
+    wall = time.perf_counter() - started
+    video_seconds = sum(s.get('video_seconds', 0) for s in summaries if not s.get('skipped'))
+    write_json_atomic(os.path.join(args.out, "batch.json"), {
+        "options": options,
+        "workers": workers,
+        "wall_seconds": round(wall, 1),
+        "speedup": round(video_seconds / wall, 1) if wall else None,
+        "videos": summaries,
+    })
+    return summaries
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+import heapq
+import itertools
+from datetime import datetime
+
+import cv2
+
+from .utils import scale_box
+
+# Car crops are scored on a grayscale copy of their lower half at this width, where the
+# plate usually is, so scoring costs about the same for near and far cars
+SCORE_WIDTH = 160
+# Car width in source pixels from which a plate is large enough to read reliably
+READABLE_WIDTH = 400
+# Laplacian variance at which a crop counts as half sharp
+SHARPNESS_KNEE = 100.0
+
+
+def sharpness(car_crop):
+    """Variance of the Laplacian over the lower half of a car crop; low means blurred"""
+    height, width = car_crop.shape[:2]
+    lower = car_crop[height // 2:]
+    if lower.size == 0:
+        return 0.0
+    scaled_height = max(1, int(lower.shape[0] * SCORE_WIDTH / width))
+    gray = cv2.cvtColor(cv2.resize(lower, (SCORE_WIDTH, scaled_height), interpolation=cv2.INTER_AREA),
+                        cv2.COLOR_BGR2GRAY)
+    return float(cv2.Laplacian(gray, cv2.CV_64F).var())
+
+
+def shot_score(car_crop, confidence, clipped=False):
+    """
+    How promising a car crop is for plate OCR, in [0, 1]: detector confidence, times the
+    plate size (the car's width in source pixels), times a saturating sharpness term.
+    Cars cut off by the frame edge count half, as their plate may be outside the crop.
+    """
+    if car_crop.size == 0:
+        return 0.0
+    size = min(1.0, car_crop.shape[1] / READABLE_WIDTH)
+    sharp = sharpness(car_crop)
+    score = confidence * size * sharp / (sharp + SHARPNESS_KNEE)
+    return score / 2 if clipped else score
+
+
+class BestShotBuffer:
+    """
+    Keeps the best few full-resolution crops of every tracked car over its lifetime, so
+    ANPR reads the sharpest view of a car rather than whatever frame it crossed the line
+    in. Crops are only copied when they beat one that is kept. Once a car that crossed
+    the line leaves, its best crops are released with the direction and time of the
+    crossing; cars that never crossed are forgotten.
+    """
+    def __init__(self, keep=2, max_wait=150):
+        self.keep = keep
+        # Frames to wait after a crossing before releasing a car that never leaves
+        self.max_wait = max_wait
+        self._shots = {}  # object_id -> heap of (score, order, crop)
+        self._crossed = {}  # object_id -> (direction, crossed_at, frames since crossing)
+        self._order = itertools.count()
+
+    def __len__(self):
+        return len(self._shots)
+
+    def observe(self, full_frame, tracked, scale_x, scale_y):
+        """Score this frame's crops of the tracked cars, given as [(object_id, box, confidence)]"""
+        height, width = full_frame.shape[:2]
+        for object_id, box, confidence in tracked:
+            x1, y1, x2, y2 = scale_box(box, scale_x, scale_y, full_frame.shape)
+            if x2 <= x1 or y2 <= y1:
+                continue
+            crop = full_frame[y1:y2, x1:x2]
+            clipped = x1 == 0 or y1 == 0 or x2 == width or y2 == height
+            score = shot_score(crop, confidence, clipped)
+            shots = self._shots.setdefault(object_id, [])
+            if len(shots) < self.keep:
+                heapq.heappush(shots, (score, next(self._order), crop.copy()))
+            elif score > shots[0][0]:
+                heapq.heapreplace(shots, (score, next(self._order), crop.copy()))
+
+    def crossed(self, object_id, direction, crossed_at=None):
+        """
+        Note a line crossing. A car that crosses back before leaving is released at once
+        for its first crossing, so both directions are read.
+        """
+        released = []
+        previous = self._crossed.get(object_id)
+        if previous is not None and previous[0] != direction:
+            released.append(self._release(object_id, keep_shots=True))
+        self._crossed[object_id] = (direction, crossed_at or datetime.now(), 0)
+        return [entry for entry in released if entry is not None]
+
+    def finished(self, live_ids):
+        """
+        Release the cars that left, or crossed more than `max_wait` frames ago, as
+        [(object_id, direction, crossed_at, crops best first)]. Call once per frame.
+        """
+        released = []
+        for object_id in list(self._shots):
+            if object_id in live_ids:
+                continue
+            if object_id in self._crossed:
+                released.append(self._release(object_id))
+            else:
+                del self._shots[object_id]
+        for object_id, (direction, crossed_at, waited) in list(self._crossed.items()):
+            if waited >= self.max_wait:
+                released.append(self._release(object_id))
+            elif object_id not in live_ids and object_id not in self._shots:
+                del self._crossed[object_id]
+            else:
+                self._crossed[object_id] = (direction, crossed_at, waited + 1)
+        return [entry for entry in released if entry is not None]
+
+    def _release(self, object_id, keep_shots=False):
+        direction, crossed_at, _ = self._crossed.pop(object_id)
+        shots = self._shots.get(object_id, []) if keep_shots else self._shots.pop(object_id, [])
+        crops = [crop for _, _, crop in sorted(shots, reverse=True)]
+        if not crops:
+            return None
+        return object_id, direction, crossed_at, crops
@@ -1,11 +1,15 @@
 import json
 import os
 import cv2
+import numpy as np
 import time
 import logging
 from threading import Lock, Thread
 from . import multicam
 from . import car_counter
+from .capture import LatestFrameReader, get_capture_status
+from .frame_pool import frame_budget, get_memory_report
+from .metrics import observe_stage, END_TO_END_SECONDS
 
 class CameraService:
     def __init__(self):
@@ -18,10 +22,13 @@ logging.basicConfig(level=logging.INFO)
 
 class CameraService:
     def __init__(self):
-        self.CONFIG_PATH = os.path.join(os.path.dirname(__file__), "../config/feeds_config.json")
+        self.CONFIG_PATH = os.environ.get("FEEDS_CONFIG", os.path.join(os.path.dirname(__file__), "../config/feeds_config.json"))
         self.video_frames = {}
+        self.video_frame_seqs = {}
+        self.video_frame_times = {}
         self.video_frame_locks = {}
         self.video_threads = {}
+        self.previews_refused = set()
 
     def load_config(self):
         with open(self.CONFIG_PATH, "r") as f:
@@ -74,40 +81,42 @@ class CameraService:
             json.dump(config, f, indent=2)
         return feed
 
-    def update_frame(self, feed_id, frame):
+    def update_frame(self, feed_id, frame, captured_at=None):
         if feed_id not in self.video_frame_locks:
             self.video_frame_locks[feed_id] = Lock()
         with self.video_frame_locks[feed_id]:
-            self.video_frames[feed_id] = frame
+            # Copy into a preallocated display buffer so the pipeline can keep reusing its own
+            display = self.video_frames.get(feed_id)
+            if display is None or display.shape != frame.shape:
+                try:
+                    display = frame_budget.allocate((self, feed_id), feed_id, "display", frame.shape)
+                except MemoryError as e:
+                    # Only the preview is dropped, the pipeline keeps counting; tried again next frame
+                    if feed_id not in self.previews_refused:
+                        self.previews_refused.add(feed_id)
+                        logging.warning(f"[update_frame] No preview for Feed ID {feed_id}: {e}")
+                    return
+                self.previews_refused.discard(feed_id)
+                self.video_frames[feed_id] = display
+            np.copyto(display, frame)
+            self.video_frame_seqs[feed_id] = self.video_frame_seqs.get(feed_id, 0) + 1
+            self.video_frame_times[feed_id] = captured_at
 
     def preload_camera(self, feed_id, video_path):
         logging.info(f"[preload_camera] Starting thread for Feed ID {feed_id}, Source: {video_path}")
 
-        cap = None
-        retry_count = 0
-        while retry_count < 5:
-            cap = cv2.VideoCapture(video_path)
-            if cap.isOpened():
-                break
-            logging.warning(f"[preload_camera] Retry {retry_count+1}: Failed to open {video_path}")
-            retry_count += 1
-            time.sleep(2)
-
-        if not cap or not cap.isOpened():
-            logging.error(f"[preload_camera] Could not open video: {video_path}")
-            return
-
-        while True:
-            ret, frame = cap.read()
-            if not ret or frame is None:
-                logging.warning(f"[preload_camera] Empty frame from {video_path}, resetting...")
-                cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
-                time.sleep(0.5)
+        # The reader reconnects with exponential backoff and paces files at their native FPS
+        reader = LatestFrameReader(feed_id, video_path).start()
+        last_seq = 0
+        while reader.is_alive():
+            frame, last_seq, captured_at = reader.read(last_seq, timeout=1)
+            if frame is None:
                 continue
 
             self.update_frame(feed_id, frame) # Use the new update_frame function
 
-            time.sleep(0.033)  # ~30 FPS
+    def get_capture_status(self):
+        return get_capture_status()
 
     def start_multicam_processing(self, feed_id):
         multicam.main(feed_id, self.update_frame)
@@ -125,7 +134,7 @@ class CameraService:
                     if feed_id not in self.video_frame_locks:
                         self.video_frame_locks[feed_id] = Lock()
                     # Start multicam processing in a separate thread
-                    thread = Thread(target=self.start_multicam_processing, args=(feed_id,))
+                    thread = Thread(target=self.start_multicam_processing, args=(feed_id,), name=f"camera-multicam-{feed_id}")
                     thread.daemon = True
                     thread.start()
                     self.video_threads[feed_id] = thread
@@ -134,7 +143,7 @@ class CameraService:
                     if feed_id not in self.video_frame_locks:
                         self.video_frame_locks[feed_id] = Lock()
                     # Start car_counter processing in a separate thread
-                    thread = Thread(target=self.start_car_counter_processing, args=(feed_id,))
+                    thread = Thread(target=self.start_car_counter_processing, args=(feed_id,), name=f"camera-counter-{feed_id}")
                     thread.daemon = True
                     thread.start()
                     self.video_threads[feed_id] = thread
@@ -153,21 +162,33 @@ class CameraService:
                 if feed_id not in self.video_frame_locks:
                     self.video_frame_locks[feed_id] = Lock()
 
-                thread = Thread(target=self.preload_camera, args=(feed_id, video_path))
+                thread = Thread(target=self.preload_camera, args=(feed_id, video_path), name=f"camera-preload-{feed_id}")
                 thread.daemon = True
                 thread.start()
                 self.video_threads[feed_id] = thread
 
+    def get_memory_report(self):
+        return get_memory_report()
+
     def generate_mjpeg_frames(self, feed_id):
+        last_seq = 0
         while True:
             with self.video_frame_locks.get(feed_id, Lock()):
                 frame = self.video_frames.get(feed_id)
-
-            if frame is None:
-                time.sleep(0.1)
+                seq = self.video_frame_seqs.get(feed_id, 0)
+                captured_at = self.video_frame_times.get(feed_id)
+                # Encode under the lock, the display buffer is overwritten in place
+                if frame is not None and seq != last_seq:
+                    started = time.monotonic()
+                    ret, jpeg = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, 70])
+                    observe_stage(feed_id, "encode", time.monotonic() - started)
+                else:
+                    ret = None
+
+            if ret is None:
+                time.sleep(0.01 if frame is not None else 0.1)
                 continue
-
-            ret, jpeg = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, 70])
+            last_seq = seq
             if not ret:
                 continue
 
@@ -175,3 +196,6 @@ class CameraService:
                 b"--frame\r\n"
                 b"Content-Type: image/jpeg\r\n\r\n" + jpeg.tobytes() + b"\r\n"
             )
+            # The generator resumes once the server has written the chunk to the client
+            if captured_at is not None:
+                END_TO_END_SECONDS.labels(feed_id).observe(time.monotonic() - captured_at)
@@ -0,0 +1,339 @@
+import cv2
+import numpy as np
+import os
+import random
+import logging
+import threading
+import time
+from .frame_pool import FramePool
+from .synthetic import open_capture
+from .metrics import registry, observe_stage, FRAMES_DROPPED, FRAME_AGE_SECONDS, QUEUE_DEPTH
+
+# Relative video sources in the feeds config are relative to the backend directory
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+# Every running LatestFrameReader, used to report capture health; a feed may have more than one
+_readers = set()
+_readers_lock = threading.Lock()
+
+
+def resolve_source(source):
+    """
+    Turn a `video_source` from the feeds config into something cv2.VideoCapture accepts.
+    Numeric strings are webcam indexes, URLs are passed through and everything else
+    is a path relative to the backend directory.
+    """
+    if isinstance(source, int):
+        return source
+    if isinstance(source, str) and source.isnumeric():
+        return int(source)
+    if "://" in source:
+        return source
+    return os.path.abspath(os.path.join(BACKEND_DIR, source))
+
+
+def is_live_source(source):
+    """Files are replayed at their native rate, everything else is treated as a live camera."""
+    return isinstance(source, int) or "://" in source
+
+
+class LatestFrameReader:
+    """
+    Reads a single video source on its own thread and only ever keeps the newest frame.
+
+    Consumers never see a backlog: `read()` hands out the most recent frame together with
+    its sequence number and capture time, so decisions are always made on fresh data.
+    Failed opens and dropped streams are retried with exponential backoff without
+    affecting any other feed.
+
+    Frames are decoded and (optionally) downscaled to `target_size` into preallocated,
+    budgeted buffers, so steady-state capture does not allocate any frame memory.
+    """
+    def __init__(self, feed_id, video_source, target_size=None, min_backoff=0.5, max_backoff=30.0):
+        self.feed_id = feed_id
+        self.video_source = resolve_source(video_source)
+        self.live = is_live_source(self.video_source)
+        self.target_size = tuple(target_size) if target_size else None
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+
+        # Full resolution decode targets (only used when downscaling) and the two
+        # published slots: one being read by consumers, one being written. The decode
+        # targets alternate too, so the full frame behind the published one stays intact
+        self._decode_pool = None
+        self._pool = None
+
+        self.cap = None
+        self.running = False
+        self.thread = None
+
+        # Latest frame slot, guarded by a condition so readers can wait for a newer frame
+        self._cond = threading.Condition()
+        self._frame = None
+        self._full_frame = None
+        self._seq = 0
+        self._consumed_seq = 0
+        self._captured_at = None
+
+        # Health information
+        self.connected = False
+        self.reconnects = 0
+        self.last_error = None
+        self.backoff = 0.0
+        self._fps_window_start = time.monotonic()
+        self._fps_window_frames = 0
+        self.fps = 0.0
+
+    def start(self):
+        """Start the capture thread and register the reader for status reporting"""
+        self.running = True
+        self.thread = threading.Thread(target=self._capture_loop, name=f"capture-feed-{self.feed_id}", daemon=True)
+        self.thread.start()
+        with _readers_lock:
+            _readers.add(self)
+        return self
+
+    def stop(self):
+        """Stop the capture thread and release the source"""
+        self.running = False
+        with self._cond:
+            self._cond.notify_all()
+        if self.thread:
+            self.thread.join(timeout=1)
+        self._release()
+        if self._pool is not None:
+            self._pool.close()
+        if self._decode_pool is not None:
+            self._decode_pool.close()
+        with _readers_lock:
+            _readers.discard(self)
+
+    def is_alive(self):
+        return self.running and self.thread is not None and self.thread.is_alive()
+
+    def _open(self):
+        cap = open_capture(self.video_source)
+        if not cap.isOpened():
+            cap.release()
+            return None
+        if self.live:
+            # Keep the driver-side queue as short as possible so we never decode stale frames
+            cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        return cap
+
+    def _release(self):
+        if self.cap is not None:
+            self.cap.release()
+            self.cap = None
+        self.connected = False
+
+    def _wait_backoff(self, reason):
+        """Sleep with exponential backoff (plus jitter) before the next reconnect attempt"""
+        self.last_error = reason
+        self.backoff = min(self.max_backoff, max(self.min_backoff, self.backoff * 2))
+        delay = self.backoff * random.uniform(0.8, 1.2)
+        logging.warning(f"[capture] Feed {self.feed_id}: {reason}, retrying in {delay:.1f}s")
+        deadline = time.monotonic() + delay
+        while self.running and time.monotonic() < deadline:
+            time.sleep(min(0.1, deadline - time.monotonic()))
+
+    def _capture_loop(self):
+        frame_interval = 0.0
+        next_frame_at = time.monotonic()
+        rewinding = False
+
+        while self.running:
+            if self.cap is None:
+                self.cap = self._open()
+                if self.cap is None:
+                    self._wait_backoff(f"could not open {self.video_source}")
+                    continue
+                if rewinding:
+                    rewinding = False
+                else:
+                    if self.reconnects:
+                        logging.info(f"[capture] Feed {self.feed_id}: reconnected to {self.video_source}")
+                    self.reconnects += 1
+                self.connected = True
+                if not self.live:
+                    # Replay files at their native frame rate so they behave like a camera
+                    fps = self.cap.get(cv2.CAP_PROP_FPS)
+                    frame_interval = 1.0 / fps if fps and fps > 0 else 1.0 / 30
+                next_frame_at = time.monotonic()
+
+            try:
+                ret, frame, full_frame = self._read_frame()
+            except MemoryError as e:
+                logging.error(f"[capture] Feed {self.feed_id}: {e}")
+                self.last_error = str(e)
+                self.running = False
+                break
+            except Exception as e:
+                ret, frame, full_frame = False, None, None
+                self.last_error = str(e)
+
+            if not ret or frame is None:
+                if not self.live and self._seq:
+                    # End of file, loop back to the start
+                    self._release()
+                    rewinding = True
+                    continue
+                self._release()
+                self._wait_backoff(f"lost stream {self.video_source}")
+                continue
+
+            self.backoff = 0.0
+            self._publish(frame, full_frame)
+
+            if frame_interval:
+                next_frame_at += frame_interval
+                delay = next_frame_at - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    next_frame_at = time.monotonic()
+
+        self._release()
+
+    def _ensure_pool(self, shape):
+        if self._pool is None or self._pool.shape != tuple(shape):
+            if self._pool is not None:
+                self._pool.close()
+            self._pool = FramePool(self.feed_id, "capture", shape, count=2)
+        return self._pool
+
+    def _read_frame(self):
+        """
+        Decode the next frame into the back buffer, downscaling on capture when configured.
+        Returns (ret, frame, full resolution frame).
+        """
+        started = time.monotonic()
+        if self.target_size is None:
+            back = self._pool.next() if self._pool is not None else None
+            ret, frame = self.cap.read(back)
+            observe_stage(self.feed_id, "decode", time.monotonic() - started)
+            if ret and frame is not back:
+                # First frame or the stream changed resolution
+                back = self._ensure_pool(frame.shape).next()
+                np.copyto(back, frame)
+                frame = back
+            return ret, frame, frame
+
+        decode_buf = self._decode_pool.next() if self._decode_pool is not None else None
+        ret, frame = self.cap.read(decode_buf)
+        decoded = time.monotonic()
+        observe_stage(self.feed_id, "decode", decoded - started)
+        if not ret or frame is None:
+            return False, None, None
+        if frame is not decode_buf:
+            if self._decode_pool is not None:
+                self._decode_pool.close()
+            self._decode_pool = FramePool(self.feed_id, "decode", frame.shape, count=2)
+            decode_buf = self._decode_pool.next()
+            np.copyto(decode_buf, frame)
+            frame = decode_buf
+        width, height = self.target_size
+        back = self._ensure_pool((height, width) + frame.shape[2:]).next()
+        cv2.resize(frame, self.target_size, dst=back, interpolation=cv2.INTER_AREA)
+        observe_stage(self.feed_id, "resize", time.monotonic() - decoded)
+        return True, back, frame
+
+    def _publish(self, frame, full_frame):
+        now = time.monotonic()
+        with self._cond:
+            if self._seq > self._consumed_seq:
+                # Nobody read the previous frame before it was replaced
+                FRAMES_DROPPED.labels(self.feed_id, "stale").inc()
+            self._frame = frame
+            self._full_frame = full_frame
+            self._seq += 1
+            self._captured_at = now
+            self._cond.notify_all()
+
+        self._fps_window_frames += 1
+        elapsed = now - self._fps_window_start
+        if elapsed >= 1.0:
+            self.fps = self._fps_window_frames / elapsed
+            self._fps_window_start = now
+            self._fps_window_frames = 0
+
+    @property
+    def full_shape(self):
+        """Shape of the frames at source resolution, or None before the first frame"""
+        full_frame = self._full_frame
+        return full_frame.shape if full_frame is not None else None
+
+    def _copy_latest(self, dst, last_seq, timeout, full_dst=None):
+        started = time.monotonic()
+        with self._cond:
+            if self._seq <= last_seq:
+                self._cond.wait_for(lambda: self._seq > last_seq or not self.running, timeout=timeout)
+            if self._seq <= last_seq:
+                return None, last_seq, None
+            if dst is None:
+                dst = self._frame.copy()
+            else:
+                np.copyto(dst, self._frame)
+            if full_dst is not None and full_dst.shape == self._full_frame.shape:
+                np.copyto(full_dst, self._full_frame)
+            self._consumed_seq = self._seq
+            seq, captured_at = self._seq, self._captured_at
+        observe_stage(self.feed_id, "capture_wait", time.monotonic() - started)
+        return dst, seq, captured_at
+
+    def read_into(self, dst, last_seq=0, timeout=1.0, full_dst=None):
+        """
+        Copy the newest frame with a sequence number above `last_seq` into `dst`, waiting up
+        to `timeout` seconds. Returns (seq, captured_at), or (last_seq, None) on timeout.
+        `dst` must have the capture shape (`target_size` when downscaling). A `full_dst`
+        of `full_shape` also receives the same frame at source resolution.
+        """
+        frame, seq, captured_at = self._copy_latest(dst, last_seq, timeout, full_dst)
+        return seq, captured_at
+
+    def read(self, last_seq=0, timeout=1.0):
+        """
+        Return (frame, seq, captured_at) for the newest frame with a sequence number above
+        `last_seq`, waiting up to `timeout` seconds. Returns (None, last_seq, None) on timeout.
+        The frame is a private copy; hot loops should use `read_into` with a pooled buffer.
+        """
+        return self._copy_latest(None, last_seq, timeout)
+
+    def frame_age(self):
+        """Seconds since the newest frame was captured, or None if nothing was captured yet"""
+        captured_at = self._captured_at
+        if captured_at is None:
+            return None
+        return time.monotonic() - captured_at
+
+    def status(self):
+        age = self.frame_age()
+        return {
+            "feedId": self.feed_id,
+            "source": str(self.video_source),
+            "connected": self.connected,
+            "framesCaptured": self._seq,
+            "fps": round(self.fps, 2),
+            "frameAgeMs": round(age * 1000, 1) if age is not None else None,
+            "reconnects": max(0, self.reconnects - 1),
+            "backoffSeconds": round(self.backoff, 2),
+            "lastError": self.last_error,
+        }
+
+
+def _collect_capture_metrics():
+    with _readers_lock:
+        readers = list(_readers)
+    for reader in readers:
+        age = reader.frame_age()
+        FRAME_AGE_SECONDS.labels(reader.feed_id).set(round(age, 4) if age is not None else 0)
+        QUEUE_DEPTH.labels(reader.feed_id, "frame_buffer").set(reader._seq - reader._consumed_seq)
+
+
+registry.add_collector(_collect_capture_metrics)
+
+
+def get_capture_status():
+    with _readers_lock:
+        readers = list(_readers)
+    return [reader.status() for reader in readers]
@@ -3,13 +3,25 @@ from .detector import CarDetector
 from .counter import ParkingCounter
 import json
 import os
-from .utils import draw_parking_status, draw_line
-import numpy as np
+from .utils import draw_parking_status
+from .capture import LatestFrameReader
+from .frame_pool import FramePool
+from .scheduler import inference_scheduler
+from .metrics import FrameTimer, FRAMES_PROCESSED, QUEUE_DEPTH
+from .tracker import CentroidTracker, box_of, tracked_detections
+from .best_shot import BestShotBuffer
+from .trace import open_feed_trace
+from .zones import ZoneSet
+from .events import event_bus, CrossingEvent, CountEvent
+from .feeds_service import start_count_sink
 import threading
-import queue
 import time
 
 class CarCounterState:
+    """
+    The global count of the counter feeds. Every change is published as a CountEvent;
+    the feeds config is written from the event bus, off the frame loop.
+    """
     def __init__(self, config_path):
         self.config_path = config_path
         self.config = self._load_config()
@@ -19,108 +31,29 @@ class CarCounterState:
         with open(self.config_path, 'r') as f:
             return json.load(f)
 
-    def _save_config(self):
-        with open(self.config_path, 'w') as f:
-            json.dump(self.config, f, indent=4)
-
     def increment(self):
         self.total_cars_counted += 1
-        self.config['global_car_count'] = self.total_cars_counted
-        self._save_config()
+        event_bus.publish(CountEvent(self.total_cars_counted))
 
     def decrement(self):
         self.total_cars_counted -= 1
-        self.config['global_car_count'] = self.total_cars_counted
-        self._save_config()
+        event_bus.publish(CountEvent(self.total_cars_counted))
 
-CONFIG_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'config', 'feeds_config.json'))
+CONFIG_PATH = os.environ.get('FEEDS_CONFIG', os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'config', 'feeds_config.json')))
+# Frames are downscaled to this (width, height) on capture
+PROCESS_SIZE = (640, 480)
 # This single instance will be used everywhere
 car_counter_state = CarCounterState(CONFIG_PATH)
 
-class CentroidTracker:
-    def __init__(self, max_disappeared=10):
-        self.next_object_id = 0
-        self.objects = {}
-        self.disappeared = {}
-        self.max_disappeared = max_disappeared
-        self.last_direction = {}
-        self.previous_positions = {}
-
-    def register(self, centroid):
-        self.objects[self.next_object_id] = centroid
-        self.disappeared[self.next_object_id] = 0
-        self.last_direction[self.next_object_id] = None
-        self.previous_positions[self.next_object_id] = centroid
-        self.next_object_id += 1
-
-    def deregister(self, object_id):
-        del self.objects[object_id]
-        del self.disappeared[object_id]
-        del self.last_direction[object_id]
-        del self.previous_positions[object_id]
-
-    def update(self, rects):
-        if len(rects) == 0:
-            disappeared_ids = []
-            for object_id in list(self.disappeared.keys()):
-                self.disappeared[object_id] += 1
-                if self.disappeared[object_id] > self.max_disappeared:
-                    disappeared_ids.append(object_id)
-                    self.deregister(object_id)
-            return self.objects, disappeared_ids
-
-        input_centroids = []
-        for (x, y, w, h) in rects:
-            cx = x + w // 2
-            cy = y + h // 2
-            input_centroids.append((cx, cy))
-
-        if len(self.objects) == 0:
-            for centroid in input_centroids:
-                self.register(centroid)
-            return self.objects, []
-
-        object_ids = list(self.objects.keys())
-        object_centroids = list(self.objects.values())
-
-        D = np.linalg.norm(np.array(object_centroids)[:, None] - np.array(input_centroids), axis=2)
-
-        rows = D.min(axis=1).argsort()
-        cols = D.argmin(axis=1)[rows]
-
-        assigned_rows = set()
-        assigned_cols = set()
-
-        for row, col in zip(rows, cols):
-            if row in assigned_rows or col in assigned_cols:
-                continue
-            if D[row, col] > 50:
-                continue
-            object_id = object_ids[row]
-            self.objects[object_id] = input_centroids[col]
-            self.disappeared[object_id] = 0
-            assigned_rows.add(row)
-            assigned_cols.add(col)
-
-        unassigned_rows = set(range(len(object_centroids))) - assigned_rows
-        for row in unassigned_rows:
-            object_id = object_ids[row]
-            self.disappeared[object_id] += 1
-            if self.disappeared[object_id] > self.max_disappeared:
-                self.deregister(object_id)
-
-        unassigned_cols = set(range(len(input_centroids))) - assigned_cols
-        for col in unassigned_cols:
-            self.register(input_centroids[col])
-
-        return self.objects, []
-
-def process_frame(frame, car_detector, tracker, parking_counter, car_counter_state, update_callback=None):
-    frame_height, frame_width = frame.shape[:2]
-    center_y = frame_height // 2
-
-    detected_cars = car_detector.detect_cars(frame)
+def update_counts(detected_cars, tracker, parking_counter, car_counter_state, zones, timer=None):
+    """
+    Track this frame's detections and apply every zone crossing to the counters.
+    Kept free of any image work so detection traces can be replayed through it.
+    Returns the (object id, direction, zone name) of every crossing.
+    """
     objects, disappeared_ids = tracker.update(detected_cars)
+    if timer:
+        timer.lap("tracking")
 
     # Handle disappeared cars
     for object_id in disappeared_ids:
@@ -129,25 +62,41 @@ def process_frame(frame, car_detector, tracker, parking_counter, car_counter_sta
             parking_counter.decrement_count()
             car_counter_state.decrement()
 
+    crossings = []
+    for object_id, direction, zone in zones.track_crossings(tracker):
+        crossings.append((object_id, direction, zone["name"]))
+        if zone["counter"] != "feed":
+            continue
+        tracker.last_direction[object_id] = direction
+        if direction == "towards":
+            # Car coming towards camera - increment count
+            parking_counter.increment_count()
+            car_counter_state.increment()
+        else:
+            # Car going away from camera - decrement count
+            parking_counter.decrement_count()
+            car_counter_state.decrement()
     for object_id, centroid in objects.items():
-        prev_centroid = tracker.previous_positions.get(object_id, None)
-        if prev_centroid is not None:
-            prev_cx, prev_cy = prev_centroid
-            cx, cy = centroid
-            if prev_cy < center_y <= cy:
-                # Car coming towards camera crossing line - increment count
-                parking_counter.increment_count()
-                tracker.last_direction[object_id] = "towards"
-                car_counter_state.increment()
-            elif prev_cy > center_y >= cy:
-                # Car going away from camera crossing line - decrement count
-                parking_counter.decrement_count()
-                tracker.last_direction[object_id] = "away"
-                car_counter_state.decrement()
         tracker.previous_positions[object_id] = centroid
-
-    # Draw horizontal line
-    draw_line(frame, center_y)
+    if timer:
+        timer.lap("counting")
+    return crossings
+
+def process_frame(frame, car_detector, tracker, parking_counter, car_counter_state, update_callback=None, timer=None,
+                  tracked=None, zones=None):
+    if zones is None:
+        zones = ZoneSet.default(frame.shape[1::-1])
+
+    detected_cars, scores = car_detector.detect_cars_with_scores(frame)
+    if timer:
+        timer.lap("inference")
+    crossings = update_counts(detected_cars, tracker, parking_counter, car_counter_state, zones, timer)
+    if tracked is not None:
+        # (object id, box, confidence) of the cars seen in this frame, for best-shot ANPR
+        tracked.extend(tracked_detections(tracker, detected_cars, scores))
+
+    # Draw the counting lines and zones
+    zones.draw(frame)
 
     # Draw bounding boxes
     for (x, y, w, h) in detected_cars:
@@ -155,133 +104,171 @@ def process_frame(frame, car_detector, tracker, parking_counter, car_counter_sta
 
     # Display total cars counted
     cv2.putText(frame, f"Total Cars: {car_counter_state.total_cars_counted}", (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
-    return car_counter_state.total_cars_counted
+    if timer:
+        timer.lap("drawing")
+    # Crossing cars with their boxes, for stages such as ANPR that look at the car itself
+    return [(object_id, direction, box_of(detected_cars, tracker.objects[object_id]), zone)
+            for object_id, direction, zone in crossings]
 
 class AsyncFrameProcessor:
-    def __init__(self, feed_id, video_source, detector, tracker, parking_counter, frame_skip=3):
+    def __init__(self, feed_id, video_source, detector, tracker, parking_counter, frame_skip=3, anpr=None, zones=None):
         self.feed_id = feed_id
         self.video_source = video_source
         self.detector = detector
         self.tracker = tracker
         self.parking_counter = parking_counter
         self.frame_skip = frame_skip
+        self.zones = zones or ZoneSet.default(PROCESS_SIZE)
         
-        # Thread-safe frame buffer
-        self.frame_buffer = queue.Queue(maxsize=60)
-        self.result_buffer = queue.Queue(maxsize=30)
+        # Capture runs on its own thread and only keeps the newest frame, downscaled on
+        # capture, so the processing thread never works through a backlog of stale frames
+        self.reader = LatestFrameReader(feed_id, video_source, target_size=PROCESS_SIZE)
+
+        # Two preallocated working frames: one is drawn on while the other is on display
+        width, height = PROCESS_SIZE
+        self.work_pool = FramePool(feed_id, "work", (height, width, 3), count=2)
+        self.result_lock = threading.Lock()
+        self.latest_result = None
+        self.latest_captured_at = None
+        self.timer = FrameTimer(feed_id)
+
+        # With ANPR, every processed frame is also copied at source resolution, so cars
+        # can be cropped sharply without decoding or detecting anything a second time.
+        # The best crops of each car are kept until it leaves, then sent to ANPR.
+        self.anpr = anpr
+        self.full_pool = None
+        self.best_shots = BestShotBuffer(keep=anpr.best_shots) if anpr is not None else None
         
         # Thread control
         self.running = False
-        self.capture_thread = None
         self.processing_thread = None
         
-        # Frame counter for sampling
-        self.frame_counter = 0
-        
-        # Video capture
-        self.cap = cv2.VideoCapture(video_source)
-        if not self.cap.isOpened():
-            raise ValueError(f"Could not open video source: {video_source}")
+        # Sequence number of the last captured frame that was processed
+        self.last_seq = 0
             
     def start(self):
         """Start the async processing threads"""
         self.running = True
-        self.capture_thread = threading.Thread(target=self._capture_frames, daemon=True)
-        self.processing_thread = threading.Thread(target=self._process_frames_async, daemon=True)
-        self.capture_thread.start()
+        self.reader.start()
+        self.processing_thread = threading.Thread(target=self._process_frames_async, name=f"counter-feed-{self.feed_id}", daemon=True)
         self.processing_thread.start()
         
     def stop(self):
         """Stop all processing threads"""
         self.running = False
-        if self.capture_thread:
-            self.capture_thread.join(timeout=1)
+        self.reader.stop()
         if self.processing_thread:
             self.processing_thread.join(timeout=1)
-        if self.cap:
-            self.cap.release()
-            
-    def _capture_frames(self):
-        """Background thread for capturing frames from video source"""
-        while self.running:
-            try:
-                ret, frame = self.cap.read()
-                if not ret:
-                    # Try to reopen the video source
-                    self.cap.release()
-                    self.cap = cv2.VideoCapture(self.video_source)
-                    time.sleep(0.1)
-                    continue
-                    
-                # Add frame to buffer (non-blocking)
-                try:
-                    self.frame_buffer.put_nowait(frame)
-                except queue.Full:
-                    # Remove oldest frame if buffer is full
-                    try:
-                        self.frame_buffer.get_nowait()
-                        self.frame_buffer.put_nowait(frame)
-                    except queue.Empty:
-                        pass
-                        
-            except Exception as e:
-                print(f"Error in frame capture for {self.feed_id}: {e}")
-                time.sleep(0.1)
+        self.work_pool.close()
+        if self.full_pool is not None:
+            self.full_pool.close()
+        if self.anpr is not None:
+            self.anpr.disable(self.feed_id)
+        if self.detector.trace is not None:
+            self.detector.trace.close()
+        inference_scheduler.unregister(self.feed_id)
                 
     def _process_frames_async(self):
         """Background thread for processing frames with detection and counting"""
         while self.running:
             try:
-                # Get frame from buffer with timeout
-                frame = self.frame_buffer.get(timeout=1)
-                
-                # Frame sampling - process only 1 in every N frames
-                self.frame_counter += 1
-                if self.frame_counter % self.frame_skip != 0:
+                # Wait until the scheduler wants the next frame of this feed
+                inference_scheduler.pace(self.feed_id)
+
+                # Frame sampling - wait until at least N new frames were captured,
+                # then always take the newest one
+                processed_frame = self.work_pool.next()
+                full_frame = self._full_frame()
+                seq, captured_at = self.reader.read_into(processed_frame, self.last_seq + self.frame_skip - 1, timeout=1,
+                                                         full_dst=full_frame)
+                if captured_at is None:
                     continue
-                    
-                # Resize frame for faster processing
-                processed_frame = cv2.resize(frame, (640, 480))
+                self.last_seq = seq
+                self.detector.frame_index = seq
+                self.timer.begin(captured_at)
                 
-                # Perform detection and counting
-                process_frame(
-                    processed_frame, 
-                    self.detector, 
-                    self.tracker, 
-                    self.parking_counter, 
-                    car_counter_state
-                )
+                # Perform detection and counting in one of the shared inference slots
+                tracked = [] if full_frame is not None else None
+                with inference_scheduler.slot(self.feed_id) as schedule:
+                    self.detector.imgsz = schedule.imgsz
+                    crossings = process_frame(
+                        processed_frame, 
+                        self.detector, 
+                        self.tracker, 
+                        self.parking_counter, 
+                        car_counter_state,
+                        timer=self.timer,
+                        tracked=tracked,
+                        zones=self.zones
+                    )
+                FRAMES_PROCESSED.labels(self.feed_id).inc()
+                for object_id, direction, _, zone in crossings:
+                    event_bus.publish(CrossingEvent(self.feed_id, object_id, direction, zone))
+                if full_frame is not None:
+                    self._collect_shots(crossings, tracked, full_frame)
                 
-                # Add result to buffer for display
-                try:
-                    self.result_buffer.put_nowait(processed_frame)
-                except queue.Full:
-                    # Remove oldest result if buffer is full
-                    try:
-                        self.result_buffer.get_nowait()
-                        self.result_buffer.put_nowait(processed_frame)
-                    except queue.Empty:
-                        pass
+                # Publish the result for display
+                with self.result_lock:
+                    self.latest_result = processed_frame
+                    self.latest_captured_at = captured_at
+                QUEUE_DEPTH.labels(self.feed_id, "result_buffer").set(1)
                         
-            except queue.Empty:
-                continue
             except Exception as e:
                 print(f"Error in frame processing for {self.feed_id}: {e}")
                 time.sleep(0.1)
                 
-    def get_latest_frame(self):
-        """Get the latest processed frame for display"""
-        try:
-            return self.result_buffer.get_nowait()
-        except queue.Empty:
+    def _full_frame(self):
+        """Source resolution buffer for ANPR crops, once the source size is known"""
+        if self.anpr is None:
+            return None
+        shape = self.reader.full_shape
+        if shape is None:
             return None
+        if self.full_pool is None or self.full_pool.shape != tuple(shape):
+            if self.full_pool is not None:
+                self.full_pool.close()
+            self.full_pool = FramePool(self.feed_id, "full", shape, count=1)
+        return self.full_pool.next()
+
+    def _collect_shots(self, crossings, tracked, full_frame):
+        """Keep the best full resolution crops of every car, and hand them to ANPR once a counted car leaves"""
+        scale_x = full_frame.shape[1] / PROCESS_SIZE[0]
+        scale_y = full_frame.shape[0] / PROCESS_SIZE[1]
+        self.best_shots.observe(full_frame, tracked, scale_x, scale_y)
+        released = []
+        for object_id, direction, _, _ in crossings:
+            released.extend(self.best_shots.crossed(object_id, direction))
+        released.extend(self.best_shots.finished(self.tracker.objects))
+        for _, direction, crossed_at, crops in released:
+            self.anpr.submit(self.feed_id, crops, direction, crossed_at)
+        self.timer.lap("anpr_shots")
+
+    def get_latest_frame(self):
+        """Get the latest processed frame for display, or None if nothing new was processed"""
+        return self.get_latest_result()[0]
+
+    def get_latest_result(self):
+        """Get (frame, captured_at) of the latest processed frame, or (None, None)"""
+        with self.result_lock:
+            frame, self.latest_result = self.latest_result, None
+            captured_at = self.latest_captured_at
+        QUEUE_DEPTH.labels(self.feed_id, "result_buffer").set(0)
+        return frame, captured_at
             
     def is_running(self):
         """Check if processor is running"""
-        return self.running and self.capture_thread.is_alive() and self.processing_thread.is_alive()
+        return self.running and self.reader.is_alive() and self.processing_thread.is_alive()
+
+    def capture_status(self):
+        """Capture health and how old the newest frame is"""
+        return self.reader.status()
 
 
-def main(target_feed_id=None, update_frame_callback=None):
+def main(target_feed_id=None, update_frame_callback=None, anpr_default=False):
+    """
+    Run the counter feeds, or just one. A feed reads plates when its `anpr` is set, or
+    by `anpr_default` when it is not, as for the standalone ANPR process.
+    """
     processors = []
     
     # Load config from JSON file
@@ -289,19 +276,37 @@ def main(target_feed_id=None, update_frame_callback=None):
         car_counter_config = json.load(f)
 
     counter_feeds = [feed for feed in car_counter_config['feeds'] if feed['type'] == 'counter']
+    if target_feed_id is not None:
+        counter_feeds = [feed for feed in counter_feeds if feed['id'] == target_feed_id]
+    start_count_sink()
 
     # Initialize async processors for each video source
     for feed in counter_feeds:
         source = feed['video_source']
-        source = os.path.abspath(os.path.join(os.path.dirname(CONFIG_PATH), '..', source))
 
-        detector = CarDetector()
+        # Model and threshold as tuned for this feed by bench.tune, if it was
+        tuning = feed.get('tuning') or {}
+        detector = CarDetector.from_config(tuning)
         detector.load_model()
+        # Optionally record every detection result for offline tracker and counter tests
+        detector.trace = open_feed_trace(feed, "counter", PROCESS_SIZE)
 
         tracker = CentroidTracker(max_disappeared=10)
 
         parking_counter = ParkingCounter(0, 0)
 
+        inference_scheduler.register(feed)
+
+        # Feeds with "anpr": true read the plates of the cars they count
+        anpr = None
+        if feed.get('anpr', anpr_default):
+            # Imported here so only deployments that use ANPR pay for its dependencies
+            from .anpr import anpr_service
+            anpr = anpr_service
+            anpr.enable(feed)
+
+        # A source that cannot be opened is retried in the background by its
+        # reader, so one bad camera never keeps the others from starting
         try:
             processor = AsyncFrameProcessor(
                 feed_id=feed['id'],
@@ -309,35 +314,38 @@ def main(target_feed_id=None, update_frame_callback=None):
                 detector=detector,
                 tracker=tracker,
                 parking_counter=parking_counter,
-                frame_skip=3  # Process 1 in every 3 frames
+                frame_skip=tuning.get('frame_skip', 3),  # Process 1 in every 3 frames unless tuned
+                anpr=anpr,
+                zones=ZoneSet.from_config(feed.get('zones'), PROCESS_SIZE)
             )
-            processor.start()
-            processors.append(processor)
-        except ValueError as e:
+        except MemoryError as e:
             print(f"Error initializing processor for {feed['id']}: {e}")
+            # Release what was set up for the feed, as the processor's stop() would have
+            if anpr is not None:
+                anpr.disable(feed['id'])
+            if detector.trace is not None:
+                detector.trace.close()
+            inference_scheduler.unregister(feed['id'])
             continue
+        processor.start()
+        processors.append(processor)
 
-    # Main display loop - non-blocking
-    while True:
+    # Main display loop - non-blocking, and headless so it also runs on servers without a display
+    while processors:
         for processor in processors[:]:  # Use slice to allow removal during iteration
             if not processor.is_running():
                 processors.remove(processor)
                 continue
                 
-            frame = processor.get_latest_frame()
+            frame, captured_at = processor.get_latest_result()
             if frame is not None and update_frame_callback:
-                update_frame_callback(processor.feed_id, frame)
+                update_frame_callback(processor.feed_id, frame, captured_at)
 
-        if cv2.waitKey(30) & 0xFF == ord('q'):  # Reduced wait time for smoother display
-            break
-            
-        time.sleep(0.01)  # Small sleep to prevent CPU overload
+        time.sleep(0.03)  # Small sleep to prevent CPU overload
 
     # Cleanup
     for processor in processors:
         processor.stop()
 
-    cv2.destroyAllWindows()
-
 if __name__ == "__main__":
     main()
\ No newline at end of file
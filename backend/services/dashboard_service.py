@@ -1,7 +1,7 @@
 import json
 import os
 
-CONFIG_PATH = os.path.join(os.path.dirname(__file__), "..", "config", "feeds_config.json")
+CONFIG_PATH = os.environ.get("FEEDS_CONFIG", os.path.join(os.path.dirname(__file__), "..", "config", "feeds_config.json"))
 
 def load_config():
     with open(CONFIG_PATH, "r") as f:
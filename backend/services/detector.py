@@ -4,21 +4,59 @@ class CarDetector:
     def __init__(self, model_name='yolov8n.pt'):
         self.model_name = model_name
         self.model = None
+        # Inference input size, lowered by the scheduler when shedding load
+        self.imgsz = 640
+        self.conf = 0.5
+        # Optional trace.TraceWriter; every detection result is written to it under frame_index
+        self.trace = None
+        self.frame_index = 0
+
+    @classmethod
+    def from_config(cls, settings=None):
+        """From the `tuning` block of a feed, as written by bench.tune; the defaults without one"""
+        settings = settings or {}
+        detector = cls(settings.get('model', 'yolov8n.pt'))
+        detector.imgsz = settings.get('imgsz', detector.imgsz)
+        detector.conf = settings.get('conf', detector.conf)
+        return detector
 
     def load_model(self):
         self.model = YOLO(self.model_name)
 
-    def detect_cars(self, frame):
-        results = self.model(frame, verbose=False)
+    def _cars(self, result):
+        """([x, y, w, h] boxes, confidences) of the cars in one YOLO result"""
+        detected_cars = []
+        scores = []
+        boxes = result.boxes.xyxy.cpu().numpy()  # Bounding boxes
+        confidences = result.boxes.conf.cpu().numpy()  # Confidence scores
+        class_ids = result.boxes.cls.cpu().numpy()  # Class IDs
+        for box, conf, cls in zip(boxes, confidences, class_ids):
+            if conf > self.conf and int(cls) == 2:  # Class 2 is car in COCO dataset
+                x1, y1, x2, y2 = map(int, box)
+                w = x2 - x1
+                h = y2 - y1
+                detected_cars.append([x1, y1, w, h])
+                scores.append(float(conf))
+        return detected_cars, scores
+
+    def detect_cars_with_scores(self, frame):
+        """Detected cars as ([x, y, w, h] boxes, confidences)"""
+        results = self.model(frame, imgsz=self.imgsz, verbose=False)
         detected_cars = []
+        scores = []
         for result in results:
-            boxes = result.boxes.xyxy.cpu().numpy()  # Bounding boxes
-            confidences = result.boxes.conf.cpu().numpy()  # Confidence scores
-            class_ids = result.boxes.cls.cpu().numpy()  # Class IDs
-            for box, conf, cls in zip(boxes, confidences, class_ids):
-                if conf > 0.5 and int(cls) == 2:  # Class 2 is car in COCO dataset
-                    x1, y1, x2, y2 = map(int, box)
-                    w = x2 - x1
-                    h = y2 - y1
-                    detected_cars.append([x1, y1, w, h])
-        return detected_cars
+            boxes, confidences = self._cars(result)
+            detected_cars.extend(boxes)
+            scores.extend(confidences)
+        if self.trace is not None:
+            self.trace.write(self.frame_index, detected_cars, scores)
+        return detected_cars, scores
+
+    def detect_cars_batch(self, frames):
+        """([x, y, w, h] boxes, confidences) for each of several images, in one call to the model"""
+        if not frames:
+            return []
+        return [self._cars(result) for result in self.model(list(frames), imgsz=self.imgsz, verbose=False)]
+
+    def detect_cars(self, frame):
+        return self.detect_cars_with_scores(frame)[0]
@@ -0,0 +1,260 @@
+"""
+In-process event bus between the pipelines and everything that reacts to what they see.
+
+The counting loops and ANPR workers publish typed events once; sinks such as the feeds
+config, the plate store, Google Sheets, the CSV log, the event history and SSE clients
+subscribe to the types they want. Every subscription has a bounded queue of its own and
+a policy for when that queue is full, so a slow sink loses or coalesces its own events
+instead of slowing the publisher:
+
+    drop_oldest  make room by dropping the oldest waiting event (default)
+    drop_newest  drop the event being published
+    latest       keep only the newest event per key, e.g. the count of each feed
+    block        wait up to `block_timeout` for room, then drop; only for publishers
+                 that may wait, such as ANPR workers, never for a frame loop
+
+A subscription with a handler gets a thread of its own that calls the handler with
+batches of up to `batch_size` events; one without a handler is drained by its owner
+with `get_batch`, as the SSE endpoint does.
+"""
+import threading
+import time
+from collections import OrderedDict, deque
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+
+from .metrics import registry, QUEUE_DEPTH, EVENTS_PUBLISHED, EVENTS_DROPPED
+
+POLICIES = ("drop_oldest", "drop_newest", "latest", "block")
+
+
+@dataclass(frozen=True)
+class CrossingEvent:
+    """A tracked car crossed one of a feed's counting lines or zones"""
+    kind = "crossing"
+    feed_id: int
+    object_id: int
+    direction: str
+    zone: str = None
+    at: datetime = field(default_factory=datetime.now)
+
+    @property
+    def key(self):
+        return self.feed_id
+
+
+@dataclass(frozen=True)
+class CountEvent:
+    """The global car count of the counter feeds changed"""
+    kind = "count"
+    total: int
+    at: datetime = field(default_factory=datetime.now)
+
+    @property
+    def key(self):
+        return "global"
+
+
+@dataclass(frozen=True)
+class OccupancyEvent:
+    """The free slots of a multicam feed changed"""
+    kind = "occupancy"
+    feed_id: int
+    available_slots: int
+    total_slots: int
+    at: datetime = field(default_factory=datetime.now)
+
+    @property
+    def key(self):
+        return self.feed_id
+
+
+@dataclass(frozen=True)
+class PlateEvent:
+    """ANPR read the plate of a counted car"""
+    kind = "plate"
+    feed_id: int
+    plate: str
+    location: str
+    direction: str
+    confidence: float = None
+    image: str = None
+    at: datetime = field(default_factory=datetime.now)
+
+    @property
+    def key(self):
+        return self.plate
+
+
+EVENT_TYPES = {cls.kind: cls for cls in (CrossingEvent, CountEvent, OccupancyEvent, PlateEvent)}
+
+
+def event_dict(event):
+    """JSON-ready dict of an event, with its kind"""
+    data = asdict(event)
+    data["at"] = event.at.isoformat(timespec="milliseconds")
+    data["kind"] = event.kind
+    return data
+
+
+class Subscription:
+    """A subscriber's bounded queue of events; see the module docstring for the policies"""
+    def __init__(self, name, types=None, max_queue=1000, policy="drop_oldest", batch_size=100, max_wait=0.2,
+                 block_timeout=1.0):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown backpressure policy: {policy} (known: {', '.join(POLICIES)})")
+        self.name = name
+        self.types = tuple(types) if types else None
+        self.max_queue = max(1, max_queue)
+        self.policy = policy
+        self.batch_size = max(1, batch_size)
+        self.max_wait = max_wait
+        self.block_timeout = block_timeout
+        self._events = OrderedDict() if policy == "latest" else deque()
+        self._cond = threading.Condition()
+        self.closed = False
+        self.dropped = 0
+        self.thread = None
+
+    def __len__(self):
+        return len(self._events)
+
+    def wants(self, event):
+        return self.types is None or isinstance(event, self.types)
+
+    def offer(self, event):
+        """Queue an event by the subscription's policy; False if it or an older one was dropped"""
+        with self._cond:
+            if self.closed:
+                return False
+            kept = True
+            if self.policy == "latest":
+                self._events.pop(event.key, None)
+                self._events[event.key] = event
+                if len(self._events) > self.max_queue:
+                    self._events.popitem(last=False)
+                    kept = False
+            elif len(self._events) < self.max_queue:
+                self._events.append(event)
+            elif self.policy == "drop_oldest":
+                self._events.popleft()
+                self._events.append(event)
+                kept = False
+            elif self.policy == "block" and self._cond.wait_for(
+                    lambda: len(self._events) < self.max_queue or self.closed, self.block_timeout) and not self.closed:
+                self._events.append(event)
+            else:
+                kept = False
+            if not kept:
+                self.dropped += 1
+                EVENTS_DROPPED.labels(self.name).inc()
+            self._cond.notify_all()
+            return kept
+
+    def get_batch(self, timeout=None):
+        """
+        Up to `batch_size` events, waiting up to `timeout` for the first and then up to
+        `max_wait` for more to fill the batch; [] on timeout or once closed
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._events or self.closed, timeout) or self.closed:
+                return []
+            deadline = time.monotonic() + self.max_wait
+            while len(self._events) < self.batch_size and not self.closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self._cond.wait(remaining):
+                    break
+            batch = []
+            while self._events and len(batch) < self.batch_size:
+                if self.policy == "latest":
+                    batch.append(self._events.popitem(last=False)[1])
+                else:
+                    batch.append(self._events.popleft())
+            self._cond.notify_all()
+            return batch
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+    def run(self, handler):
+        """Feed batches to a handler until closed; the subscription's thread"""
+        while not self.closed:
+            batch = self.get_batch(timeout=1.0)
+            if not batch:
+                continue
+            try:
+                handler(batch)
+            except Exception as e:
+                print(f"❌ Event sink {self.name} failed on {len(batch)} events: {e}")
+
+
+class EventBus:
+    """Publishes events to every subscription that wants them; see the module docstring"""
+    def __init__(self):
+        self._subscriptions = ()
+        self._lock = threading.Lock()
+        registry.add_collector(self._collect_metrics)
+
+    def subscribe(self, name, handler=None, types=None, **options):
+        """
+        Subscribe to events of the given types (all if None). With a handler, the events
+        are passed to it in batches on a thread of the subscription's own.
+        """
+        subscription = Subscription(name, types, **options)
+        if handler is not None:
+            subscription.thread = threading.Thread(target=subscription.run, args=(handler,),
+                                                   name=f"events-{name}", daemon=True)
+            subscription.thread.start()
+        with self._lock:
+            # Replaced rather than changed, so publishing never takes the lock
+            self._subscriptions = self._subscriptions + (subscription,)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        subscription.close()
+        with self._lock:
+            self._subscriptions = tuple(s for s in self._subscriptions if s is not subscription)
+
+    def subscribed(self, name):
+        return any(s.name == name for s in self._subscriptions)
+
+    def publish(self, event):
+        EVENTS_PUBLISHED.labels(event.kind).inc()
+        for subscription in self._subscriptions:
+            if subscription.wants(event):
+                subscription.offer(event)
+
+    def _collect_metrics(self):
+        depths = {}
+        for subscription in self._subscriptions:
+            depths[subscription.name] = depths.get(subscription.name, 0) + len(subscription)
+        for name, depth in depths.items():
+            QUEUE_DEPTH.labels("events", name).set(depth)
+
+
+class EventHistory:
+    """The most recent events of every kind, kept in memory for the API"""
+    def __init__(self, bus, maxlen=1000):
+        self.bus = bus
+        self.events = deque(maxlen=maxlen)
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if not self.bus.subscribed("history"):
+                self.bus.subscribe("history", self._append, max_queue=self.events.maxlen)
+
+    def _append(self, events):
+        self.events.extend(events)
+
+    def recent(self, kind=None, limit=100):
+        """Newest first"""
+        events = [event for event in reversed(self.events) if kind is None or event.kind == kind]
+        return events[:limit]
+
+
+# This single bus is shared by every pipeline and sink in the process
+event_bus = EventBus()
+event_history = EventHistory(event_bus)
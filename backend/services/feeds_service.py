@@ -2,7 +2,9 @@ import os
 import json
 from threading import Lock
 
-CONFIG_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'config', 'feeds_config.json'))
+from .events import event_bus, CountEvent, OccupancyEvent
+
+CONFIG_PATH = os.environ.get('FEEDS_CONFIG', os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'config', 'feeds_config.json')))
 lock = Lock()
 
 def _load_config():
@@ -70,3 +72,27 @@ def update_feed_initial_count(feed_id, count):
         if updated:
             _save_config(config)
         return updated
+
+def save_counts(events):
+    """Write the newest global count and free slots of a batch of count and occupancy events to the config"""
+    with lock:
+        config = _load_config()
+        slots = {event.feed_id: event for event in events if isinstance(event, OccupancyEvent)}
+        for feed in config["feeds"]:
+            if feed.get("id") in slots:
+                feed["availableSlots"] = slots[feed["id"]].available_slots
+                feed["totalSlots"] = slots[feed["id"]].total_slots
+        for event in events:
+            if isinstance(event, CountEvent):
+                config["global_car_count"] = event.total
+        _save_config(config)
+
+def start_count_sink():
+    """
+    Keep the counts in the config up to date from the event bus. Only the newest count
+    per feed is kept while the config is being written, so the pipelines never wait.
+    """
+    with lock:
+        if not event_bus.subscribed("feeds-config"):
+            event_bus.subscribe("feeds-config", save_counts, types=(CountEvent, OccupancyEvent),
+                                policy="latest", max_wait=0.5)
@@ -0,0 +1,110 @@
+import json
+import os
+import numpy as np
+from threading import Lock
+
+CONFIG_PATH = os.environ.get('FEEDS_CONFIG', os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'config', 'feeds_config.json')))
+DEFAULT_FRAME_MEMORY_MB = 1024
+
+
+def _load_limit_bytes():
+    """Frame memory budget from `frame_memory_mb` in the feeds config, falling back to the default"""
+    try:
+        with open(CONFIG_PATH, 'r') as f:
+            limit_mb = json.load(f).get('frame_memory_mb', DEFAULT_FRAME_MEMORY_MB)
+    except (OSError, ValueError):
+        limit_mb = DEFAULT_FRAME_MEMORY_MB
+    return int(limit_mb * 1024 * 1024)
+
+
+class FrameMemoryBudget:
+    """
+    Process-wide accounting of every frame buffer the pipelines hold.
+
+    All long-lived frame arrays are allocated through `allocate()`, so the total stays
+    under a fixed limit and the memory held by each feed can be reported.
+    """
+    def __init__(self, limit_bytes):
+        self.limit_bytes = limit_bytes
+        self._lock = Lock()
+        # owner -> (feed_id, name, nbytes); keyed by owner, as one feed may have several pipelines
+        self._allocations = {}
+
+    def used_bytes(self):
+        with self._lock:
+            return self._used_bytes()
+
+    def _used_bytes(self):
+        return sum(nbytes for _, _, nbytes in self._allocations.values())
+
+    def allocate(self, owner, feed_id, name, shape, dtype=np.uint8):
+        """
+        Allocate (or re-allocate) the buffer held by `owner`, any hashable object such as
+        the FramePool it backs, raising MemoryError if over budget
+        """
+        nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        with self._lock:
+            previous = self._allocations.get(owner)
+            used = self._used_bytes() - (previous[2] if previous else 0)
+            if used + nbytes > self.limit_bytes:
+                raise MemoryError(
+                    f"Frame memory budget exceeded allocating {name} for feed {feed_id}: "
+                    f"{(used + nbytes) / 2**20:.1f} MB > {self.limit_bytes / 2**20:.1f} MB"
+                )
+            self._allocations[owner] = (feed_id, name, nbytes)
+        return np.empty(shape, dtype)
+
+    def free(self, owner):
+        """Release the buffer held by `owner`"""
+        with self._lock:
+            self._allocations.pop(owner, None)
+
+    def report(self):
+        with self._lock:
+            feeds = {}
+            for feed_id, name, nbytes in self._allocations.values():
+                feed = feeds.setdefault(str(feed_id), {"bytes": 0, "buffers": {}})
+                feed["bytes"] += nbytes
+                feed["buffers"][name] = feed["buffers"].get(name, 0) + nbytes
+            return {
+                "limitBytes": self.limit_bytes,
+                "usedBytes": self._used_bytes(),
+                "feeds": feeds,
+            }
+
+
+# This single budget is shared by every feed in the process
+frame_budget = FrameMemoryBudget(_load_limit_bytes())
+
+
+class FramePool:
+    """
+    A fixed set of preallocated frames of one shape, backed by a single budgeted block.
+    Buffers are handed out round-robin, so callers can double-buffer without allocating.
+    """
+    def __init__(self, feed_id, name, shape, count=2, dtype=np.uint8, budget=None):
+        self.feed_id = feed_id
+        self.name = name
+        self.shape = tuple(shape)
+        self.budget = budget or frame_budget
+        self._block = self.budget.allocate(self, feed_id, name, (count,) + self.shape, dtype)
+        self.buffers = [self._block[i] for i in range(count)]
+        self._next = 0
+
+    def __len__(self):
+        return len(self.buffers)
+
+    def next(self):
+        """Return the next buffer in rotation"""
+        buf = self.buffers[self._next]
+        self._next = (self._next + 1) % len(self.buffers)
+        return buf
+
+    def close(self):
+        self.budget.free(self)
+        self.buffers = []
+        self._block = None
+
+
+def get_memory_report():
+    return frame_budget.report()
@@ -0,0 +1,233 @@
+import asyncio
+import hashlib
+import os
+import random
+import re
+import threading
+import time
+
+import cv2
+
+from .metrics import GEMINI_REQUESTS, GEMINI_REQUEST_SECONDS
+
+SINGLE_PROMPT = """
+You are an expert vehicle license plate reader for Indian vehicles, specifically from Maharashtra.
+Analyze this image and extract the exact license plate number.
+- Respond with ONLY the alphanumeric characters of the plate number.
+- Do not include spaces, hyphens, or any other descriptions. For example, if you see 'MH 14 TC 1234', respond with 'MH14TC1234'.
+- If the license plate is unclear or you cannot read it confidently, respond with the single word: UNREADABLE
+"""
+
+PACKED_PROMPT = """
+You are an expert vehicle license plate reader for Indian vehicles, specifically from Maharashtra.
+You are given {count} license plate images, numbered 1 to {count} in the order they appear.
+For every image, write one line of the form "<number>: <plate>", for example "1: MH14TC1234".
+- Write the plate with ONLY its alphanumeric characters, without spaces or hyphens.
+- If a plate is unclear or you cannot read it confidently, write "<number>: UNREADABLE".
+- Write nothing else.
+"""
+
+_ANSWER_LINE = re.compile(r"^\s*(\d+)\s*[:.)-]\s*([A-Za-z0-9 -]+?)\s*$")
+
+
+def parse_packed_answer(text, count):
+    """Plate text per image from a packed answer; None where an image got no line"""
+    answers = [None] * count
+    for line in text.splitlines():
+        match = _ANSWER_LINE.match(line)
+        if not match:
+            continue
+        n = int(match.group(1))
+        if 1 <= n <= count:
+            answers[n - 1] = match.group(2)
+    return answers
+
+
+def parse_plate(answer):
+    """Plate characters of one answer, or "" if Gemini could not read it"""
+    if answer is None:
+        return ""
+    plate = ''.join(filter(str.isalnum, answer)).upper()
+    if "UNREADABLE" in plate or len(plate) < 6:
+        return ""
+    return plate
+
+
+class TokenBucket:
+    """Allows `rate` requests per second on average, with bursts of up to `burst`"""
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class GenaiTransport:
+    """Sends prompts and images to Gemini through one reused model handle"""
+    def __init__(self, model="gemini-1.5-flash-latest", api_key=None):
+        # Imported here so only deployments that use Gemini need its client library
+        import google.generativeai as genai
+        api_key = api_key or os.environ.get("GEMINI_API_KEY")
+        if not api_key:
+            raise RuntimeError("The Gemini client needs GEMINI_API_KEY to be set")
+        genai.configure(api_key=api_key)
+        self.model = genai.GenerativeModel(model)
+
+    async def generate(self, prompt, images):
+        from PIL import Image
+        parts = [prompt] + [Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB)) for image in images]
+        response = await self.model.generate_content_async(parts)
+        return response.text
+
+
+class StubTransport:
+    """
+    Local stand-in for Gemini: answers in Gemini's formats after `latency` seconds, with
+    `plate` for every image, or a made-up plate derived from the image bytes so different
+    crops get different answers. `fail_rate` of the requests raise, to exercise retries.
+    """
+    def __init__(self, plate=None, latency=0.3, fail_rate=0.0):
+        self.plate = plate
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.requests = 0
+
+    def _plate_for(self, image):
+        if self.plate is not None:
+            return self.plate
+        digest = int(hashlib.blake2b(image.tobytes(), digest_size=4).hexdigest(), 16)
+        return f"MH{digest % 50:02d}AB{digest % 10000:04d}"
+
+    async def generate(self, prompt, images):
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+        if random.random() < self.fail_rate:
+            raise ConnectionError("Simulated Gemini error")
+        if len(images) == 1 and "numbered" not in prompt:
+            return self._plate_for(images[0])
+        return "\n".join(f"{n}: {self._plate_for(image)}" for n, image in enumerate(images, 1))
+
+
+class GeminiPlateClient:
+    """
+    Reads plates with Gemini without tying up the caller for a round trip per plate.
+    Requests run on an asyncio loop of the client's own, at most `max_concurrency` at a
+    time and `rate` per second (bursting to `burst`), each with a `timeout` and up to
+    `retries` retries with backoff.
+
+    Plates from every caller, all workers and tiers sharing the client, are pooled for
+    up to `coalesce_ms` and sent `pack_size` to a request as soon as that many wait, so
+    workers escalating a plate or two each still fill packed requests. The numbered
+    answers are split back per plate; plates a packed answer missed are asked again one
+    by one.
+    """
+    def __init__(self, transport, max_concurrency=4, rate=2.0, burst=4, timeout=15.0, retries=2, pack_size=4,
+                 coalesce_ms=30):
+        self.transport = transport
+        self.max_concurrency = max(1, max_concurrency)
+        self.rate = rate
+        self.burst = burst
+        self.timeout = timeout
+        self.retries = retries
+        self.pack_size = max(1, pack_size)
+        self.coalesce_window = coalesce_ms / 1000.0
+        # (image, future) of the plates waiting to be packed; only touched on the client's loop
+        self._pending = []
+        self._flush_timer = None
+        self._tasks = set()
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="gemini-client", daemon=True)
+        self.thread.start()
+        # Created on the client's loop, which they belong to
+        self.semaphore, self.bucket = asyncio.run_coroutine_threadsafe(self._primitives(), self.loop).result()
+
+    async def _primitives(self):
+        return asyncio.Semaphore(self.max_concurrency), TokenBucket(self.rate, self.burst)
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout=2)
+
+    def read_batch(self, images):
+        """Plate text per image ("" where unreadable); safe to call from any thread"""
+        return asyncio.run_coroutine_threadsafe(self.read_many(images), self.loop).result()
+
+    async def read_many(self, images):
+        futures = [self.loop.create_future() for _ in images]
+        self._pending.extend(zip(images, futures))
+        if len(self._pending) >= self.pack_size:
+            self._flush(full_packs_only=True)
+        if self._pending and self._flush_timer is None:
+            self._flush_timer = self.loop.call_later(self.coalesce_window, self._flush)
+        return list(await asyncio.gather(*futures))
+
+    def _flush(self, full_packs_only=False):
+        """Send the waiting plates in packs; on the coalescing timer, the last partial pack too"""
+        if not full_packs_only and self._flush_timer is not None:
+            self._flush_timer = None
+        while self._pending and (len(self._pending) >= self.pack_size or not full_packs_only):
+            pack, self._pending = self._pending[:self.pack_size], self._pending[self.pack_size:]
+            task = self.loop.create_task(self._send(pack))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        if not self._pending and self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+
+    async def _send(self, pack):
+        try:
+            answers = await self._read_pack([image for image, _ in pack])
+        except Exception as e:
+            print(f"❌ [Gemini] Reading {len(pack)} plates failed: {e}")
+            answers = [""] * len(pack)
+        for (_, future), answer in zip(pack, answers):
+            if not future.done():
+                future.set_result(answer)
+
+    async def _read_pack(self, images):
+        if len(images) == 1:
+            return [parse_plate(await self._request(SINGLE_PROMPT, images))]
+        text = await self._request(PACKED_PROMPT.format(count=len(images)), images)
+        if text is None:
+            return [""] * len(images)
+        answers = parse_packed_answer(text, len(images))
+        missing = [i for i, answer in enumerate(answers) if answer is None]
+        if missing:
+            singles = await asyncio.gather(*(self._request(SINGLE_PROMPT, [images[i]]) for i in missing))
+            for i, single in zip(missing, singles):
+                answers[i] = single
+        return [parse_plate(answer) for answer in answers]
+
+    async def _request(self, prompt, images):
+        """Answer text of one request, or None once every retry failed"""
+        for attempt in range(self.retries + 1):
+            await self.bucket.acquire()
+            async with self.semaphore:
+                started = time.monotonic()
+                try:
+                    text = await asyncio.wait_for(self.transport.generate(prompt, images), self.timeout)
+                except asyncio.TimeoutError:
+                    GEMINI_REQUESTS.labels("timeout").inc()
+                    print(f"⚠️ [Gemini] Request for {len(images)} plates timed out after {self.timeout}s")
+                except Exception as e:
+                    GEMINI_REQUESTS.labels("error").inc()
+                    print(f"❌ [Gemini] Request for {len(images)} plates failed: {e}")
+                else:
+                    GEMINI_REQUESTS.labels("ok").inc()
+                    GEMINI_REQUEST_SECONDS.labels().observe(time.monotonic() - started)
+                    return text
+            if attempt < self.retries:
+                await asyncio.sleep(min(10.0, 0.5 * 2 ** attempt) * random.uniform(0.5, 1.0))
+        return None
@@ -1,49 +1,247 @@
-import gspread
-from google.oauth2.service_account import Credentials
-from datetime import datetime
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload
-import base64
+import csv
+import json
 import os
+import random
+import threading
+from datetime import datetime
+
+from .metrics import registry, QUEUE_DEPTH, SHEETS_ROWS_APPENDED, SHEETS_FLUSH_FAILURES
+
+SERVICE_DIR = os.path.dirname(os.path.abspath(__file__))
+CONFIG_PATH = os.environ.get('FEEDS_CONFIG', os.path.abspath(os.path.join(SERVICE_DIR, '..', 'config', 'feeds_config.json')))
+SERVICE_ACCOUNT_FILE = os.environ.get('GOOGLE_SERVICE_ACCOUNT', os.path.join(SERVICE_DIR, "service_account.json"))
+SHEET_URL = "https://docs.google.com/spreadsheets/d/19T6dYT7cOG1LN4vUJRad1fIOvtgv2mlzhYRy5rLUF50/edit?gid=0#gid=0"
+OUTBOX_FILE = os.path.join(SERVICE_DIR, "sheets_outbox.jsonl")
+# A sheet URL with this scheme is a local CSV file instead, e.g. local:///tmp/plates.csv
+LOCAL_SCHEME = "local://"
+
+
+def open_google_worksheet(url=SHEET_URL, service_account_file=SERVICE_ACCOUNT_FILE):
+    """First worksheet of a Google Sheet, authorised with the service account"""
+    # Imported here so the backend only needs the Google client libraries when it syncs
+    import gspread
+    from google.oauth2.service_account import Credentials
+    scopes = [
+        "https://www.googleapis.com/auth/spreadsheets",
+    ]
+    creds = Credentials.from_service_account_file(service_account_file, scopes=scopes)
+    client = gspread.authorize(creds)
+    return client.open_by_url(url).sheet1
+
+
+class LocalWorksheet:
+    """
+    Stand-in for a Google worksheet that keeps its rows in a local CSV file, for tests and
+    for running without Google access. `fail_next(n)` makes the next n appends raise, to
+    exercise the outbox and retries.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.appends = 0
+        self._failures = 0
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+    def fail_next(self, count=1):
+        self._failures = count
+
+    def col_values(self, col):
+        if not os.path.isfile(self.path):
+            return []
+        with open(self.path, 'r', newline='') as f:
+            return [row[col - 1] for row in csv.reader(f) if len(row) >= col]
+
+    def append_rows(self, rows, value_input_option=None):
+        if self._failures:
+            self._failures -= 1
+            raise ConnectionError("Simulated Google Sheets outage")
+        with open(self.path, 'a', newline='') as f:
+            csv.writer(f).writerows(rows)
+        self.appends += 1
 
-# ✅ Update Google Sheet
-def update_google_sheet(plate, status="enter", location="Section A"):
-    try:
-        scopes = [
-            "https://www.googleapis.com/auth/spreadsheets",
-        ]
 
-        creds = Credentials.from_service_account_file("service_account.json", scopes=scopes)
-        client = gspread.authorize(creds)
+def open_worksheet(url=SHEET_URL):
+    if url.startswith(LOCAL_SCHEME):
+        return LocalWorksheet(url[len(LOCAL_SCHEME):])
+    return open_google_worksheet(url)
 
-        # Define Google Sheet URLs
-        sheet1_url = "https://docs.google.com/spreadsheets/d/19T6dYT7cOG1LN4vUJRad1fIOvtgv2mlzhYRy5rLUF50/edit?gid=0#gid=0"
-        
 
-        # Load worksheets
-        sheet1 = client.open_by_url(sheet1_url).sheet1
-        
+class SheetsOutbox:
+    """
+    Plate events waiting to be written to the sheet, kept in a JSON lines file so none
+    are lost while Google is unreachable or the backend restarts. New events are appended;
+    once a batch is in the sheet, the file is rewritten without it.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._events = []
+        if os.path.isfile(path):
+            with open(path, 'r') as f:
+                for line in f:
+                    try:
+                        self._events.append(json.loads(line))
+                    except ValueError:
+                        continue  # A line cut short when the process was killed mid-write
 
-        # Get current date and time
-        now = datetime.now()
-        date_str = now.strftime("%Y-%m-%d")
-        time_str = now.strftime("%H:%M:%S")
+    def __len__(self):
+        with self._lock:
+            return len(self._events)
 
-        # Determine next IDs
-        id1 = len(sheet1.get_all_values())
+    def add(self, event):
+        with self._lock:
+            self._events.append(event)
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(self.path, 'a') as f:
+                f.write(json.dumps(event) + "\n")
 
+    def peek(self, count):
+        with self._lock:
+            return list(self._events[:count])
 
+    def remove(self, count):
+        """Drop the oldest `count` events once they are in the sheet"""
+        with self._lock:
+            del self._events[:count]
+            tmp = self.path + ".tmp"
+            with open(tmp, 'w') as f:
+                for event in self._events:
+                    f.write(json.dumps(event) + "\n")
+            os.replace(tmp, self.path)
 
-        # Row format: [id, plate, date, time, status, location, image]
-        new_row = [id1, plate, date_str, time_str, status.lower(), location]
 
-        # Append to both sheets
-        sheet1.append_row(new_row, value_input_option="USER_ENTERED")
+class SheetsSync:
+    """
+    Writes plate events to the Google Sheet in the background. `add()` only appends to the
+    on-disk outbox, so callers never wait on the network. A sync thread keeps one open
+    worksheet and a local count of its rows, and appends the outbox in batches with a
+    single `append_rows` call every `flush_interval` seconds, or sooner once `batch_size`
+    events are waiting. When a write fails it backs off exponentially, up to
+    `max_backoff` seconds, and reconnects before trying again.
 
+    Settings under `sheets` in the feeds config: url, flush_interval_s (default 5),
+    batch_size (default 100), max_backoff_s (default 300).
+    """
+    def __init__(self, url=SHEET_URL, outbox_path=OUTBOX_FILE, flush_interval=5.0, batch_size=100,
+                 max_backoff=300.0, open_worksheet=open_worksheet):
+        self.url = url
+        self.outbox = SheetsOutbox(outbox_path)
+        self.flush_interval = flush_interval
+        self.batch_size = max(1, batch_size)
+        self.max_backoff = max_backoff
+        self.open_worksheet = open_worksheet
+        self.worksheet = None
+        self.next_id = None
+        self.failures = 0
+        self.running = False
+        self.thread = None
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
 
-        print(f"✅ Google Sheets updated: {plate} ({status}) at {date_str} {time_str}")
+    @classmethod
+    def from_config(cls, config_path=CONFIG_PATH):
+        try:
+            with open(config_path, 'r') as f:
+                settings = json.load(f).get('sheets', {})
+        except (OSError, ValueError):
+            settings = {}
+        return cls(
+            url=settings.get('url', SHEET_URL),
+            flush_interval=settings.get('flush_interval_s', 5.0),
+            batch_size=settings.get('batch_size', 100),
+            max_backoff=settings.get('max_backoff_s', 300.0),
+        )
 
-    except Exception as e:
-        import traceback
-        traceback.print_exc()
-        print(f"❌ Google Sheet update failed: {e}")
+    def start(self):
+        with self._lock:
+            if self.running:
+                return
+            self.running = True
+            self.thread = threading.Thread(target=self._run, name="sheets-sync", daemon=True)
+            self.thread.start()
+            registry.add_collector(self._collect_metrics)
+
+    def stop(self, flush=True):
+        """Stop the sync thread, first trying once more to write what is waiting"""
+        self.running = False
+        self._wake.set()
+        if self.thread is not None:
+            self.thread.join(timeout=10)
+            self.thread = None
+        if flush:
+            while len(self.outbox) and self.flush():
+                pass
+
+    def add(self, plate, status="enter", location="Section A", when=None):
+        """Queue a plate event for the sheet; never blocks on the network"""
+        when = when or datetime.now()
+        self.outbox.add({
+            "plate": plate,
+            "date": when.strftime("%Y-%m-%d"),
+            "time": when.strftime("%H:%M:%S"),
+            "status": status.lower(),
+            "location": location,
+        })
+        self.start()
+        if len(self.outbox) >= self.batch_size and not self.failures:
+            self._wake.set()
+
+    def _connect(self):
+        if self.worksheet is None:
+            self.worksheet = self.open_worksheet(self.url)
+            # One column is enough to count the rows; the header row takes id 0
+            self.next_id = len(self.worksheet.col_values(1))
+
+    def flush(self):
+        """Write one batch from the outbox to the sheet; False if that failed"""
+        events = self.outbox.peek(self.batch_size)
+        if not events:
+            return True
+        try:
+            self._connect()
+            # Row format: [id, plate, date, time, status, location]
+            rows = [[self.next_id + i, e['plate'], e['date'], e['time'], e['status'], e['location']]
+                    for i, e in enumerate(events)]
+            self.worksheet.append_rows(rows, value_input_option="USER_ENTERED")
+        except Exception as e:
+            # The row count may be off after a failure, so it is read again on reconnect
+            self.worksheet = None
+            self.failures += 1
+            SHEETS_FLUSH_FAILURES.labels().inc()
+            print(f"❌ Google Sheet update failed ({len(events)} rows kept for retry): {e}")
+            return False
+        self.next_id += len(rows)
+        self.failures = 0
+        self.outbox.remove(len(events))
+        SHEETS_ROWS_APPENDED.labels().inc(len(rows))
+        print(f"✅ Google Sheets updated: {len(rows)} rows")
+        return True
+
+    def _backoff(self):
+        if not self.failures:
+            return self.flush_interval
+        # The exponent is capped so a long outage cannot overflow the float
+        delay = min(self.max_backoff, self.flush_interval * 2 ** min(self.failures, 20))
+        return delay * random.uniform(0.5, 1.0)
+
+    def _run(self):
+        while self.running:
+            self._wake.wait(self._backoff())
+            self._wake.clear()
+            if not self.running:
+                break
+            while len(self.outbox) and self.flush() and len(self.outbox) >= self.batch_size:
+                pass
+
+    def _collect_metrics(self):
+        QUEUE_DEPTH.labels("sheets", "outbox").set(len(self.outbox))
+
+
+# This single sync is shared by everything that writes plate events to the sheet
+sheets_sync = SheetsSync.from_config()
+
+
+# ✅ Update Google Sheet
+def update_google_sheet(plate, status="enter", location="Section A", when=None):
+    """Queue a plate event for the Google Sheet; it is written in the background"""
+    sheets_sync.add(plate, status, location, when)
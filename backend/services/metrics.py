@@ -0,0 +1,292 @@
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Latency buckets in seconds, roughly log-spaced from 0.5 ms to 10 s
+LATENCY_BUCKETS = (
+    0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.035, 0.05, 0.075,
+    0.1, 0.15, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+class _Histogram:
+    """
+    One labelled histogram series. `observe` is a bisect and two increments with no
+    locking, which is cheap enough for the per-frame hot loop. Each series is normally
+    written by a single pipeline thread.
+    """
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """Estimate a quantile by linear interpolation inside the matching bucket"""
+        return quantile_from_counts(self.bounds, self.counts, q)
+
+    def snapshot(self):
+        return list(self.counts), self.sum
+
+
+def quantile_from_counts(bounds, counts, q):
+    """Quantile estimate from per-bucket (non-cumulative) counts, e.g. the difference of two snapshots"""
+    total = sum(counts)
+    if total == 0:
+        return None
+    rank = q * total
+    seen = 0
+    for i, count in enumerate(counts):
+        if seen + count >= rank and count:
+            lower = bounds[i - 1] if i > 0 else 0.0
+            upper = bounds[i] if i < len(bounds) else bounds[-1]
+            return lower + (upper - lower) * (rank - seen) / count
+        seen += count
+    return bounds[-1]
+
+
+class _Counter:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class _Gauge:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+
+class Metric:
+    """A named metric family; `labels(...)` returns (and caches) the series for those label values"""
+    def __init__(self, kind, name, help_text, label_names=(), buckets=LATENCY_BUCKETS):
+        self.kind = kind
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def _new_series(self):
+        if self.kind == "histogram":
+            return _Histogram(self.buckets)
+        if self.kind == "counter":
+            return _Counter()
+        return _Gauge()
+
+    def labels(self, *values):
+        key = tuple(str(v) for v in values)
+        series = self._series.get(key)
+        if series is None:
+            with self._lock:
+                series = self._series.setdefault(key, self._new_series())
+        return series
+
+    def remove(self, *values):
+        with self._lock:
+            self._series.pop(tuple(str(v) for v in values), None)
+
+    def series(self):
+        with self._lock:
+            return list(self._series.items())
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for key, series in self.series():
+            if self.kind == "histogram":
+                cumulative = 0
+                counts = list(series.counts)
+                for bound, count in zip(self.buckets, counts):
+                    cumulative += count
+                    lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, ('le', repr(bound)))} {cumulative}")
+                cumulative += counts[-1]
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, ('le', '+Inf'))} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {series.sum}")
+                lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {cumulative}")
+            else:
+                lines.append(f"{self.name}{_format_labels(self.label_names, key)} {series.value}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def _register(self, kind, name, help_text, label_names, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = Metric(kind, name, help_text, label_names, **kwargs)
+                self._metrics[name] = metric
+            return metric
+
+    def histogram(self, name, help_text, label_names=(), buckets=LATENCY_BUCKETS):
+        return self._register("histogram", name, help_text, label_names, buckets=buckets)
+
+    def counter(self, name, help_text, label_names=()):
+        return self._register("counter", name, help_text, label_names)
+
+    def gauge(self, name, help_text, label_names=()):
+        return self._register("gauge", name, help_text, label_names)
+
+    def add_collector(self, collector):
+        """Register a function that refreshes gauges right before every scrape"""
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render(self):
+        with self._lock:
+            collectors = list(self._collectors)
+            metrics = list(self._metrics.values())
+        for collector in collectors:
+            try:
+                collector()
+            except Exception as e:
+                print(f"Error collecting metrics: {e}")
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# This single registry will be used everywhere
+registry = MetricsRegistry()
+
+STAGE_SECONDS = registry.histogram(
+    "pipeline_stage_seconds", "Time spent in each pipeline stage per frame", ("feed", "stage"))
+END_TO_END_SECONDS = registry.histogram(
+    "pipeline_end_to_end_seconds", "Time from frame capture until its JPEG was handed to a client", ("feed",))
+FRAMES_PROCESSED = registry.counter(
+    "pipeline_frames_processed_total", "Frames that went through detection and counting", ("feed",))
+FRAMES_DROPPED = registry.counter(
+    "pipeline_frames_dropped_total", "Captured frames that were replaced before anything read them", ("feed", "reason"))
+QUEUE_DEPTH = registry.gauge(
+    "pipeline_queue_depth", "Items waiting in a pipeline buffer", ("feed", "queue"))
+FRAME_AGE_SECONDS = registry.gauge(
+    "pipeline_frame_age_seconds", "Age of the newest captured frame", ("feed",))
+ANPR_DROPPED = registry.counter(
+    "anpr_tasks_dropped_total", "Car crops dropped because they could be neither queued nor spilled to disk", ("feed",))
+ANPR_SPILLED = registry.counter(
+    "anpr_tasks_spilled_total", "Car crops spilled to disk because the ANPR queue was full", ("feed",))
+ANPR_PROCESSED = registry.counter(
+    "anpr_tasks_processed_total", "Car crops through plate detection and OCR, by outcome", ("feed", "result"))
+ANPR_BATCH_SIZE = registry.histogram(
+    "anpr_batch_size", "Car crops per plate detection batch", (), buckets=(1, 2, 4, 8, 16, 32, 64))
+ANPR_OCR_IMAGES = registry.counter(
+    "anpr_ocr_images_total", "Plate images sent to each OCR backend", ("backend",))
+ANPR_OCR_SETTLED = registry.counter(
+    "anpr_ocr_settled_total", "Plate reads by the OCR backend whose read was kept", ("backend",))
+SHEETS_ROWS_APPENDED = registry.counter(
+    "sheets_rows_appended_total", "Plate events written to the Google Sheet", ())
+SHEETS_FLUSH_FAILURES = registry.counter(
+    "sheets_flush_failures_total", "Batched Google Sheet writes that failed and will be retried", ())
+GEMINI_REQUESTS = registry.counter(
+    "gemini_requests_total", "Gemini plate recognition requests, by outcome", ("result",))
+GEMINI_REQUEST_SECONDS = registry.histogram(
+    "gemini_request_seconds", "Round trip time of successful Gemini requests", ())
+ANPR_CACHE_LOOKUPS = registry.counter(
+    "anpr_plate_cache_lookups_total", "Plate read cache lookups, by hit or miss", ("result",))
+ANPR_CACHE_ENTRIES = registry.gauge(
+    "anpr_plate_cache_entries", "Plate reads held in the plate read cache", ())
+PLATE_STORE_ROWS = registry.counter(
+    "plate_store_rows_inserted_total", "Plate events written to the plate store", ())
+PLATE_IMAGES = registry.counter(
+    "plate_images_total", "Plate images by what became of them: written, deduplicated, dropped or evicted",
+    ("result",))
+PLATE_IMAGE_BYTES = registry.gauge(
+    "plate_images_bytes", "Disk space used by plate images and their thumbnails", ())
+EVENTS_PUBLISHED = registry.counter(
+    "events_published_total", "Events published on the event bus, by kind", ("kind",))
+EVENTS_DROPPED = registry.counter(
+    "events_dropped_total", "Events a subscriber's full queue dropped or replaced", ("subscriber",))
+OCCUPANCY_VERIFICATIONS = registry.counter(
+    "occupancy_verifications_total", "YOLO checks of slot occupancy, on the interval or after a change",
+    ("feed", "reason"))
+OCCUPANCY_CORRECTIONS = registry.counter(
+    "occupancy_corrections_total", "Slots whose state from image statistics a YOLO check overturned", ("feed",))
+TILES_INFERRED = registry.counter(
+    "tiled_inference_views_total", "Tiles of tiled inference, by whether they were inferred or skipped as unchanged",
+    ("feed", "result"))
+
+
+class FrameTimer:
+    """
+    Lap timer for one frame: `begin()` when a frame is taken, `lap(stage)` after every stage.
+    Carries the capture timestamp so the end-to-end latency can be measured downstream.
+    """
+    __slots__ = ("feed_id", "captured_at", "_last")
+
+    def __init__(self, feed_id):
+        self.feed_id = feed_id
+        self.captured_at = None
+        self._last = time.monotonic()
+
+    def begin(self, captured_at=None):
+        self.captured_at = captured_at
+        self._last = time.monotonic()
+
+    def lap(self, stage):
+        now = time.monotonic()
+        STAGE_SECONDS.labels(self.feed_id, stage).observe(now - self._last)
+        self._last = now
+
+
+def observe_stage(feed_id, stage, seconds):
+    STAGE_SECONDS.labels(feed_id, stage).observe(seconds)
+
+
+def render():
+    return registry.render()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_http_server(port, host="0.0.0.0"):
+    """Serve /metrics from a background thread, for scripts that run outside the Flask app"""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True)
+    thread.start()
+    return server
@@ -1,109 +1,35 @@
 import cv2
 from .detector import CarDetector
 from .counter import ParkingCounter
-from .utils import draw_line
+from .capture import LatestFrameReader
+from .frame_pool import FramePool
+from .scheduler import inference_scheduler
+from .metrics import FrameTimer, FRAMES_PROCESSED
+from .tracker import CentroidTracker
+from .trace import open_feed_trace
+from .slot_occupancy import SlotOccupancy
+from .zones import ZoneSet
+from .tiling import TiledDetector
+from .events import event_bus, CrossingEvent, OccupancyEvent
+from .feeds_service import start_count_sink
 
 import json
 import os
-import numpy as np
-
-CONFIG_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'config', 'feeds_config.json'))
-
-class CentroidTracker:
-    def __init__(self, max_disappeared=10):
-        self.next_object_id = 0
-        self.objects = {}
-        self.disappeared = {}
-        self.max_disappeared = max_disappeared
-        self.last_direction = {}
-        self.previous_positions = {}
-
-    def register(self, centroid):
-        self.objects[self.next_object_id] = centroid
-        self.disappeared[self.next_object_id] = 0
-        self.last_direction[self.next_object_id] = None
-        self.previous_positions[self.next_object_id] = centroid
-        self.next_object_id += 1
-
-    def deregister(self, object_id):
-        del self.objects[object_id]
-        del self.disappeared[object_id]
-        del self.last_direction[object_id]
-        del self.previous_positions[object_id]
-
-    def update(self, rects):
-        if len(rects) == 0:
-            disappeared_ids = []
-            for object_id in list(self.disappeared.keys()):
-                self.disappeared[object_id] += 1
-                if self.disappeared[object_id] > self.max_disappeared:
-                    disappeared_ids.append(object_id)
-                    self.deregister(object_id)
-            return self.objects, disappeared_ids
-
-        input_centroids = []
-        for (x, y, w, h) in rects:
-            cx = x + w // 2
-            cy = y + h // 2
-            input_centroids.append((cx, cy))
-
-        if len(self.objects) == 0:
-            for centroid in input_centroids:
-                self.register(centroid)
-            return self.objects, []
-
-        object_ids = list(self.objects.keys())
-        object_centroids = list(self.objects.values())
-
-        D = np.linalg.norm(np.array(object_centroids)[:, None] - np.array(input_centroids), axis=2)
-
-        rows = D.min(axis=1).argsort()
-        cols = D.argmin(axis=1)[rows]
-
-        assigned_rows = set()
-        assigned_cols = set()
-
-        for row, col in zip(rows, cols):
-            if row in assigned_rows or col in assigned_cols:
-                continue
-            if D[row, col] > 50:
-                continue
-            object_id = object_ids[row]
-            self.objects[object_id] = input_centroids[col]
-            self.disappeared[object_id] = 0
-            assigned_rows.add(row)
-            assigned_cols.add(col)
-
-        unassigned_rows = set(range(len(object_centroids))) - assigned_rows
-        for row in unassigned_rows:
-            object_id = object_ids[row]
-            self.disappeared[object_id] += 1
-            if self.disappeared[object_id] > self.max_disappeared:
-                self.deregister(object_id)
-
-        unassigned_cols = set(range(len(input_centroids))) - assigned_cols
-        for col in unassigned_cols:
-            self.register(input_centroids[col])
-
-        return self.objects, []
-
-def update_available_slots(feed_id, available_slots):
-    with open(CONFIG_PATH, 'r+') as f:
-        parking_slots_config = json.load(f)
-        for feed in parking_slots_config['feeds']:
-            if feed['id'] == feed_id:
-                feed['availableSlots'] = available_slots
-                break
-        f.seek(0)
-        json.dump(parking_slots_config, f, indent=4)
-        f.truncate()
-
-def process_frame(frame, car_detector, tracker, parking_counter, feed_id, update_callback=None):
-    frame_height, frame_width = frame.shape[:2]
-    center_y = frame_height // 2
-
-    detected_cars = car_detector.detect_cars(frame)
+import threading
+
+CONFIG_PATH = os.environ.get('FEEDS_CONFIG', os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'config', 'feeds_config.json')))
+# Frames are downscaled to this (width, height) on capture
+PROCESS_SIZE = (640, 480)
+
+def update_counts(detected_cars, tracker, parking_counter, zones, timer=None):
+    """
+    Track this frame's detections and apply every zone crossing to the counters.
+    Kept free of any image work so detection traces can be replayed through it.
+    Returns the (object id, direction, zone name) of every crossing.
+    """
     objects, disappeared_ids = tracker.update(detected_cars)
+    if timer:
+        timer.lap("tracking")
 
     # Handle disappeared cars
     for object_id in disappeared_ids:
@@ -113,103 +39,194 @@ def process_frame(frame, car_detector, tracker, parking_counter, feed_id, update
         elif last_dir == "away":
             parking_counter.increment_count()
 
+    crossings = []
+    for object_id, direction, zone in zones.track_crossings(tracker):
+        crossings.append((object_id, direction, zone["name"]))
+        if zone["counter"] != "feed":
+            continue
+        tracker.last_direction[object_id] = direction
+        if direction == "towards":
+            # Car coming towards camera - decrement available slots
+            parking_counter.decrement_count()
+        else:
+            # Car going away from camera - increment available slots
+            parking_counter.increment_count()
     for object_id, centroid in objects.items():
-        prev_centroid = tracker.previous_positions.get(object_id, None)
-        if prev_centroid is not None:
-            prev_cx, prev_cy = prev_centroid
-            cx, cy = centroid
-            if prev_cy < center_y <= cy:
-                # Car coming towards camera crossing line - decrement available slots
-                parking_counter.decrement_count()
-                tracker.last_direction[object_id] = "towards"
-            elif prev_cy > center_y >= cy:
-                # Car going away from camera crossing line - increment available slots
-                parking_counter.increment_count()
-                tracker.last_direction[object_id] = "away"
         tracker.previous_positions[object_id] = centroid
+    if timer:
+        timer.lap("counting")
+    return crossings
+
+def process_frame(frame, car_detector, tracker, parking_counter, feed_id, update_callback=None, timer=None, persist=True,
+                  zones=None, detection_frame=None):
+    """`detection_frame`, if given, is what the detector looks at instead, e.g. the frame at source resolution"""
+    if zones is None:
+        zones = ZoneSet.default(frame.shape[1::-1])
 
-    # Draw horizontal line
-    draw_line(frame, center_y)
+    detected_cars = car_detector.detect_cars(frame if detection_frame is None else detection_frame)
+    if timer:
+        timer.lap("inference")
+    available_before = parking_counter.available_slots
+    crossings = update_counts(detected_cars, tracker, parking_counter, zones, timer)
+
+    # Draw the counting lines and zones
+    zones.draw(frame)
 
     # Draw bounding boxes
     for (x, y, w, h) in detected_cars:
         cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 255, 0), 2)
-    
-
-    # Call update callback with current available slots
-    
-
-    update_available_slots(feed_id, parking_counter.available_slots)
+    if timer:
+        timer.lap("drawing")
+
+    # Crossings and free slots go out as events; the config is written off this thread
+    if persist:
+        for object_id, direction, zone in crossings:
+            event_bus.publish(CrossingEvent(feed_id, object_id, direction, zone))
+        if parking_counter.available_slots != available_before:
+            event_bus.publish(OccupancyEvent(feed_id, parking_counter.available_slots, parking_counter.total_slots))
+        if timer:
+            timer.lap("persist")
     if update_callback:
-        update_callback(feed_id, frame)
+        update_callback(feed_id, frame, timer.captured_at if timer else None)
+
+def process_occupancy_frame(frame, car_detector, occupancy, parking_counter, feed_id, update_callback=None,
+                            timer=None, detection_frame=None):
+    """
+    Slot occupancy mode: update every slot from image statistics, and only take an
+    inference slot for YOLO when the occupancy is due for a check
+    """
+    occupancy.update(frame)
+    if timer:
+        timer.lap("occupancy")
+    if occupancy.verify_due():
+        with inference_scheduler.slot(feed_id) as schedule:
+            car_detector.imgsz = schedule.imgsz
+            occupancy.verify(car_detector.detect_cars(frame if detection_frame is None else detection_frame), feed_id)
+        if timer:
+            timer.lap("inference")
+
+    occupancy.draw(frame)
+    if timer:
+        timer.lap("drawing")
+
+    if occupancy.available != parking_counter.available_slots:
+        parking_counter.available_slots = occupancy.available
+        event_bus.publish(OccupancyEvent(feed_id, parking_counter.available_slots, parking_counter.total_slots))
+        if timer:
+            timer.lap("persist")
+    if update_callback:
+        update_callback(feed_id, frame, timer.captured_at if timer else None)
+
+def run_feed(config, update_frame_callback=None, frame_skip=2):
+    """
+    Detection and counting loop for a single multicam feed. Each feed runs on its own
+    thread with its own reader, so a slow or broken camera never stalls the others.
+    A feed with an `occupancy` block of slot polygons counts free slots by looking at
+    every slot (see slot_occupancy.py) instead of counting line crossings. A feed with
+    a `tiling` block detects cars on tiles of the source resolution frame (see
+    tiling.py) rather than on the downscaled frame.
+    """
+    feed_id = config["id"]
+    total_slots = config["totalSlots"]
+    available_slots = config["availableSlots"]
+
+    # Model, threshold and sampling as tuned for this feed by bench.tune, if it was
+    tuning = config.get("tuning") or {}
+    frame_skip = tuning.get("frame_skip", frame_skip)
+    detector = CarDetector.from_config(tuning)
+    detector.load_model()
+    if config.get("tiling"):
+        detector = TiledDetector.from_config(detector, config["tiling"], PROCESS_SIZE, feed_id)
+    tracker = CentroidTracker(max_disappeared=10)
+    zones = ZoneSet.from_config(config.get("zones"), PROCESS_SIZE)
+    occupancy = None
+    if config.get("occupancy"):
+        occupancy = SlotOccupancy.from_config(config["occupancy"], PROCESS_SIZE)
+        total_slots = occupancy.count
+    parking_counter = ParkingCounter(total_slots, min(available_slots, total_slots))
+
+    # Frames are downscaled on capture and drawn on in one of two preallocated
+    # working buffers, so the loop itself never allocates frame memory
+    width, height = PROCESS_SIZE
+    try:
+        work_pool = FramePool(feed_id, "work", (height, width, 3), count=2)
+    except MemoryError as e:
+        print(f"Error initializing feed {feed_id}: {e}")
+        return
+    inference_scheduler.register(config)
+    # Optionally record every detection result for offline tracker and counter tests
+    detector.trace = open_feed_trace(config, "multicam", PROCESS_SIZE)
+    reader = LatestFrameReader(feed_id, config["video_source"], target_size=PROCESS_SIZE).start()
+    timer = FrameTimer(feed_id)
+    last_seq = 0
+    # Source resolution copy of every processed frame, for tiled inference
+    full_pool = None
+    try:
+        while reader.is_alive():
+            # Wait until the scheduler wants the next frame of this feed
+            inference_scheduler.pace(feed_id)
+
+            # Implement frame skipping, always processing the newest frame
+            processed_frame = work_pool.next()
+            full_frame = None
+            if config.get("tiling") and reader.full_shape is not None:
+                if full_pool is None or full_pool.shape != tuple(reader.full_shape):
+                    if full_pool is not None:
+                        full_pool.close()
+                    full_pool = FramePool(feed_id, "full", reader.full_shape, count=1)
+                full_frame = full_pool.next()
+            seq, captured_at = reader.read_into(processed_frame, last_seq + frame_skip - 1, timeout=1,
+                                                full_dst=full_frame)
+            if captured_at is None:
+                continue
+            last_seq = seq
+            detector.frame_index = seq
+            timer.begin(captured_at)
+
+            try:
+                if occupancy is not None:
+                    process_occupancy_frame(processed_frame, detector, occupancy, parking_counter, feed_id,
+                                            update_frame_callback, timer, detection_frame=full_frame)
+                else:
+                    with inference_scheduler.slot(feed_id) as schedule:
+                        detector.imgsz = schedule.imgsz
+                        process_frame(processed_frame, detector, tracker, parking_counter, feed_id, update_frame_callback, timer,
+                                      zones=zones, detection_frame=full_frame)
+                FRAMES_PROCESSED.labels(feed_id).inc()
+            except Exception as e:
+                print(f"Error in frame processing for {feed_id}: {e}")
+    finally:
+        reader.stop()
+        work_pool.close()
+        if full_pool is not None:
+            full_pool.close()
+        if detector.trace is not None:
+            detector.trace.close()
+        inference_scheduler.unregister(feed_id)
 
 def main(target_feed_id=None, update_frame_callback=None):
-    car_detectors = []
-    trackers = []
-    caps = []
-    parking_counters = []
-
     # Load config from JSON file
     with open(CONFIG_PATH, 'r') as f:
         parking_slots_config = json.load(f)
 
-    if target_feed_id:
+    if target_feed_id is not None:
         multicam_feeds = [feed for feed in parking_slots_config['feeds'] if feed['type'] == 'multicam' and feed['id'] == target_feed_id]
     else:
         multicam_feeds = [feed for feed in parking_slots_config['feeds'] if feed['type'] == 'multicam']
+    start_count_sink()
 
-    # Initialize detectors, trackers, video captures, and counters for each camera feed
-    for config in multicam_feeds:
-     source = config["video_source"]
-     source = os.path.abspath(os.path.join(os.path.dirname(CONFIG_PATH), '..', source))
-     total_slots = config["totalSlots"]
-     available_slots = config["availableSlots"]
-
-     detector = CarDetector()
-     detector.load_model()
-     car_detectors.append(detector)
-
-     tracker = CentroidTracker(max_disappeared=10)
-     trackers.append(tracker)
-
-     parking_counter = ParkingCounter(total_slots, available_slots)
-     parking_counters.append(parking_counter)
-
-     cap = cv2.VideoCapture(source)
-     if not cap.isOpened():
-        print(f"Error: Could not open video source {source}")
+    if len(multicam_feeds) == 1:
+        run_feed(multicam_feeds[0], update_frame_callback)
         return
-     caps.append(cap)
 
+    threads = []
+    for config in multicam_feeds:
+        thread = threading.Thread(target=run_feed, args=(config, update_frame_callback), name=f"multicam-feed-{config['id']}", daemon=True)
+        thread.start()
+        threads.append(thread)
 
-    while True:
-        frames = []
-        rets = []
-        for cap in caps:
-            ret, frame = cap.read()
-            rets.append(ret)
-            frames.append(frame if ret else None)
-
-        if not any(rets):
-            break
-
-        for i, ret in enumerate(rets):
-            if ret:
-                # Implement frame skipping
-                if caps[i].get(cv2.CAP_PROP_POS_FRAMES) % 2 != 0:
-                    continue
-
-                # Resize frame for faster processing and streaming
-                processed_frame = cv2.resize(frames[i], (640, 480))
-                process_frame(processed_frame, car_detectors[i], trackers[i], parking_counters[i], multicam_feeds[i]['id'], update_frame_callback)
-                
-
-        if cv2.waitKey(1) & 0xFF == ord('q'):
-            break
-
-    for cap in caps:
-        cap.release()
-    cv2.destroyAllWindows()
+    for thread in threads:
+        thread.join()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,290 @@
+import itertools
+import json
+import os
+import re
+import threading
+import time
+
+import cv2
+
+from .metrics import ANPR_OCR_IMAGES, ANPR_OCR_SETTLED
+
+# Indian registration plates, e.g. MH12AB1234 and MH14C1234, and the BH series, e.g. 22BH1234AA
+DEFAULT_PLATE_PATTERN = r"[A-Z]{2}[0-9]{1,2}[A-Z]{0,3}[0-9]{4}|[0-9]{2}BH[0-9]{4}[A-Z]{1,2}"
+# Reads below this confidence go on to the next tier
+DEFAULT_MIN_CONFIDENCE = 0.6
+DEFAULT_TIERS = ["easyocr"]
+
+
+def clean_plate_text(text):
+    """
+    Cleans raw OCR text into a plate number.
+    This version is lenient and will try to find at least 4 digits.
+    """
+    cleaned = ''.join(filter(str.isalnum, text)).strip().upper()
+
+    # Reverted to more lenient 4-character logic
+    if len(cleaned) >= 4:
+        return cleaned
+    # Fallback for very short or messy reads: find the last 4 digits
+    digits = ''.join(filter(str.isdigit, cleaned))
+    return digits[-4:] if len(digits) >= 4 else ""
+
+def ocr_plate(image, reader, **options):
+    """
+    Performs OCR on an image using EasyOCR, returning the cleaned text and its confidence.
+    """
+    try:
+        result = reader.readtext(image, **options)
+        if result:
+            # Take the most confident reading
+            return clean_plate_text(result[0][1]), float(result[0][2])
+        return "", 0.0
+    except Exception as e:
+        print(f"⚠️ [Worker] EasyOCR error: {e}")
+        return "", 0.0
+
+def ocr_plates_batch(images, reader, **options):
+    """
+    OCR several scaled plate images with one call to EasyOCR's batched API, returning
+    (text, confidence) per image. The images share the width set by scale_plate_image
+    and are padded to a common height.
+    """
+    if not images:
+        return []
+    if len(images) == 1 or not hasattr(reader, "readtext_batched"):
+        return [ocr_plate(image, reader, **options) for image in images]
+    height = max(image.shape[0] for image in images)
+    padded = [
+        cv2.copyMakeBorder(image, 0, height - image.shape[0], 0, 0, cv2.BORDER_REPLICATE)
+        if image.shape[0] < height else image
+        for image in images
+    ]
+    try:
+        results = reader.readtext_batched(padded, **options)
+    except Exception as e:
+        print(f"⚠️ [Worker] EasyOCR batch error: {e}")
+        return [ocr_plate(image, reader, **options) for image in images]
+    return [(clean_plate_text(result[0][1]), float(result[0][2])) if result else ("", 0.0) for result in results]
+
+
+# EasyOCR readers by (languages, gpu), so the fast and beam search tiers share one model
+_easyocr_readers = {}
+
+
+def easyocr_reader(languages=("en",), gpu=True):
+    key = (tuple(languages), gpu)
+    if key not in _easyocr_readers:
+        # Imported here so the backend only pays for EasyOCR when a feed uses it
+        import easyocr
+        _easyocr_readers[key] = easyocr.Reader(list(languages), gpu=gpu)
+    return _easyocr_readers[key]
+
+
+class EasyOcrBackend:
+    """EasyOCR, greedy decoding by default; the fast first tier"""
+    def __init__(self, languages=("en",), gpu=True, decoder="greedy", beam_width=5):
+        self.reader = easyocr_reader(languages, gpu)
+        self.options = {"decoder": decoder}
+        if decoder != "greedy":
+            self.options["beamWidth"] = beam_width
+
+    def read_batch(self, images):
+        return ocr_plates_batch(images, self.reader, **self.options)
+
+
+class EasyOcrBeamBackend(EasyOcrBackend):
+    """
+    EasyOCR with beam search decoding, also run on a contrast-equalised copy of every
+    plate, keeping the more confident read. Several times slower than the first tier.
+    """
+    def __init__(self, languages=("en",), gpu=True, beam_width=10):
+        super().__init__(languages, gpu, decoder="beamsearch", beam_width=beam_width)
+        self.clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(4, 8))
+
+    def read_batch(self, images):
+        plain = super().read_batch(images)
+        equalised = super().read_batch([self._equalise(image) for image in images])
+        return [max(a, b, key=lambda read: read[1]) for a, b in zip(plain, equalised)]
+
+    def _equalise(self, image):
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+        return cv2.cvtColor(self.clahe.apply(gray), cv2.COLOR_GRAY2BGR)
+
+
+class TrOcrBackend:
+    """A transformer OCR model from Hugging Face, run locally; heavier than EasyOCR"""
+    def __init__(self, model="microsoft/trocr-base-printed", num_beams=4):
+        # Imported here so only deployments with a TrOCR tier need transformers and torch
+        from transformers import TrOCRProcessor, VisionEncoderDecoderModel
+        self.processor = TrOCRProcessor.from_pretrained(model)
+        self.model = VisionEncoderDecoderModel.from_pretrained(model)
+        self.num_beams = max(2, num_beams)
+
+    def read_batch(self, images):
+        if not images:
+            return []
+        rgb = [cv2.cvtColor(image, cv2.COLOR_BGR2RGB) for image in images]
+        pixel_values = self.processor(images=rgb, return_tensors="pt").pixel_values
+        output = self.model.generate(pixel_values, num_beams=self.num_beams, max_new_tokens=16,
+                                     output_scores=True, return_dict_in_generate=True)
+        texts = self.processor.batch_decode(output.sequences, skip_special_tokens=True)
+        confidences = output.sequences_scores.exp().tolist()
+        return [(clean_plate_text(text), float(confidence)) for text, confidence in zip(texts, confidences)]
+
+
+# Gemini clients by (model, offline), shared by every tier and worker thread that uses
+# Gemini, so their requests share one rate limit and concurrency bound
+_gemini_clients = {}
+_gemini_clients_lock = threading.Lock()
+# Processes that each hold their own clients; see share_remote_limits
+_remote_share = 1
+
+
+def share_remote_limits(processes):
+    """
+    Split the rate, burst and concurrency limits of remote backends evenly over this
+    many processes, for ANPR worker processes that each build their own clients, so
+    together they stay within the configured limits
+    """
+    global _remote_share
+    _remote_share = max(1, processes)
+
+
+class GeminiBackend:
+    """
+    Gemini, through the shared asynchronous client in gemini_client.py: several plates
+    per request, several requests in flight. Gemini reports no confidence, so a plate
+    it does read gets a fixed `confidence`. Offline, a local stub answers instead. In
+    ANPR worker processes each process gets its share of the limits, see share_remote_limits.
+    """
+    remote = True
+
+    def __init__(self, model="gemini-1.5-flash-latest", api_key=None, confidence=0.9, max_concurrency=4,
+                 rate=2.0, burst=4, timeout_s=15.0, retries=2, pack_size=4, coalesce_ms=30, offline=False):
+        from .gemini_client import GeminiPlateClient, GenaiTransport, StubTransport
+        with _gemini_clients_lock:
+            key = (model, offline)
+            if key not in _gemini_clients:
+                transport = StubTransport() if offline else GenaiTransport(model, api_key)
+                share = _remote_share
+                _gemini_clients[key] = GeminiPlateClient(transport, max(1, max_concurrency // share), rate / share,
+                                                         max(1, burst // share), timeout_s, retries, pack_size,
+                                                         coalesce_ms)
+            self.client = _gemini_clients[key]
+        self.confidence = confidence
+
+    def read_batch(self, images):
+        if not images:
+            return []
+        return [(plate, self.confidence if plate else 0.0) for plate in self.client.read_batch(images)]
+
+
+class StubOcrBackend:
+    """
+    Local stand-in for a remote backend: answers with `text`, or with `answers` in turn,
+    after an optional delay, and counts the images it was asked to read.
+    """
+    def __init__(self, text="", confidence=0.9, answers=None, latency=0.0):
+        self.answers = itertools.cycle(answers) if answers else None
+        self.text = text
+        self.confidence = confidence
+        self.latency = latency
+        self.images_read = 0
+
+    def read_batch(self, images):
+        if self.latency:
+            time.sleep(self.latency)
+        self.images_read += len(images)
+        texts = [next(self.answers) if self.answers else self.text for _ in images]
+        return [(text, self.confidence if text else 0.0) for text in texts]
+
+
+# OCR backends a tier can name in the config
+OCR_BACKENDS = {
+    "easyocr": EasyOcrBackend,
+    "easyocr_beam": EasyOcrBeamBackend,
+    "trocr": TrOcrBackend,
+    "gemini": GeminiBackend,
+    "stub": StubOcrBackend,
+}
+
+
+def make_ocr_backend(name, **params):
+    """
+    Build a backend by name. With ANPR_OCR_OFFLINE=1 in the environment, remote backends
+    talk to a local stub instead, so tests and local runs never call out.
+    """
+    if name not in OCR_BACKENDS:
+        raise ValueError(f"Unknown OCR backend: {name} (known: {', '.join(sorted(OCR_BACKENDS))})")
+    backend = OCR_BACKENDS[name]
+    if getattr(backend, "remote", False) and os.environ.get("ANPR_OCR_OFFLINE") == "1":
+        params["offline"] = True
+    return backend(**params)
+
+
+class TieredOcr:
+    """
+    Reads plates with a list of backends, cheapest first. Every plate goes through the
+    first tier; only reads below `min_confidence`, or that do not look like a plate, go
+    on to the next tier, and so on. The best read over the tiers tried wins. Backends are
+    built on first use, so a tier that is never reached costs nothing.
+    """
+    def __init__(self, tiers=None, min_confidence=DEFAULT_MIN_CONFIDENCE, plate_pattern=DEFAULT_PLATE_PATTERN):
+        self.tiers = [tier if isinstance(tier, dict) else {"backend": tier} for tier in (tiers or DEFAULT_TIERS)]
+        self.min_confidence = min_confidence
+        self.plate_pattern = re.compile(plate_pattern) if plate_pattern else None
+        self._backends = {}
+
+    def looks_valid(self, text):
+        if not text:
+            return False
+        return self.plate_pattern is None or self.plate_pattern.fullmatch(text) is not None
+
+    def settled(self, read):
+        return self.looks_valid(read[0]) and read[1] >= self.min_confidence
+
+    def backend(self, i):
+        if i not in self._backends:
+            params = dict(self.tiers[i])
+            self._backends[i] = make_ocr_backend(params.pop("backend"), **params)
+        return self._backends[i]
+
+    def read_batch(self, images):
+        """(text, confidence) for every plate image"""
+        best = [("", 0.0)] * len(images)
+        tier_of = [None] * len(images)
+        pending = list(range(len(images)))
+        for i, tier in enumerate(self.tiers):
+            if not pending:
+                break
+            name = tier["backend"]
+            try:
+                reads = self.backend(i).read_batch([images[j] for j in pending])
+            except Exception as e:
+                print(f"⚠️ [Worker] OCR tier {name} failed: {e}")
+                continue
+            ANPR_OCR_IMAGES.labels(name).inc(len(pending))
+            for j, read in zip(pending, reads):
+                if (self.looks_valid(read[0]), read[1]) > (self.looks_valid(best[j][0]), best[j][1]):
+                    best[j] = read
+                    tier_of[j] = name
+            pending = [j for j in pending if not self.settled(best[j])]
+        for name in tier_of:
+            if name is not None:
+                ANPR_OCR_SETTLED.labels(name).inc()
+        return best
+
+
+def ocr_settings_key(settings):
+    return json.dumps(settings or {}, sort_keys=True)
+
+
+def tiered_ocr_from_settings(settings):
+    """TieredOcr from an `ocr` block of the feeds config: {"tiers": [...], "min_confidence": ..., "plate_pattern": ...}"""
+    settings = settings or {}
+    return TieredOcr(
+        tiers=settings.get("tiers"),
+        min_confidence=settings.get("min_confidence", DEFAULT_MIN_CONFIDENCE),
+        plate_pattern=settings.get("plate_pattern", DEFAULT_PLATE_PATTERN),
+    )
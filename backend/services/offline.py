@@ -0,0 +1,216 @@
+import cv2
+import numpy as np
+import time
+from collections import defaultdict
+
+from . import car_counter
+from . import multicam
+from .counter import ParkingCounter
+from .synthetic import open_capture
+from .tracker import CentroidTracker, box_of
+from .zones import ZoneSet
+
+# Frames are resized to this (width, height) before detection, like the live pipelines
+PROCESS_SIZE = (640, 480)
+
+# Default sampling of the live pipelines: car_counter processes 1 in 3, multicam 1 in 2
+DEFAULT_FRAME_SKIP = {"counter": 3, "multicam": 2}
+
+
+class StageRecorder:
+    """
+    Drop-in for metrics.FrameTimer that keeps every raw stage duration, so offline runs
+    can report exact percentiles instead of histogram estimates.
+    """
+    def __init__(self):
+        self.captured_at = None
+        self.durations = defaultdict(list)
+        self._last = time.perf_counter()
+
+    def begin(self, captured_at=None):
+        self.captured_at = captured_at
+        self._last = time.perf_counter()
+
+    def lap(self, stage):
+        now = time.perf_counter()
+        self.durations[stage].append(now - self._last)
+        self._last = now
+
+    def summary(self):
+        return {stage: percentiles(values) for stage, values in sorted(self.durations.items())}
+
+
+def percentiles(values):
+    if not values:
+        return {}
+    ordered = sorted(values)
+
+    def pick(q):
+        return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+    return {
+        "count": len(ordered),
+        "mean_ms": round(sum(ordered) / len(ordered) * 1000, 3),
+        "p50_ms": round(pick(0.50) * 1000, 3),
+        "p90_ms": round(pick(0.90) * 1000, 3),
+        "p99_ms": round(pick(0.99) * 1000, 3),
+        "max_ms": round(ordered[-1] * 1000, 3),
+    }
+
+
+class RecordingCounterState:
+    """Stands in for car_counter.CarCounterState without touching the feeds config"""
+    def __init__(self, events, initial_count=0):
+        self.events = events
+        self.total_cars_counted = initial_count
+        self.frame_index = 0
+
+    def increment(self):
+        self.total_cars_counted += 1
+        self.events.append({"frame": self.frame_index, "direction": "towards"})
+
+    def decrement(self):
+        self.total_cars_counted -= 1
+        self.events.append({"frame": self.frame_index, "direction": "away"})
+
+
+class RecordingParkingCounter(ParkingCounter):
+    """ParkingCounter that also records the crossing behind every change"""
+    def __init__(self, total_slots, available_slots, events):
+        super().__init__(total_slots, available_slots)
+        self.events = events
+        self.frame_index = 0
+
+    def increment_count(self, amount=1):
+        self.events.append({"frame": self.frame_index, "direction": "away"})
+        super().increment_count(amount)
+
+    def decrement_count(self):
+        self.events.append({"frame": self.frame_index, "direction": "towards"})
+        super().decrement_count()
+
+
+def iter_frames(path, start_frame=0, end_frame=None, recorder=None, sample_every=1):
+    """
+    Decode a video file sequentially, as fast as possible, yielding (frame index, frame).
+    With `sample_every` N only every Nth frame is yielded; the others are grabbed without
+    being converted to an image, which skips most of their decode cost.
+    """
+    cap = open_capture(path)
+    if not cap.isOpened():
+        raise ValueError(f"Could not open video source: {path}")
+    try:
+        if start_frame:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+        index = start_frame
+        frame = None
+        while end_frame is None or index < end_frame:
+            if sample_every > 1 and (index + 1) % sample_every != 0:
+                if not cap.grab():
+                    break
+                index += 1
+                continue
+            if recorder:
+                recorder.begin()
+            ret, frame = cap.read(frame)
+            if not ret:
+                break
+            if recorder:
+                recorder.lap("decode")
+            yield index, frame
+            index += 1
+    finally:
+        cap.release()
+
+
+class OfflinePipeline:
+    """
+    Runs the car_counter or multicam per-frame logic over recorded frames with no
+    display, pacing or config writes. Crossing events are collected with the index of
+    the frame they happened on.
+
+    With `draw=False` the overlay drawing is skipped and the crossings of the last
+    processed frame are kept in `crossings` as (object id, direction, [x, y, w, h]).
+    """
+    def __init__(self, pipeline, detector, tracker=None, frame_skip=None, process_size=PROCESS_SIZE,
+                 total_slots=0, available_slots=0, recorder=None, draw=True, zones=None):
+        if pipeline not in DEFAULT_FRAME_SKIP:
+            raise ValueError(f"Unknown pipeline: {pipeline}")
+        self.pipeline = pipeline
+        self.detector = detector
+        self.tracker = tracker or CentroidTracker(max_disappeared=10)
+        self.frame_skip = frame_skip or DEFAULT_FRAME_SKIP[pipeline]
+        self.process_size = process_size
+        self.recorder = recorder or StageRecorder()
+        self.draw = draw
+        # Counting lines and zones; by default the middle line of the first frame
+        self.zones = zones
+        self.events = []
+        self.crossings = []
+        self.frames_decoded = 0
+        self.frames_processed = 0
+
+        if pipeline == "counter":
+            self.state = RecordingCounterState(self.events)
+            self.parking_counter = ParkingCounter(0, 0)
+        else:
+            self.state = None
+            self.parking_counter = RecordingParkingCounter(total_slots, available_slots, self.events)
+
+        # Reused resize target, so the loop does not allocate a frame per iteration
+        self._work = None
+        if process_size is not None:
+            width, height = process_size
+            self._work = np.empty((height, width, 3), np.uint8)
+
+    def process(self, index, frame):
+        """Feed one decoded frame; returns True if it was sampled and processed"""
+        self.frames_decoded += 1
+        if (index + 1) % self.frame_skip != 0:
+            return False
+
+        self.recorder.begin()
+        self.detector.frame_index = index
+        if self.process_size is not None:
+            frame = cv2.resize(frame, self.process_size, dst=self._work)
+            self.recorder.lap("resize")
+
+        if self.pipeline == "counter":
+            self.state.frame_index = index
+        else:
+            self.parking_counter.frame_index = index
+
+        if not self.draw:
+            self._track_and_count(frame)
+        elif self.pipeline == "counter":
+            car_counter.process_frame(frame, self.detector, self.tracker, self.parking_counter, self.state,
+                                      timer=self.recorder, zones=self.zones)
+        else:
+            multicam.process_frame(frame, self.detector, self.tracker, self.parking_counter, None,
+                                   timer=self.recorder, persist=False, zones=self.zones)
+        self.frames_processed += 1
+        return True
+
+    def _track_and_count(self, frame):
+        detected_cars = self.detector.detect_cars(frame)
+        self.recorder.lap("inference")
+        if self.zones is None:
+            self.zones = ZoneSet.default(frame.shape[1::-1])
+        if self.pipeline == "counter":
+            crossed = car_counter.update_counts(detected_cars, self.tracker, self.parking_counter, self.state,
+                                                self.zones, self.recorder)
+        else:
+            crossed = multicam.update_counts(detected_cars, self.tracker, self.parking_counter, self.zones, self.recorder)
+        self.crossings = [(object_id, direction, box_of(detected_cars, self.tracker.objects[object_id]))
+                          for object_id, direction, _ in crossed]
+
+    def run(self, path, start_frame=0, end_frame=None):
+        for index, frame in iter_frames(path, start_frame, end_frame, self.recorder):
+            self.process(index, frame)
+        return self.events
+
+    def counts(self):
+        counts = {"towards": 0, "away": 0}
+        for event in self.events:
+            counts[event["direction"]] += 1
+        return counts
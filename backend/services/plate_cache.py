@@ -0,0 +1,128 @@
+import time
+from collections import OrderedDict
+from threading import Lock
+
+import cv2
+import numpy as np
+
+from .metrics import registry, ANPR_CACHE_LOOKUPS, ANPR_CACHE_ENTRIES
+
+HASH_BITS = 64
+
+
+def plate_hash(plate_image):
+    """
+    64-bit difference hash of a plate crop: the crop is reduced to 9x8 grey pixels and
+    every bit says whether a pixel is brighter than its right neighbour. Near-identical
+    crops of the same plate hash within a few bits of each other, whatever their size
+    or overall brightness.
+    """
+    gray = cv2.cvtColor(plate_image, cv2.COLOR_BGR2GRAY) if plate_image.ndim == 3 else plate_image
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+class PlateReadCache:
+    """
+    Recent plate reads by perceptual hash of the plate crop, so a car that lingers in view
+    or is tracked again does not send the same plate through OCR, or Gemini, over and
+    over. A crop within `max_distance` bits of a cached one gets the cached read.
+
+    Lookups use multi-index hashing: the hash is split into `max_distance + 1` chunks, and
+    any hash within `max_distance` bits matches at least one chunk exactly, so only the
+    entries sharing a chunk are compared. Unlike a BK-tree this allows removing entries,
+    which LRU eviction and expiry need. Holds at most `max_entries` reads, each for at
+    most `ttl` seconds. Thread-safe.
+    """
+    def __init__(self, max_entries=2048, ttl=600.0, max_distance=4, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_distance = max_distance
+        self.clock = clock
+        chunks = max_distance + 1
+        width = -(-HASH_BITS // chunks)
+        self._chunks = [(i * width, min(width, HASH_BITS - i * width)) for i in range(chunks)]
+        self._entries = OrderedDict()  # hash -> (read, stored at), least recently used first
+        self._index = [{} for _ in self._chunks]  # chunk value -> set of hashes
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        registry.add_collector(self._collect_metrics)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def _keys(self, h):
+        return [(h >> shift) & ((1 << width) - 1) for shift, width in self._chunks]
+
+    def _remove(self, h):
+        del self._entries[h]
+        for index, key in zip(self._index, self._keys(h)):
+            bucket = index[key]
+            bucket.discard(h)
+            if not bucket:
+                del index[key]
+
+    def _expire(self, now):
+        while self._entries:
+            h, (_, stored_at) = next(iter(self._entries.items()))
+            if now - stored_at <= self.ttl and len(self._entries) <= self.max_entries:
+                break
+            self._remove(h)
+
+    def get(self, h):
+        """The cached read of the closest hash within `max_distance` bits, or None"""
+        now = self.clock()
+        with self._lock:
+            best, best_distance = None, self.max_distance + 1
+            for index, key in zip(self._index, self._keys(h)):
+                for candidate in index.get(key, ()):
+                    distance = hamming(h, candidate)
+                    if distance < best_distance:
+                        best, best_distance = candidate, distance
+            if best is not None and now - self._entries[best][1] > self.ttl:
+                self._remove(best)
+                best = None
+            if best is None:
+                self.misses += 1
+                ANPR_CACHE_LOOKUPS.labels("miss").inc()
+                return None
+            self._entries.move_to_end(best)
+            self.hits += 1
+            ANPR_CACHE_LOOKUPS.labels("hit").inc()
+            return self._entries[best][0]
+
+    def put(self, h, read):
+        now = self.clock()
+        with self._lock:
+            if h in self._entries:
+                self._remove(h)
+            self._entries[h] = (read, now)
+            for index, key in zip(self._index, self._keys(h)):
+                index.setdefault(key, set()).add(h)
+            self._expire(now)
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def _collect_metrics(self):
+        ANPR_CACHE_ENTRIES.labels().set(len(self))
+
+
+def plate_cache_from_settings(settings):
+    """PlateReadCache from the `cache` block of the anpr config, or None if it is turned off"""
+    settings = settings or {}
+    if not settings.get('enabled', True):
+        return None
+    return PlateReadCache(
+        max_entries=settings.get('max_entries', 2048),
+        ttl=settings.get('ttl_s', 600.0),
+        max_distance=settings.get('max_distance', 4),
+    )
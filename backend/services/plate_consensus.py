@@ -0,0 +1,93 @@
+import time
+from collections import OrderedDict, defaultdict
+from threading import Lock
+
+
+def fuse_reads(reads):
+    """
+    One plate text out of several OCR reads of the same car, given as [(text, confidence)].
+    Reads of the most supported length vote character by character, weighted by their
+    confidence, so "HH12TD9721", "HH121D9721" and "HH12TD9721" fuse to "HH12TD9721".
+    Returns (text, confidence) with confidence in [0, 1], or ("", 0.0) if nothing was read.
+    """
+    reads = [(text, max(float(confidence), 1e-3)) for text, confidence in reads if text]
+    if not reads:
+        return "", 0.0
+    length_weight = defaultdict(float)
+    for text, confidence in reads:
+        length_weight[len(text)] += confidence
+    length = max(length_weight, key=lambda n: (length_weight[n], n))
+    voters = [(text, confidence) for text, confidence in reads if len(text) == length]
+    total = sum(confidence for _, confidence in voters)
+
+    chars = []
+    agreement = 0.0
+    for i in range(length):
+        votes = defaultdict(float)
+        for text, confidence in voters:
+            votes[text[i]] += confidence
+        char = max(votes, key=votes.get)
+        chars.append(char)
+        agreement += votes[char] / total
+    # How much the voters agree, times how sure they were on average
+    confidence = (agreement / length) * (total / len(voters))
+    return "".join(chars), min(1.0, confidence)
+
+
+def plate_distance(a, b):
+    """Substituted characters between two plates of the same length; None if the lengths differ"""
+    if len(a) != len(b):
+        return None
+    return sum(1 for x, y in zip(a, b) if x != y)
+
+
+class PlateDedupeIndex:
+    """
+    Recently emitted plates per (location, direction), expiring after `window` seconds.
+    A plate within `max_distance` substituted characters of one already emitted at the
+    same place and direction counts as the same vehicle pass, so OCR variants such as
+    HH12TD9721 and HH121D9721 minutes apart produce a single event. Thread-safe; memory
+    is bounded by the plates seen within one window, capped at `max_entries`.
+    """
+    def __init__(self, window=300.0, max_distance=1, max_entries=10000, clock=time.monotonic):
+        self.window = window
+        self.max_distance = max_distance
+        self.max_entries = max_entries
+        self.clock = clock
+        self._entries = OrderedDict()  # (plate, location, direction) -> last seen, oldest first
+        self._lock = Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def _expire(self, now):
+        while self._entries:
+            key, seen = next(iter(self._entries.items()))
+            if now - seen <= self.window and len(self._entries) <= self.max_entries:
+                break
+            del self._entries[key]
+
+    def check(self, plate, location, direction):
+        """
+        Record a plate and return the plate it duplicates within the window, or None if
+        it is new. A duplicate refreshes the window of the plate it matched.
+        """
+        now = self.clock()
+        with self._lock:
+            self._expire(now)
+            match = None
+            if (plate, location, direction) in self._entries:
+                match = plate
+            elif self.max_distance:
+                for seen_plate, seen_location, seen_direction in self._entries:
+                    if seen_location != location or seen_direction != direction:
+                        continue
+                    distance = plate_distance(plate, seen_plate)
+                    if distance is not None and distance <= self.max_distance:
+                        match = seen_plate
+                        break
+            key = (match or plate, location, direction)
+            self._entries[key] = now
+            self._entries.move_to_end(key)
+            return match
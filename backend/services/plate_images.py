@@ -0,0 +1,210 @@
+import hashlib
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+
+import cv2
+
+from .metrics import registry, PLATE_IMAGES, PLATE_IMAGE_BYTES
+
+THUMB_SUFFIX = ".thumb.jpg"
+
+
+class PlateImageStore:
+    """
+    Plate images on disk, written by a background thread so OCR never waits on disk.
+
+    Images are named by a hash of their pixels under a directory per day, e.g.
+    2025/08/07/3fa1c0d2e4b5a697.jpg, so a plate crop saved twice is stored once. Every
+    image gets a thumbnail next to it. The store keeps under `max_bytes` by evicting the
+    least recently saved images first, and deletes images older than `max_age_days`.
+    Image files from before the store, or from a previous run, are found on start and
+    take part in retention by their modification time.
+    """
+    def __init__(self, root, max_bytes=2 * 1024 ** 3, max_age_days=30, thumb_width=160, jpeg_quality=90,
+                 queue_size=200, sweep_interval=60.0):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_age = max_age_days * 86400 if max_age_days else None
+        self.thumb_width = thumb_width
+        self.jpeg_quality = jpeg_quality
+        self.sweep_interval = sweep_interval
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._files = OrderedDict()  # key -> [relative path, bytes incl. thumbnail, last saved], LRU first
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._scanned = False
+        self.thread = None
+
+    @classmethod
+    def from_settings(cls, root, settings=None):
+        """Store from the `images` block of the anpr config: max_mb, max_age_days, thumb_width"""
+        settings = settings or {}
+        return cls(
+            root,
+            max_bytes=int(settings.get('max_mb', 2048) * 1024 ** 2),
+            max_age_days=settings.get('max_age_days', 30),
+            thumb_width=settings.get('thumb_width', 160),
+        )
+
+    def start(self):
+        with self._lock:
+            if self.thread is not None:
+                return
+            os.makedirs(self.root, exist_ok=True)
+            if not self._scanned:
+                # Once only, a restarted store already knows its files
+                self._scan()
+                self._scanned = True
+            self.thread = threading.Thread(target=self._run, name="plate-images", daemon=True)
+            self.thread.start()
+        registry.add_collector(self._collect_metrics)
+
+    def stop(self, timeout=10):
+        """Stop the writer thread once it has written the images already queued"""
+        with self._lock:
+            thread, self.thread = self.thread, None
+        if thread is None:
+            return
+        # Queued behind the pending images, so those are written first
+        self._queue.put(None)
+        thread.join(timeout)
+
+    def _scan(self):
+        """Index the images already on disk, oldest first"""
+        found = []
+        for directory, _, names in os.walk(self.root):
+            for name in names:
+                if not name.endswith(".jpg") or name.endswith(THUMB_SUFFIX):
+                    continue
+                path = os.path.join(directory, name)
+                thumb = path[:-len(".jpg")] + THUMB_SUFFIX
+                try:
+                    stat = os.stat(path)
+                    size = stat.st_size + (os.path.getsize(thumb) if os.path.exists(thumb) else 0)
+                except OSError:
+                    continue
+                found.append((stat.st_mtime, os.path.relpath(path, self.root).replace(os.sep, "/"), size))
+        for mtime, relative, size in sorted(found):
+            key = os.path.splitext(os.path.basename(relative))[0]
+            self._files[key] = [relative, size, mtime]
+            self._bytes += size
+
+    def save(self, image, when):
+        """
+        Queue a plate image for writing and return its path relative to the store root.
+        Never blocks: if the writer is too far behind, the image is dropped and None returned.
+        """
+        self.start()
+        key = hashlib.blake2b(image.tobytes(), digest_size=8).hexdigest()
+        with self._lock:
+            entry = self._files.get(key)
+            if entry is not None:
+                entry[2] = time.time()
+                self._files.move_to_end(key)
+                PLATE_IMAGES.labels("deduplicated").inc()
+                return entry[0]
+            relative = f"{when:%Y/%m/%d}/{key}.jpg"
+            try:
+                self._queue.put_nowait((key, relative, image))
+            except queue.Full:
+                PLATE_IMAGES.labels("dropped").inc()
+                return None
+            # Size is filled in once written; until then a second save of it is a duplicate
+            self._files[key] = [relative, 0, time.time()]
+        return relative
+
+    def path(self, relative):
+        return os.path.join(self.root, relative)
+
+    def _run(self):
+        next_sweep = time.monotonic()
+        while True:
+            try:
+                item = self._queue.get(timeout=self.sweep_interval)
+            except queue.Empty:
+                item = ()
+            if item is None:
+                return
+            if item:
+                self._write(*item)
+            if time.monotonic() >= next_sweep or self._bytes > self.max_bytes:
+                self._sweep()
+                next_sweep = time.monotonic() + self.sweep_interval
+
+    def _write(self, key, relative, image):
+        path = self.path(relative)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            params = [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality]
+            ok, encoded = cv2.imencode(".jpg", image, params)
+            height, width = image.shape[:2]
+            thumb_height = max(1, height * self.thumb_width // max(1, width))
+            thumb = cv2.resize(image, (self.thumb_width, thumb_height), interpolation=cv2.INTER_AREA)
+            ok_thumb, encoded_thumb = cv2.imencode(".jpg", thumb, params)
+            if not (ok and ok_thumb):
+                raise OSError("JPEG encoding failed")
+            tmp = path + ".tmp"
+            with open(tmp, 'wb') as f:
+                f.write(encoded.tobytes())
+            os.replace(tmp, path)
+            with open(path[:-len(".jpg")] + THUMB_SUFFIX, 'wb') as f:
+                f.write(encoded_thumb.tobytes())
+        except OSError as e:
+            print(f"⚠️ Could not save plate image {relative}: {e}")
+            with self._lock:
+                self._files.pop(key, None)
+            return
+        size = encoded.size + encoded_thumb.size
+        with self._lock:
+            entry = self._files.get(key)
+            if entry is not None:
+                entry[1] = size
+                self._bytes += size
+        PLATE_IMAGES.labels("written").inc()
+
+    def _sweep(self):
+        """Delete images past their age, then the least recently saved until under the size limit"""
+        now = time.time()
+        doomed = []
+        with self._lock:
+            if self.max_age is not None:
+                for key, (relative, size, saved) in list(self._files.items()):
+                    if now - saved > self.max_age and size:
+                        doomed.append(key)
+            for key in doomed:
+                self._bytes -= self._files[key][1]
+            doomed_set = set(doomed)
+            for key, (relative, size, saved) in self._files.items():
+                if self._bytes <= self.max_bytes:
+                    break
+                if key in doomed_set or not size:
+                    continue
+                doomed.append(key)
+                self._bytes -= size
+            removed = [self._files.pop(key)[0] for key in doomed]
+        for relative in removed:
+            path = self.path(relative)
+            for leftover in (path, path[:-len(".jpg")] + THUMB_SUFFIX):
+                try:
+                    os.remove(leftover)
+                except OSError:
+                    pass
+            self._remove_empty_dirs(os.path.dirname(path))
+        if removed:
+            PLATE_IMAGES.labels("evicted").inc(len(removed))
+
+    def _remove_empty_dirs(self, directory):
+        root = os.path.abspath(self.root)
+        directory = os.path.abspath(directory)
+        while directory != root and directory.startswith(root):
+            try:
+                os.rmdir(directory)
+            except OSError:
+                return
+            directory = os.path.dirname(directory)
+
+    def _collect_metrics(self):
+        PLATE_IMAGE_BYTES.labels().set(self._bytes)
@@ -0,0 +1,325 @@
+"""
+Plate events in a local SQLite database, indexed for lookups by plate, time and location.
+
+ANPR workers hand events to `plate_store.add()`, which only queues them; a writer thread
+inserts them in batches, one transaction per batch. The database runs in WAL mode, so
+the API reads while the writer writes. Plate search uses two small side tables: every
+distinct plate with its confusable characters folded (0/O, 1/I, 8/B, ...), and the
+single-character deletions of that folded form, which find every plate within one edit
+of a query without scanning. Import an existing CSV log from the backend directory with
+
+    python -m services.plate_store import-csv services/plates_log.csv
+"""
+import argparse
+import base64
+import csv
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+from .metrics import registry, QUEUE_DEPTH, PLATE_STORE_ROWS
+
+SERVICE_DIR = os.path.dirname(os.path.abspath(__file__))
+DB_FILE = os.environ.get("PLATE_DB", os.path.join(SERVICE_DIR, "plates.db"))
+# Ways a plate filter can match stored plates
+MATCH_MODES = ("exact", "prefix", "fuzzy")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS plate_events (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,
+    plate TEXT NOT NULL,
+    location TEXT NOT NULL,
+    direction TEXT NOT NULL,
+    confidence REAL,
+    feed_id INTEGER,
+    image TEXT
+);
+CREATE INDEX IF NOT EXISTS plate_events_plate_ts ON plate_events (plate, ts);
+CREATE INDEX IF NOT EXISTS plate_events_ts ON plate_events (ts);
+CREATE INDEX IF NOT EXISTS plate_events_location_ts ON plate_events (location, ts);
+CREATE TABLE IF NOT EXISTS plates (
+    plate TEXT PRIMARY KEY,
+    folded TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS plate_variants (
+    variant TEXT NOT NULL,
+    plate TEXT NOT NULL,
+    PRIMARY KEY (variant, plate)
+) WITHOUT ROWID;
+"""
+
+COLUMNS = ("id", "ts", "plate", "location", "direction", "confidence", "feed_id", "image")
+
+# Characters OCR mixes up, folded to one of each pair for fuzzy search
+_FOLD = str.maketrans({"O": "0", "Q": "0", "D": "0", "I": "1", "L": "1", "Z": "2", "S": "5", "B": "8", "G": "6"})
+
+
+def fold_plate(plate):
+    return plate.upper().translate(_FOLD)
+
+
+def plate_variants(plate):
+    """The folded plate and every way of deleting one character from it"""
+    folded = fold_plate(plate)
+    return {folded} | {folded[:i] + folded[i + 1:] for i in range(len(folded))}
+
+
+def edit_distance(a, b):
+    previous = list(range(len(b) + 1))
+    for i, x in enumerate(a, 1):
+        current = [i]
+        for j, y in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (x != y)))
+        previous = current
+    return previous[-1]
+
+
+def encode_cursor(ts, event_id):
+    return base64.urlsafe_b64encode(f"{ts!r}:{event_id}".encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        ts, event_id = base64.urlsafe_b64decode(cursor.encode()).decode().split(":")
+        return float(ts), int(event_id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+def parse_time(value):
+    """Unix seconds from a number or an ISO 8601 timestamp; None stays None"""
+    if value is None or value == "":
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+def event_dict(row):
+    event = dict(zip(COLUMNS, row))
+    event["time"] = datetime.fromtimestamp(event["ts"]).isoformat(timespec="seconds")
+    return event
+
+
+class PlateStore:
+    """SQLite store of plate events; see the module docstring"""
+    def __init__(self, path=DB_FILE, batch_size=500, flush_interval=0.5):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._ready = False
+        self.thread = None
+
+    def connect(self):
+        """This thread's connection; every thread gets its own"""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            self._ensure_schema()
+            connection = sqlite3.connect(self.path, timeout=10)
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def _ensure_schema(self):
+        with self._lock:
+            if self._ready:
+                return
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=10)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(SCHEMA)
+            connection.commit()
+            connection.close()
+            self._ready = True
+
+    # --- Writing ---
+
+    def start(self):
+        with self._lock:
+            if self.thread is not None:
+                return
+            self.thread = threading.Thread(target=self._run, name="plate-store", daemon=True)
+            self.thread.start()
+        registry.add_collector(self._collect_metrics)
+
+    def add(self, plate, location, direction, when=None, confidence=None, feed_id=None, image=None):
+        """Queue a plate event; it is written by the store's own thread"""
+        self.start()
+        ts = (when or datetime.now()).timestamp()
+        self._queue.put((ts, plate, location, direction, confidence, feed_id, image))
+
+    def _run(self):
+        while True:
+            rows = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(rows) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    rows.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                self.insert(rows)
+            except sqlite3.Error as e:
+                print(f"❌ Could not store {len(rows)} plate events: {e}")
+
+    def insert(self, rows):
+        """Insert (ts, plate, location, direction, confidence, feed_id, image) rows in one transaction"""
+        connection = self.connect()
+        with connection:
+            connection.executemany(
+                "INSERT INTO plate_events (ts, plate, location, direction, confidence, feed_id, image) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            for plate in {row[1] for row in rows}:
+                added = connection.execute("INSERT OR IGNORE INTO plates (plate, folded) VALUES (?, ?)",
+                                           (plate, fold_plate(plate))).rowcount
+                if added:
+                    connection.executemany("INSERT OR IGNORE INTO plate_variants (variant, plate) VALUES (?, ?)",
+                                           [(variant, plate) for variant in plate_variants(plate)])
+        PLATE_STORE_ROWS.labels().inc(len(rows))
+
+    def _collect_metrics(self):
+        QUEUE_DEPTH.labels("plate_store", "pending_inserts").set(self._queue.qsize())
+
+    # --- Reading ---
+
+    def similar_plates(self, plate, max_distance=1):
+        """Known plates within `max_distance` edits of a plate, confusable characters counting as equal"""
+        folded = fold_plate(plate)
+        variants = sorted(plate_variants(plate))
+        placeholders = ",".join("?" * len(variants))
+        candidates = self.connect().execute(
+            f"SELECT DISTINCT p.plate, p.folded FROM plate_variants v JOIN plates p ON p.plate = v.plate "
+            f"WHERE v.variant IN ({placeholders})", variants).fetchall()
+        return [known for known, known_folded in candidates if edit_distance(folded, known_folded) <= max_distance]
+
+    def _where(self, plate=None, match="exact", location=None, direction=None, since=None, until=None):
+        clauses, params = [], []
+        if plate:
+            plate = plate.upper()
+            if match == "prefix":
+                clauses.append("plate >= ? AND plate < ?")
+                params += [plate, plate + "\U0010ffff"]
+            elif match == "fuzzy":
+                plates = self.similar_plates(plate) or [plate]
+                clauses.append(f"plate IN ({','.join('?' * len(plates))})")
+                params += plates
+            elif match == "exact":
+                clauses.append("plate = ?")
+                params.append(plate)
+            else:
+                raise ValueError(f"match must be one of {', '.join(MATCH_MODES)}")
+        if location:
+            clauses.append("location = ?")
+            params.append(location)
+        if direction:
+            clauses.append("direction = ?")
+            params.append(direction)
+        if since is not None:
+            clauses.append("ts >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append("ts < ?")
+            params.append(until)
+        return clauses, params
+
+    def search(self, limit=100, cursor=None, **filters):
+        """
+        Events matching the filters, newest first, as (events, next cursor). Pass the cursor
+        back to get the next page; it is None on the last page.
+        """
+        clauses, params = self._where(**filters)
+        if cursor:
+            ts, event_id = decode_cursor(cursor)
+            clauses.append("(ts < ? OR (ts = ? AND id < ?))")
+            params += [ts, ts, event_id]
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = self.connect().execute(
+            f"SELECT {', '.join(COLUMNS)} FROM plate_events {where} ORDER BY ts DESC, id DESC LIMIT ?",
+            params + [limit + 1]).fetchall()
+        events = [event_dict(row) for row in rows[:limit]]
+        next_cursor = encode_cursor(events[-1]["ts"], events[-1]["id"]) if events and len(rows) > limit else None
+        return events, next_cursor
+
+    def last_seen(self, plate, direction=None, location=None):
+        events, _ = self.search(limit=1, plate=plate, direction=direction, location=location)
+        return events[0] if events else None
+
+    def iter_events(self, chunk_size=1000, **filters):
+        """
+        Every matching event, oldest first, fetched in chunks so any number can be streamed.
+        The query runs when this is called, so a bad filter or database raises here and not
+        partway through a stream.
+        """
+        clauses, params = self._where(**filters)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        self._ensure_schema()
+        # A connection of its own, as a stream may outlive the request thread's other queries
+        connection = sqlite3.connect(self.path, timeout=10)
+        try:
+            rows = connection.execute(
+                f"SELECT {', '.join(COLUMNS)} FROM plate_events {where} ORDER BY ts, id", params)
+        except sqlite3.Error:
+            connection.close()
+            raise
+        return self._stream(connection, rows, chunk_size)
+
+    @staticmethod
+    def _stream(connection, rows, chunk_size):
+        try:
+            while True:
+                chunk = rows.fetchmany(chunk_size)
+                if not chunk:
+                    break
+                for row in chunk:
+                    yield event_dict(row)
+        finally:
+            connection.close()
+
+def import_csv(store, path):
+    """Load a plates_log.csv (timestamp, license_plate, location, direction) into the store"""
+    rows = []
+    with open(path, 'r', newline='') as f:
+        for record in csv.DictReader(f):
+            try:
+                ts = datetime.strptime(record['timestamp'], "%Y-%m-%d %H:%M:%S").timestamp()
+            except (KeyError, ValueError):
+                continue
+            rows.append((ts, record['license_plate'], record['location'], record['direction'], None, None, None))
+    for start in range(0, len(rows), store.batch_size):
+        store.insert(rows[start:start + store.batch_size])
+    return len(rows)
+
+
+# This single store is shared by the ANPR workers and the API
+plate_store = PlateStore()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage the plate event store.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    importer = commands.add_parser("import-csv", help="Import a plates_log.csv")
+    importer.add_argument("csv")
+    exporter = commands.add_parser("export", help="Write every event as NDJSON to stdout")
+    exporter.add_argument("--plate")
+    args = parser.parse_args(argv)
+    if args.command == "import-csv":
+        print(f"Imported {import_csv(plate_store, args.csv)} plate events into {plate_store.path}")
+    else:
+        for event in plate_store.iter_events(plate=args.plate):
+            print(json.dumps(event))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+import marshal
+import math
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+# Name prefixes of the threads that make up the video pipelines
+PIPELINE_THREAD_PREFIXES = ("capture-", "counter-", "multicam-", "camera-", "anpr-")
+
+MAX_DURATION_SECONDS = 120
+
+
+class ProfilerBusy(Exception):
+    pass
+
+
+class SamplingProfiler:
+    """
+    Statistical profiler for running threads. A background thread snapshots the stacks
+    of the selected threads every `interval` seconds via sys._current_frames(), so nothing
+    is hooked into the profiled code and there is no cost at all while it is not running.
+    """
+    def __init__(self, interval=0.005, thread_prefixes=PIPELINE_THREAD_PREFIXES):
+        self.interval = interval
+        self.thread_prefixes = tuple(thread_prefixes or ())
+        self.samples = Counter()  # (thread name, (frame key, ...) root first) -> count
+        self.sample_count = 0
+        self.duration = 0.0
+
+    def _selected_threads(self):
+        threads = {}
+        for thread in threading.enumerate():
+            if thread is threading.current_thread():
+                continue
+            if not self.thread_prefixes or thread.name.startswith(self.thread_prefixes):
+                threads[thread.ident] = thread.name
+        return threads
+
+    def _take_sample(self, threads):
+        frames = sys._current_frames()
+        for ident, name in threads.items():
+            frame = frames.get(ident)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append((code.co_filename, code.co_firstlineno, code.co_name))
+                frame = frame.f_back
+            stack.reverse()
+            self.samples[(name, tuple(stack))] += 1
+        self.sample_count += 1
+
+    def run(self, duration):
+        """Sample for `duration` seconds on the calling thread"""
+        started = time.monotonic()
+        deadline = started + duration
+        next_sample = started
+        threads = self._selected_threads()
+        refresh_at = started + 1.0
+        while True:
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            if now >= refresh_at:
+                # Pick up pipelines that were (re)started while profiling
+                threads = self._selected_threads()
+                refresh_at = now + 1.0
+            self._take_sample(threads)
+            next_sample += self.interval
+            delay = next_sample - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_sample = time.monotonic()
+        self.duration = time.monotonic() - started
+        return self
+
+    def collapsed(self):
+        """Stacks in the folded format used by flamegraph.pl, speedscope and friends"""
+        lines = []
+        for (thread_name, stack), count in self.samples.most_common():
+            frames = [thread_name] + [f"{name} ({os.path.basename(filename)}:{lineno})" for filename, lineno, name in stack]
+            lines.append(";".join(f.replace(";", ":") for f in frames) + f" {count}")
+        return "\n".join(lines) + "\n"
+
+    def pstats(self):
+        """
+        Samples converted to a marshalled pstats dump, loadable with pstats.Stats or
+        snakeviz. Call counts are sample counts and times are sample counts times the interval.
+        """
+        stats = {}
+        for (thread_name, stack), count in self.samples.items():
+            seconds = count * self.interval
+            seen = set()
+            for depth, key in enumerate(stack):
+                cc, nc, tt, ct, callers = stats.get(key, (0, 0, 0.0, 0.0, {}))
+                if key not in seen:
+                    # Recursive frames only count once towards cumulative time
+                    seen.add(key)
+                    cc += count
+                    ct += seconds
+                nc += count
+                if depth == len(stack) - 1:
+                    tt += seconds
+                if depth > 0:
+                    caller = stack[depth - 1]
+                    c_cc, c_nc, c_tt, c_ct = callers.get(caller, (0, 0, 0.0, 0.0))
+                    callers[caller] = (c_cc + count, c_nc + count,
+                                       c_tt + (seconds if depth == len(stack) - 1 else 0.0), c_ct + seconds)
+                stats[key] = (cc, nc, tt, ct, callers)
+        return marshal.dumps(stats)
+
+
+_session_lock = threading.Lock()
+
+
+def profile(duration, interval=0.005, thread_prefixes=PIPELINE_THREAD_PREFIXES):
+    """Run one profiling session; only one may run at a time"""
+    duration, interval = float(duration), float(interval)
+    if not (math.isfinite(duration) and math.isfinite(interval)):
+        raise ValueError("duration and interval must be finite")
+    duration = min(max(duration, 0.1), MAX_DURATION_SECONDS)
+    interval = min(max(interval, 0.001), duration)
+    if not _session_lock.acquire(blocking=False):
+        raise ProfilerBusy("A profiling session is already running")
+    try:
+        return SamplingProfiler(interval, thread_prefixes).run(duration)
+    finally:
+        _session_lock.release()
@@ -0,0 +1,246 @@
+import json
+import os
+import time
+import logging
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+from threading import Condition
+
+import cv2
+
+CONFIG_PATH = os.environ.get('FEEDS_CONFIG', os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'config', 'feeds_config.json')))
+
+# Gate counters drive global_car_count and ANPR, lot cameras are best effort
+DEFAULT_PRIORITY = {"counter": 10, "multicam": 1}
+DEFAULT_TARGET_FPS = {"counter": 10, "multicam": 5}
+
+# Load shedding steps, applied one at a time: (fraction of target FPS, YOLO input size)
+SHED_LEVELS = [
+    (1.0, 640),
+    (0.5, 640),
+    (0.5, 480),
+    (0.25, 480),
+    (0.25, 320),
+]
+
+
+def configure_threads(intra_op_threads):
+    """
+    Pin intra-op parallelism of OpenCV and torch so concurrent inferences share the
+    cores instead of each one trying to use all of them. OMP_NUM_THREADS only reaches
+    OpenMP runtimes loaded after this call; torch may already be loaded, so its thread
+    count is set directly.
+    """
+    os.environ["OMP_NUM_THREADS"] = str(intra_op_threads)
+    cv2.setNumThreads(intra_op_threads)
+    try:
+        import torch
+        torch.set_num_threads(intra_op_threads)
+    except ImportError:
+        pass
+
+
+class FeedSchedule:
+    def __init__(self, feed_id, priority, target_fps, input_size=640):
+        self.feed_id = feed_id
+        self.priority = priority
+        self.target_fps = target_fps
+        # Largest YOLO input size of the feed, lowered by its tuning; shedding only goes below it
+        self.input_size = input_size
+        self.shed_level = 0
+        self.next_due = 0.0
+        self.waiting_since = None
+        self.inference_ms = 0.0
+        self.wait_ms = 0.0
+        self.inferences = 0
+        # Pipelines running this feed; the schedule is dropped when the last one unregisters
+        self.users = 1
+
+    @property
+    def fps(self):
+        return self.target_fps * SHED_LEVELS[self.shed_level][0]
+
+    @property
+    def imgsz(self):
+        return min(SHED_LEVELS[self.shed_level][1], self.input_size)
+
+    def status(self):
+        return {
+            "feedId": self.feed_id,
+            "priority": self.priority,
+            "targetFps": self.target_fps,
+            "effectiveFps": round(self.fps, 2),
+            "inputSize": self.imgsz,
+            "shedLevel": self.shed_level,
+            "avgInferenceMs": round(self.inference_ms, 1),
+            "avgSlotWaitMs": round(self.wait_ms, 1),
+            "inferences": self.inferences,
+            "waiting": self.waiting_since is not None,
+        }
+
+
+class InferenceScheduler:
+    """
+    Hands out a fixed number of inference slots to feeds by priority and paces every
+    feed at its target FPS. When the slots stay saturated, the lowest priority feeds are
+    shed first (lower FPS, then lower input size), and restored highest priority first
+    once there is headroom again. Every decision is kept for the API.
+    """
+    def __init__(self, slots=None, intra_op_threads=2, high_water=0.9, low_water=0.6, adjust_interval=2.0):
+        cpu_count = os.cpu_count() or 1
+        self.intra_op_threads = max(1, min(intra_op_threads, cpu_count))
+        self.slots = slots or max(1, cpu_count // self.intra_op_threads)
+        self.high_water = high_water
+        self.low_water = low_water
+        self.adjust_interval = adjust_interval
+
+        self.feeds = {}
+        self.active = 0
+        self.decisions = deque(maxlen=100)
+        self.utilization = 0.0
+
+        self._cond = Condition()
+        self._busy_seconds = 0.0
+        self._window_start = time.monotonic()
+
+        configure_threads(self.intra_op_threads)
+
+    @classmethod
+    def from_config(cls, config_path=CONFIG_PATH):
+        try:
+            with open(config_path, 'r') as f:
+                settings = json.load(f).get('scheduler', {})
+        except (OSError, ValueError):
+            settings = {}
+        return cls(
+            slots=settings.get('slots'),
+            intra_op_threads=settings.get('inference_threads', 2),
+            high_water=settings.get('high_water', 0.9),
+            low_water=settings.get('low_water', 0.6),
+        )
+
+    def register(self, feed):
+        """
+        Register a feed from its config entry, using `priority` and `target_fps` if
+        present, and the input size of its `tuning` block. A feed registered again by
+        another pipeline shares its schedule until both have unregistered.
+        """
+        feed_type = feed.get('type')
+        with self._cond:
+            schedule = self.feeds.get(feed['id'])
+            if schedule is not None:
+                schedule.users += 1
+                return schedule
+            schedule = FeedSchedule(
+                feed['id'],
+                feed.get('priority', DEFAULT_PRIORITY.get(feed_type, 1)),
+                feed.get('target_fps', DEFAULT_TARGET_FPS.get(feed_type, 5)),
+                (feed.get('tuning') or {}).get('imgsz', SHED_LEVELS[0][1]),
+            )
+            self.feeds[feed['id']] = schedule
+            return schedule
+
+    def unregister(self, feed_id):
+        with self._cond:
+            schedule = self.feeds.get(feed_id)
+            if schedule is not None:
+                schedule.users -= 1
+                if schedule.users <= 0:
+                    del self.feeds[feed_id]
+            self._cond.notify_all()
+
+    def input_size(self, feed_id):
+        return self.feeds[feed_id].imgsz
+
+    def pace(self, feed_id):
+        """Sleep until the feed is due for its next inference at its current effective FPS"""
+        feed = self.feeds[feed_id]
+        delay = feed.next_due - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def _is_next(self, feed):
+        # The waiting feed with the highest priority goes first, ties go to the longest waiting
+        waiting = [f for f in self.feeds.values() if f.waiting_since is not None]
+        if not waiting:
+            return True
+        best = min(waiting, key=lambda f: (-f.priority, f.waiting_since))
+        return best is feed
+
+    @contextmanager
+    def slot(self, feed_id):
+        """Hold one inference slot for the duration of the block"""
+        feed = self.feeds[feed_id]
+        with self._cond:
+            feed.waiting_since = time.monotonic()
+            while not (self.active < self.slots and self._is_next(feed)):
+                self._cond.wait(0.05)
+            started = time.monotonic()
+            feed.wait_ms = 0.9 * feed.wait_ms + 0.1 * (started - feed.waiting_since) * 1000
+            feed.waiting_since = None
+            feed.next_due = started + 1.0 / max(feed.fps, 0.1)
+            self.active += 1
+        try:
+            yield feed
+        finally:
+            elapsed = time.monotonic() - started
+            with self._cond:
+                self.active -= 1
+                self._busy_seconds += elapsed
+                feed.inferences += 1
+                feed.inference_ms = 0.9 * feed.inference_ms + 0.1 * elapsed * 1000 if feed.inferences > 1 else elapsed * 1000
+                self._adjust()
+                self._cond.notify_all()
+
+    def _adjust(self):
+        now = time.monotonic()
+        window = now - self._window_start
+        if window < self.adjust_interval:
+            return
+        self.utilization = self._busy_seconds / (window * self.slots)
+        self._busy_seconds = 0.0
+        self._window_start = now
+
+        if self.utilization > self.high_water:
+            candidates = [f for f in self.feeds.values() if f.shed_level < len(SHED_LEVELS) - 1]
+            if candidates:
+                feed = min(candidates, key=lambda f: (f.priority, f.shed_level))
+                feed.shed_level += 1
+                self._record("shed", feed)
+        elif self.utilization < self.low_water:
+            candidates = [f for f in self.feeds.values() if f.shed_level > 0]
+            if candidates:
+                feed = max(candidates, key=lambda f: (f.priority, f.shed_level))
+                feed.shed_level -= 1
+                self._record("restore", feed)
+
+    def _record(self, action, feed):
+        decision = {
+            "time": datetime.now().isoformat(timespec="seconds"),
+            "action": action,
+            "feedId": feed.feed_id,
+            "shedLevel": feed.shed_level,
+            "effectiveFps": round(feed.fps, 2),
+            "inputSize": feed.imgsz,
+            "utilization": round(self.utilization, 3),
+        }
+        self.decisions.append(decision)
+        logging.info(f"[scheduler] {action} feed {feed.feed_id}: {feed.fps:.1f} FPS at {feed.imgsz}px (utilization {self.utilization:.0%})")
+
+    def status(self):
+        with self._cond:
+            return {
+                "slots": self.slots,
+                "activeSlots": self.active,
+                "intraOpThreads": self.intra_op_threads,
+                "utilization": round(self.utilization, 3),
+                "highWater": self.high_water,
+                "lowWater": self.low_water,
+                "feeds": [f.status() for f in sorted(self.feeds.values(), key=lambda f: -f.priority)],
+                "decisions": list(self.decisions),
+            }
+
+
+# This single instance will be used everywhere
+inference_scheduler = InferenceScheduler.from_config()
@@ -0,0 +1,158 @@
+import time
+
+import cv2
+import numpy as np
+
+from .metrics import OCCUPANCY_VERIFICATIONS, OCCUPANCY_CORRECTIONS
+
+# Slots are compared on a grayscale copy of the frame downscaled to this width
+WORK_WIDTH = 160
+
+
+class SlotOccupancy:
+    """
+    Occupancy of the parking slots a lot camera sees, each slot a polygon in frame
+    coordinates. Every frame, each slot is compared with a learned image of it empty:
+    the mean absolute grey level difference and the change in edge density over the
+    slot, all slots at once with one bincount per statistic over a slot label image.
+    A slot whose score stays on the other side of the threshold for `confirm_frames`
+    frames changes state.
+
+    YOLO only runs when `verify_due()` says so: every `verify_interval` seconds, and
+    soon after any slot changed state, so a change the statistics got wrong is put
+    right. Verification decides which slots hold a car, and the slots it finds empty
+    become, or refresh, their empty reference. Until a slot has a reference it keeps
+    the state YOLO gave it.
+    """
+    def __init__(self, slots, frame_size=(640, 480), threshold=0.12, confirm_frames=5, verify_interval=30.0,
+                 min_verify_interval=2.0, min_overlap=0.4, learn_rate=0.5, drift_rate=0.01, clock=time.monotonic):
+        if not slots:
+            raise ValueError("Slot occupancy needs at least one slot polygon")
+        self.count = len(slots)
+        self.threshold = threshold
+        self.confirm_frames = confirm_frames
+        self.verify_interval = verify_interval
+        self.min_verify_interval = min_verify_interval
+        self.min_overlap = min_overlap
+        self.learn_rate = learn_rate
+        self.drift_rate = drift_rate
+        self.clock = clock
+
+        width, height = frame_size
+        self.scale = WORK_WIDTH / width
+        self.work_size = (WORK_WIDTH, max(1, int(round(height * self.scale))))
+        self.polygons = [np.asarray(slot, dtype=np.int32).reshape(-1, 2) for slot in slots]
+        # Pixel label of the slot it belongs to, 0 outside every slot; later slots win where they overlap
+        self.labels = np.zeros(self.work_size[::-1], dtype=np.int32)
+        for i, polygon in enumerate(self.polygons, 1):
+            cv2.fillPoly(self.labels, [np.round(polygon * self.scale).astype(np.int32)], i)
+        self._flat_labels = self.labels.ravel()
+        self.pixels = np.bincount(self._flat_labels, minlength=self.count + 1)[1:].astype(np.float32)
+        if not self.pixels.all():
+            raise ValueError("Every slot polygon must cover some of the frame")
+
+        self.occupied = np.zeros(self.count, dtype=bool)
+        self.scores = np.zeros(self.count, dtype=np.float32)
+        self.reference = np.zeros(self.work_size[::-1], dtype=np.float32)
+        self.reference_edges = np.zeros(self.count, dtype=np.float32)
+        self.learned = np.zeros(self.count, dtype=bool)
+        self._streak = np.zeros(self.count, dtype=np.int32)
+        self._gray = None
+        self._edges = None
+        self.verified_at = None
+        self.changed_since_verify = False
+
+    @classmethod
+    def from_config(cls, settings, frame_size):
+        """From the `occupancy` block of a multicam feed: {"slots": [[[x, y], ...], ...], ...}"""
+        return cls(
+            settings['slots'],
+            frame_size,
+            threshold=settings.get('threshold', 0.12),
+            confirm_frames=settings.get('confirm_frames', 5),
+            verify_interval=settings.get('verify_interval_s', 30.0),
+            min_verify_interval=settings.get('min_verify_interval_s', 2.0),
+            min_overlap=settings.get('min_overlap', 0.4),
+        )
+
+    @property
+    def available(self):
+        return int(self.count - self.occupied.sum())
+
+    def _slot_means(self, values):
+        return np.bincount(self._flat_labels, weights=values.ravel(), minlength=self.count + 1)[1:] / self.pixels
+
+    def update(self, frame):
+        """Score every slot against its empty reference and apply confirmed changes"""
+        small = cv2.resize(frame, self.work_size, interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        self._edges = cv2.Canny(gray, 50, 150).astype(np.float32) / 255
+        self._gray = gray.astype(np.float32)
+        if not self.learned.any():
+            return
+        difference = self._slot_means(np.abs(self._gray - self.reference)) / 255
+        edges = self._slot_means(self._edges)
+        self.scores = difference + np.abs(edges - self.reference_edges)
+
+        # Hysteresis, so a score hovering around the threshold does not flicker
+        looks_occupied = np.where(self.occupied, self.scores > self.threshold * 0.6, self.scores > self.threshold)
+        disagrees = (looks_occupied != self.occupied) & self.learned
+        self._streak = np.where(disagrees, self._streak + 1, 0)
+        flips = self._streak >= self.confirm_frames
+        if flips.any():
+            self.occupied[flips] = ~self.occupied[flips]
+            self._streak[flips] = 0
+            self.changed_since_verify = True
+
+        # Let the references of clearly empty slots follow slow changes in lighting
+        if self.drift_rate:
+            steady = self.learned & ~self.occupied & (self.scores < self.threshold * 0.3)
+            if steady.any():
+                self._learn(steady, self.drift_rate)
+
+    def verify_due(self):
+        if self.verified_at is None:
+            return True
+        elapsed = self.clock() - self.verified_at
+        return elapsed >= self.verify_interval or (self.changed_since_verify and elapsed >= self.min_verify_interval)
+
+    def verify(self, boxes, feed_id=None):
+        """Take the slots covered by detected [x, y, w, h] car boxes as occupied, and learn the empty ones"""
+        covered = np.zeros(self.count, dtype=np.float32)
+        height, width = self.labels.shape
+        for x, y, w, h in boxes:
+            x1, y1 = max(0, int(x * self.scale)), max(0, int(y * self.scale))
+            x2, y2 = min(width, int((x + w) * self.scale) + 1), min(height, int((y + h) * self.scale) + 1)
+            if x2 <= x1 or y2 <= y1:
+                continue
+            inside = np.bincount(self.labels[y1:y2, x1:x2].ravel(), minlength=self.count + 1)[1:]
+            np.maximum(covered, inside / self.pixels, out=covered)
+        occupied = covered >= self.min_overlap
+
+        if feed_id is not None:
+            reason = "interval" if not self.changed_since_verify else "change"
+            OCCUPANCY_VERIFICATIONS.labels(feed_id, reason).inc()
+            corrections = int(((occupied != self.occupied) & self.learned).sum())
+            if corrections:
+                OCCUPANCY_CORRECTIONS.labels(feed_id).inc(corrections)
+        self.occupied = occupied
+        self._streak[:] = 0
+        if self._gray is not None:
+            empty = ~occupied
+            rate = np.where(self.learned, self.learn_rate, 1.0)
+            for value in np.unique(rate[empty]):
+                self._learn(empty & (rate == value), float(value))
+            self.learned |= empty
+        self.verified_at = self.clock()
+        self.changed_since_verify = False
+
+    def _learn(self, slots, rate):
+        """Blend the current frame into the empty reference of the given slots"""
+        mask = slots[self.labels - 1] & (self.labels > 0)
+        self.reference[mask] += rate * (self._gray[mask] - self.reference[mask])
+        edges = self._slot_means(self._edges)
+        self.reference_edges[slots] += rate * (edges[slots] - self.reference_edges[slots])
+
+    def draw(self, frame):
+        for polygon, occupied in zip(self.polygons, self.occupied):
+            cv2.polylines(frame, [polygon], True, (0, 0, 255) if occupied else (0, 255, 0), 2)
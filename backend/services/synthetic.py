@@ -0,0 +1,184 @@
+import cv2
+import numpy as np
+import time
+from urllib.parse import urlparse, parse_qs
+
+SCHEME = "synthetic://"
+
+VEHICLE_COLORS = [
+    (40, 40, 200), (200, 200, 200), (30, 30, 30), (180, 120, 40),
+    (60, 160, 60), (20, 20, 120), (220, 220, 240), (90, 90, 90),
+]
+
+
+def is_synthetic_source(source):
+    return isinstance(source, str) and source.startswith(SCHEME)
+
+
+def parse_synthetic_source(source):
+    """
+    Options of a synthetic source URL, e.g.
+    synthetic://gate?width=1280&height=720&fps=15&density=0.5&seed=3&frames=0&realtime=1
+    """
+    query = parse_qs(urlparse(source).query)
+
+    def option(name, cast, default):
+        return cast(query[name][0]) if name in query else default
+
+    return {
+        "width": option("width", int, 1280),
+        "height": option("height", int, 720),
+        "fps": option("fps", float, 15.0),
+        "density": option("density", float, 0.5),  # vehicles entering per second
+        "seed": option("seed", int, 0),
+        "frames": option("frames", int, 0),  # 0 means endless
+        "realtime": option("realtime", int, 1) == 1,
+    }
+
+
+class SyntheticCapture:
+    """
+    A cv2.VideoCapture look-alike that renders a road with moving vehicle-like boxes.
+
+    Vehicles enter from the top or bottom edge at a rate set by `density` and drive
+    across the frame, so every one of them crosses the middle line. The exact crossings
+    are kept in `crossings` as ground truth. In realtime mode `read()` blocks like a
+    camera delivering `fps` frames per second; otherwise frames come as fast as they render.
+    """
+    def __init__(self, source):
+        options = parse_synthetic_source(source)
+        self.width = options["width"]
+        self.height = options["height"]
+        self.fps = options["fps"]
+        self.density = options["density"]
+        self.frames = options["frames"]
+        self.realtime = options["realtime"]
+        self.seed = options["seed"]
+
+        self.frame_index = 0
+        self.crossings = []
+        self.vehicles = []
+        self._opened = True
+        self._rng = np.random.default_rng(self.seed)
+        self._background = self._render_background()
+        self._next_frame_at = None
+
+    def _render_background(self):
+        rng = np.random.default_rng(self.seed + 1)
+        background = np.empty((self.height, self.width, 3), np.uint8)
+        background[:] = (70, 70, 70)
+        noise = rng.integers(-12, 12, size=(self.height, self.width, 1), dtype=np.int16)
+        background[:] = np.clip(background.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+        # Lane markings
+        for x in (self.width // 3, 2 * self.width // 3):
+            for y in range(0, self.height, 60):
+                cv2.rectangle(background, (x - 3, y), (x + 3, y + 30), (220, 220, 220), -1)
+        return background
+
+    def _spawn(self):
+        width = int(self.width * self._rng.uniform(0.07, 0.12))
+        height = int(width * self._rng.uniform(1.3, 1.8))
+        towards = bool(self._rng.integers(0, 2))
+        # Crossing the frame takes 2 to 5 seconds
+        speed = (self.height + height) / (self._rng.uniform(2.0, 5.0) * self.fps)
+        x = int(self._rng.uniform(0, self.width - width))
+        y = -height if towards else self.height
+        self.vehicles.append({
+            "x": x, "y": float(y), "w": width, "h": height,
+            "vy": speed if towards else -speed,
+            "color": VEHICLE_COLORS[int(self._rng.integers(0, len(VEHICLE_COLORS)))],
+        })
+
+    def _step(self):
+        # Poisson arrivals at `density` vehicles per second
+        for _ in range(self._rng.poisson(self.density / self.fps)):
+            self._spawn()
+
+        center_y = self.height // 2
+        alive = []
+        for vehicle in self.vehicles:
+            prev_cy = vehicle["y"] + vehicle["h"] / 2
+            vehicle["y"] += vehicle["vy"]
+            cy = vehicle["y"] + vehicle["h"] / 2
+            if prev_cy < center_y <= cy:
+                self.crossings.append({"frame": self.frame_index, "direction": "towards"})
+            elif prev_cy > center_y >= cy:
+                self.crossings.append({"frame": self.frame_index, "direction": "away"})
+            if -vehicle["h"] <= vehicle["y"] <= self.height:
+                alive.append(vehicle)
+        self.vehicles = alive
+
+    def _render(self, image):
+        np.copyto(image, self._background)
+        for vehicle in self.vehicles:
+            x, y, w, h = vehicle["x"], int(vehicle["y"]), vehicle["w"], vehicle["h"]
+            cv2.rectangle(image, (x, y), (x + w, y + h), vehicle["color"], -1)
+            # Windshield and rear window
+            cv2.rectangle(image, (x + w // 8, y + h // 5), (x + w - w // 8, y + h // 3), (35, 25, 20), -1)
+            cv2.rectangle(image, (x + w // 8, y + 2 * h // 3), (x + w - w // 8, y + 4 * h // 5), (35, 25, 20), -1)
+
+    def isOpened(self):
+        return self._opened
+
+    def grab(self):
+        """Advance one frame without rendering it, like cv2.VideoCapture.grab"""
+        if not self._opened or (self.frames and self.frame_index >= self.frames):
+            return False
+
+        if self.realtime:
+            now = time.monotonic()
+            if self._next_frame_at is None:
+                self._next_frame_at = now
+            delay = self._next_frame_at - now
+            if delay > 0:
+                time.sleep(delay)
+            self._next_frame_at = max(self._next_frame_at + 1.0 / self.fps, time.monotonic() - 1.0)
+
+        self._step()
+        self.frame_index += 1
+        return True
+
+    def read(self, image=None):
+        if not self.grab():
+            return False, None
+        if image is None or image.shape != (self.height, self.width, 3):
+            image = np.empty((self.height, self.width, 3), np.uint8)
+        self._render(image)
+        return True, image
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FPS:
+            return self.fps
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            return self.width
+        if prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            return self.height
+        if prop == cv2.CAP_PROP_FRAME_COUNT:
+            return self.frames
+        if prop == cv2.CAP_PROP_POS_FRAMES:
+            return self.frame_index
+        return 0
+
+    def set(self, prop, value):
+        if prop == cv2.CAP_PROP_POS_FRAMES:
+            # Seeking re-simulates from the start so crossings stay deterministic
+            target = int(value)
+            self.frame_index = 0
+            self.crossings = []
+            self.vehicles = []
+            self._rng = np.random.default_rng(self.seed)
+            while self.frame_index < target:
+                self._step()
+                self.frame_index += 1
+            return True
+        return False
+
+    def release(self):
+        self._opened = False
+
+
+def open_capture(source):
+    """cv2.VideoCapture for real sources, SyntheticCapture for synthetic:// sources"""
+    if is_synthetic_source(source):
+        return SyntheticCapture(source)
+    return cv2.VideoCapture(source)
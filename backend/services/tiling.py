@@ -0,0 +1,176 @@
+import cv2
+import numpy as np
+
+from .metrics import TILES_INFERRED
+
+# Tiles are compared on a grayscale thumbnail of the frame at this fraction of its size
+THUMB_SCALE = 1 / 16
+
+
+def tile_grid(length, tile, overlap):
+    """Start offsets of tiles of `tile` pixels covering `length` with at least `overlap` of a tile shared"""
+    if length <= tile:
+        return [0]
+    step = tile * (1 - overlap)
+    count = int(np.ceil((length - tile) / step)) + 1
+    return [int(round(start)) for start in np.linspace(0, length - tile, count)]
+
+
+def merge_detections(boxes, scores, clipped, iou_threshold=0.5, containment=0.8):
+    """
+    Greedy non-maximum suppression over (n, 4) [x1, y1, x2, y2] boxes from overlapping
+    tiles. A box is dropped when it overlaps a more confident one by more than
+    `iou_threshold`, or when it was cut off by its tile's edge (`clipped`) and lies
+    mostly, by `containment` of its own area, inside a more confident box: the part of
+    a car that another tile, or the whole-frame view, saw in full. Boxes that were not
+    cut off are taken first, so a part never suppresses the whole.
+    """
+    if not len(boxes):
+        return np.zeros(0, dtype=np.int64)
+    x1, y1, x2, y2 = boxes.T
+    areas = np.maximum(x2 - x1, 1e-6) * np.maximum(y2 - y1, 1e-6)
+    inter_w = np.clip(np.minimum(x2[:, None], x2[None]) - np.maximum(x1[:, None], x1[None]), 0, None)
+    inter_h = np.clip(np.minimum(y2[:, None], y2[None]) - np.maximum(y1[:, None], y1[None]), 0, None)
+    intersection = inter_w * inter_h
+    iou = intersection / (areas[:, None] + areas[None] - intersection)
+    # Share of the row box's area inside the column box
+    inside = intersection / areas[:, None]
+
+    keep = []
+    suppressed = np.zeros(len(boxes), dtype=bool)
+    for i in np.lexsort((-scores, clipped)):
+        if suppressed[i]:
+            continue
+        keep.append(i)
+        suppressed |= (iou[:, i] > iou_threshold) | (clipped & (inside[:, i] > containment))
+    return np.array(keep, dtype=np.int64)
+
+
+class TiledDetector:
+    """
+    Car detection for wide, high resolution lot cameras, in place of one pass over the
+    downscaled frame, which misses distant cars. The full resolution frame is split into
+    overlapping `tile_size` tiles, plus with `full_view` the whole frame as one more
+    view, which sees near cars that no single tile holds in full.
+
+    Only views whose content changed since they were last inferred go through the model,
+    together in one batch: a view changed when any cell of its part of a 1/16 scale
+    grey thumbnail moved by more than `change_threshold` grey levels, which a car of a
+    few dozen pixels already does, or after `refresh_frames` frames without inference.
+    The others reuse their cached detections. All detections are merged with cross-tile
+    NMS, see merge_detections, and scaled to `output_size`, the frame size the tracker
+    and counting zones work in.
+
+    Stands in for CarDetector: `imgsz` is the input size of each view and the merged
+    detections are written to `trace`.
+    """
+    def __init__(self, detector, tile_size=640, overlap=0.2, full_view=True, change_threshold=12.0, refresh_frames=30,
+                 iou_threshold=0.5, containment=0.8, output_size=None, feed_id=None):
+        self.detector = detector
+        self.tile_size = tile_size
+        self.overlap = overlap
+        self.full_view = full_view
+        self.change_threshold = change_threshold
+        self.refresh_frames = refresh_frames
+        self.iou_threshold = iou_threshold
+        self.containment = containment
+        self.output_size = output_size
+        self.feed_id = feed_id
+        self.trace = None
+        self.frame_index = 0
+        self._shape = None
+        self._views = []  # (x1, y1, x2, y2) in frame pixels, whole frame last
+        self._reference = []  # thumbnail of each view when it was last inferred, or None
+        self._age = []
+        self._cache = []  # (boxes as (n, 4) x1 y1 x2 y2 in frame pixels, scores, clipped) per view
+
+    @classmethod
+    def from_config(cls, detector, settings, output_size, feed_id=None):
+        """From the `tiling` block of a multicam feed"""
+        return cls(
+            detector,
+            tile_size=settings.get('tile_size', 640),
+            overlap=settings.get('overlap', 0.2),
+            full_view=settings.get('full_view', True),
+            change_threshold=settings.get('change_threshold', 12.0),
+            refresh_frames=settings.get('refresh_frames', 30),
+            output_size=output_size,
+            feed_id=feed_id,
+        )
+
+    @property
+    def imgsz(self):
+        return self.detector.imgsz
+
+    @imgsz.setter
+    def imgsz(self, value):
+        self.detector.imgsz = value
+
+    def _layout(self, shape):
+        height, width = shape[:2]
+        self._shape = shape
+        self._views = [(x, y, min(width, x + self.tile_size), min(height, y + self.tile_size))
+                       for y in tile_grid(height, self.tile_size, self.overlap)
+                       for x in tile_grid(width, self.tile_size, self.overlap)]
+        if self.full_view and len(self._views) > 1:
+            self._views.append((0, 0, width, height))
+        self._reference = [None] * len(self._views)
+        self._age = [0] * len(self._views)
+        self._cache = [(np.zeros((0, 4)), np.zeros(0), np.zeros(0, dtype=bool))] * len(self._views)
+
+    def _changed_views(self, frame):
+        height, width = frame.shape[:2]
+        small = cv2.resize(frame, (max(1, int(width * THUMB_SCALE)), max(1, int(height * THUMB_SCALE))),
+                           interpolation=cv2.INTER_AREA)
+        thumb = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY).astype(np.float32)
+        scale_x, scale_y = thumb.shape[1] / width, thumb.shape[0] / height
+        due, crops = [], []
+        for i, (x1, y1, x2, y2) in enumerate(self._views):
+            part = thumb[int(y1 * scale_y):max(int(y1 * scale_y) + 1, int(y2 * scale_y)),
+                         int(x1 * scale_x):max(int(x1 * scale_x) + 1, int(x2 * scale_x))]
+            reference = self._reference[i]
+            self._age[i] += 1
+            if (reference is None or reference.shape != part.shape or self._age[i] >= self.refresh_frames
+                    or float(np.abs(part - reference).max()) > self.change_threshold):
+                due.append(i)
+                crops.append(frame[y1:y2, x1:x2])
+                self._reference[i] = part.copy()
+                self._age[i] = 0
+        return due, crops
+
+    def detect_cars_with_scores(self, frame):
+        """Detected cars as ([x, y, w, h] boxes, confidences), in `output_size` coordinates"""
+        if self._shape != frame.shape:
+            self._layout(frame.shape)
+        due, crops = self._changed_views(frame)
+        height, width = frame.shape[:2]
+        for i, (boxes, scores) in zip(due, self.detector.detect_cars_batch(crops)):
+            x1, y1, x2, y2 = self._views[i]
+            found = np.array(boxes, dtype=np.float64).reshape(-1, 4)
+            found[:, 2:] += found[:, :2]
+            found += (x1, y1, x1, y1)
+            # Boxes touching an edge of the view that is not an edge of the frame are cut off
+            margin = 2
+            clipped = (((found[:, 0] <= x1 + margin) & (x1 > 0)) | ((found[:, 1] <= y1 + margin) & (y1 > 0))
+                       | ((found[:, 2] >= x2 - margin) & (x2 < width)) | ((found[:, 3] >= y2 - margin) & (y2 < height)))
+            self._cache[i] = (found, np.array(scores, dtype=np.float64), clipped)
+        if self.feed_id is not None:
+            TILES_INFERRED.labels(self.feed_id, "inferred").inc(len(due))
+            TILES_INFERRED.labels(self.feed_id, "skipped").inc(len(self._views) - len(due))
+
+        boxes = np.concatenate([cached[0] for cached in self._cache])
+        scores = np.concatenate([cached[1] for cached in self._cache])
+        clipped = np.concatenate([cached[2] for cached in self._cache])
+        keep = merge_detections(boxes, scores, clipped, self.iou_threshold, self.containment)
+
+        out_width, out_height = self.output_size or (width, height)
+        scale = np.array([out_width / width, out_height / height] * 2)
+        merged = boxes[keep] * scale
+        detected_cars = [[int(x1), int(y1), int(x2) - int(x1), int(y2) - int(y1)] for x1, y1, x2, y2 in merged]
+        confidences = [float(score) for score in scores[keep]]
+        if self.trace is not None:
+            self.trace.write(self.frame_index, detected_cars, confidences)
+        return detected_cars, confidences
+
+    def detect_cars(self, frame):
+        return self.detect_cars_with_scores(frame)[0]
@@ -0,0 +1,161 @@
+import json
+import os
+import struct
+from datetime import datetime
+
+import numpy as np
+
+# Detection trace file layout (little endian):
+#   header   magic b"DTRC", uint16 version, uint32 metadata length, metadata as UTF-8 JSON
+#   records  uint32 frame index, uint16 box count n, n * 4 int16 boxes (x, y, w, h), n float32 confidences
+MAGIC = b"DTRC"
+VERSION = 1
+EXTENSION = ".dtrc"
+
+_HEADER = struct.Struct("<4sHI")
+_RECORD = struct.Struct("<IH")
+
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+
+class TraceWriter:
+    """
+    Appends the detections of every processed frame to a trace file. Writes go through
+    a buffered file, so recording costs a struct pack and two small writes per frame.
+    """
+    def __init__(self, path, metadata=None):
+        self.path = path
+        self.metadata = dict(metadata or {})
+        self.metadata.setdefault("created", datetime.now().isoformat(timespec="seconds"))
+        self.frames = 0
+        self.detections = 0
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._file = open(path, 'wb')
+        encoded = json.dumps(self.metadata, sort_keys=True).encode()
+        self._file.write(_HEADER.pack(MAGIC, VERSION, len(encoded)))
+        self._file.write(encoded)
+
+    def write(self, frame_index, boxes, confidences=None):
+        count = len(boxes)
+        self._file.write(_RECORD.pack(frame_index, count))
+        if count:
+            if confidences is None:
+                confidences = [1.0] * count
+            self._file.write(np.clip(np.asarray(boxes), -32768, 32767).astype('<i2').tobytes())
+            self._file.write(np.asarray(confidences, dtype='<f4').tobytes())
+        self.frames += 1
+        self.detections += count
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class Trace:
+    """
+    A detection trace loaded into flat arrays: one entry per frame in `frame_indices`
+    and `counts`, and all boxes and confidences back to back.
+    """
+    def __init__(self, metadata, frame_indices, counts, boxes, confidences):
+        self.metadata = metadata
+        self.frame_indices = frame_indices
+        self.counts = counts
+        self.boxes = boxes
+        self.confidences = confidences
+        self.offsets = np.concatenate(([0], np.cumsum(counts, dtype=np.int64)))
+
+    def __len__(self):
+        return len(self.frame_indices)
+
+    @property
+    def detections(self):
+        return len(self.boxes)
+
+    @property
+    def frame_size(self):
+        """(width, height) of the frames the detections were made on"""
+        return tuple(self.metadata["frame_size"])
+
+    def frame(self, i):
+        """(frame index, boxes, confidences) of the i-th record"""
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return int(self.frame_indices[i]), self.boxes[start:end], self.confidences[start:end]
+
+    def iter_boxes(self, min_confidence=None):
+        """Yield (frame index, [[x, y, w, h], ...]) in the shape the trackers take"""
+        boxes = self.boxes.tolist()
+        keep = None
+        if min_confidence is not None:
+            keep = (self.confidences > min_confidence).tolist()
+        offsets = self.offsets.tolist()
+        for i, frame_index in enumerate(self.frame_indices.tolist()):
+            start, end = offsets[i], offsets[i + 1]
+            if keep is None:
+                yield frame_index, boxes[start:end]
+            else:
+                yield frame_index, [box for box, k in zip(boxes[start:end], keep[start:end]) if k]
+
+
+def read_trace(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    magic, version, meta_length = _HEADER.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise ValueError(f"Not a detection trace: {path}")
+    if version != VERSION:
+        raise ValueError(f"Unsupported trace version {version} in {path}")
+    offset = _HEADER.size
+    metadata = json.loads(data[offset:offset + meta_length].decode())
+    offset += meta_length
+
+    frame_indices = []
+    counts = []
+    box_chunks = []
+    conf_chunks = []
+    end = len(data)
+    while offset + _RECORD.size <= end:
+        frame_index, count = _RECORD.unpack_from(data, offset)
+        offset += _RECORD.size
+        if count:
+            box_bytes = count * 8
+            if offset + box_bytes + count * 4 > end:
+                break  # Truncated last record, e.g. the recording process was killed
+            box_chunks.append(np.frombuffer(data, '<i2', count * 4, offset))
+            offset += box_bytes
+            conf_chunks.append(np.frombuffer(data, '<f4', count, offset))
+            offset += count * 4
+        frame_indices.append(frame_index)
+        counts.append(count)
+
+    boxes = np.concatenate(box_chunks).reshape(-1, 4).astype(np.int32) if box_chunks else np.empty((0, 4), np.int32)
+    confidences = np.concatenate(conf_chunks).astype(np.float32) if conf_chunks else np.empty(0, np.float32)
+    return Trace(metadata, np.array(frame_indices, np.int64), np.array(counts, np.int64), boxes, confidences)
+
+
+def open_feed_trace(feed, pipeline, frame_size):
+    """
+    TraceWriter for a feed whose config sets `record_trace`, or None. A relative path is
+    taken from the backend directory; a directory gets a timestamped file per run.
+    """
+    path = feed.get('record_trace')
+    if not path:
+        return None
+    if not os.path.isabs(path):
+        path = os.path.join(BACKEND_DIR, path)
+    if not path.endswith(EXTENSION):
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        path = os.path.join(path, f"feed{feed['id']}-{stamp}{EXTENSION}")
+    return TraceWriter(path, {
+        "feed_id": feed['id'],
+        "pipeline": pipeline,
+        "source": str(feed.get('video_source')),
+        "frame_size": list(frame_size),
+        "zones": feed.get('zones'),
+    })
@@ -0,0 +1,109 @@
+import numpy as np
+
+class CentroidTracker:
+    def __init__(self, max_disappeared=10, max_distance=50):
+        self.next_object_id = 0
+        self.objects = {}
+        self.disappeared = {}
+        self.max_disappeared = max_disappeared
+        self.max_distance = max_distance
+        self.last_direction = {}
+        self.previous_positions = {}
+
+    def register(self, centroid):
+        self.objects[self.next_object_id] = centroid
+        self.disappeared[self.next_object_id] = 0
+        self.last_direction[self.next_object_id] = None
+        self.previous_positions[self.next_object_id] = centroid
+        self.next_object_id += 1
+
+    def deregister(self, object_id):
+        del self.objects[object_id]
+        del self.disappeared[object_id]
+        del self.last_direction[object_id]
+        del self.previous_positions[object_id]
+
+    def update(self, rects):
+        if len(rects) == 0:
+            disappeared_ids = []
+            for object_id in list(self.disappeared.keys()):
+                self.disappeared[object_id] += 1
+                if self.disappeared[object_id] > self.max_disappeared:
+                    disappeared_ids.append(object_id)
+                    self.deregister(object_id)
+            return self.objects, disappeared_ids
+
+        boxes = np.asarray(rects, dtype=np.int64).reshape(-1, 4)
+        centers = boxes[:, :2] + boxes[:, 2:] // 2
+        input_centroids = list(map(tuple, centers.tolist()))
+
+        if len(self.objects) == 0:
+            for centroid in input_centroids:
+                self.register(centroid)
+            return self.objects, []
+
+        object_ids = list(self.objects.keys())
+        object_centroids = np.array(list(self.objects.values()), dtype=np.float64)
+
+        D = np.linalg.norm(object_centroids[:, None] - centers[None], axis=2)
+
+        # Greedy matching, closest objects first: each object takes its nearest detection
+        # unless it is too far or a closer object already took it, all as array operations
+        rows = D.min(axis=1).argsort(kind="stable")
+        cols = D.argmin(axis=1)[rows]
+        close = D[rows, cols] <= self.max_distance
+        rows, cols = rows[close], cols[close]
+        _, first = np.unique(cols, return_index=True)
+        rows, cols = rows[first], cols[first]
+
+        for row, col in zip(rows.tolist(), cols.tolist()):
+            object_id = object_ids[row]
+            self.objects[object_id] = input_centroids[col]
+            self.disappeared[object_id] = 0
+
+        unassigned_rows = np.ones(len(object_ids), dtype=bool)
+        unassigned_rows[rows] = False
+        for row in np.flatnonzero(unassigned_rows).tolist():
+            object_id = object_ids[row]
+            self.disappeared[object_id] += 1
+            if self.disappeared[object_id] > self.max_disappeared:
+                self.deregister(object_id)
+
+        unassigned_cols = np.ones(len(input_centroids), dtype=bool)
+        unassigned_cols[cols] = False
+        for col in np.flatnonzero(unassigned_cols).tolist():
+            self.register(input_centroids[col])
+
+        return self.objects, []
+
+
+def box_of(rects, centroid):
+    """The detection box whose centre is closest to a tracked centroid"""
+    cx, cy = centroid
+    return min(rects, key=lambda r: abs(r[0] + r[2] // 2 - cx) + abs(r[1] + r[3] // 2 - cy))
+
+
+def tracked_detections(tracker, rects, scores):
+    """(object id, box, confidence) of every tracked car that was detected in this frame"""
+    if len(rects) == 0:
+        return []
+    tracked = []
+    for object_id, centroid in tracker.objects.items():
+        if tracker.disappeared.get(object_id):
+            continue
+        i = rects.index(box_of(rects, centroid))
+        tracked.append((object_id, rects[i], scores[i]))
+    return tracked
+
+
+# Tracker variants that recorded detection traces can be replayed through
+TRACKERS = {
+    "centroid": CentroidTracker,
+}
+
+
+def make_tracker(name="centroid", **params):
+    if name not in TRACKERS:
+        raise ValueError(f"Unknown tracker: {name} (known: {', '.join(sorted(TRACKERS))})")
+    params.setdefault("max_disappeared", 10)
+    return TRACKERS[name](**params)
@@ -17,6 +17,14 @@ def draw_line(frame, line_position, color=(0, 0, 255), thickness=2):
     height, width = frame.shape[:2]
     cv2.line(frame, (0, line_position), (width, line_position), color, thickness)
 
+def scale_box(box, scale_x, scale_y, frame_shape):
+    """An [x, y, w, h] box on a downscaled frame as (x1, y1, x2, y2) on the full-resolution frame"""
+    x, y, w, h = box
+    height, width = frame_shape[:2]
+    x1, y1 = max(0, int(x * scale_x)), max(0, int(y * scale_y))
+    x2, y2 = min(width, int((x + w) * scale_x)), min(height, int((y + h) * scale_y))
+    return x1, y1, x2, y2
+
 def process_frame(frame, available_slots, total_slots):
     # Placeholder for image processing logic
     # This function can be expanded to include any additional processing needed for each frame
@@ -0,0 +1,159 @@
+import cv2
+import numpy as np
+
+# Directions the feed counters understand
+DIRECTIONS = ("towards", "away")
+# Counter a zone drives: the feed's own counters, or none, so its crossings are only published
+COUNTERS = ("feed", "none")
+
+
+def _cross(ax, ay, bx, by):
+    return ax * by - ay * bx
+
+
+class ZoneSet:
+    """
+    The counting lines and polygon zones of a feed, in processed frame coordinates,
+    from the feed's `zones` list in the feeds config:
+
+        {"name": "lane 1", "type": "line", "points": [[x1, y1], [x2, y2]],
+         "forward": "towards", "backward": "away", "counter": "feed"}
+        {"name": "gate", "type": "polygon", "points": [[x, y], ...],
+         "enter": "towards", "exit": "away", "counter": "none"}
+
+    A line is crossed forward when a track moves from the left of the line, looking
+    from its first point to its second, to its right, and backward the other way. A
+    polygon is entered and exited. Each way maps to the direction it counts as, or to
+    null if it should not count. Zones with "counter": "feed" change the feed's counts;
+    the crossings of the others are only published. Without zones, a feed counts on a
+    horizontal line through the middle of the frame, downwards being "towards".
+
+    All tracks are tested against all zones at once: one broadcast over tracks and
+    lines for the side and segment tests, and one over tracks and polygon edges for
+    the crossing-number test.
+    """
+    def __init__(self, zones):
+        self.zones = []
+        for i, zone in enumerate(zones):
+            zone = dict(zone)
+            zone.setdefault("name", f"zone {i}")
+            zone.setdefault("counter", "feed")
+            kind = zone.get("type", "line")
+            ways = ("forward", "backward") if kind == "line" else ("enter", "exit")
+            if kind not in ("line", "polygon"):
+                raise ValueError(f"Unknown zone type: {kind} (known: line, polygon)")
+            points = np.asarray(zone.get("points", ()), dtype=np.float64).reshape(-1, 2)
+            if (kind == "line" and len(points) != 2) or (kind == "polygon" and len(points) < 3):
+                raise ValueError(f"Zone {zone['name']} needs 2 points for a line or at least 3 for a polygon")
+            if zone["counter"] not in COUNTERS:
+                raise ValueError(f"Unknown counter for zone {zone['name']}: {zone['counter']} (known: {', '.join(COUNTERS)})")
+            zone.setdefault(ways[0], DIRECTIONS[0])
+            zone.setdefault(ways[1], DIRECTIONS[1])
+            if zone["counter"] == "feed" and any(zone[way] not in DIRECTIONS + (None,) for way in ways):
+                raise ValueError(f"Zone {zone['name']} counts for the feed, so it needs directions from {DIRECTIONS}")
+            zone["type"] = kind
+            zone["points"] = points
+            zone["index"] = i
+            self.zones.append(zone)
+
+        self.lines = [zone for zone in self.zones if zone["type"] == "line"]
+        self.polygons = [zone for zone in self.zones if zone["type"] == "polygon"]
+        if self.lines:
+            ends = np.array([zone["points"] for zone in self.lines])
+            self._line_start, self._line_end = ends[:, 0], ends[:, 1]
+        if self.polygons:
+            starts, ends, owner = [], [], []
+            for j, zone in enumerate(self.polygons):
+                points = zone["points"]
+                starts.append(points)
+                ends.append(np.roll(points, -1, axis=0))
+                owner.extend([j] * len(points))
+            self._edge_start = np.concatenate(starts)
+            self._edge_end = np.concatenate(ends)
+            # Edge to polygon incidence, to sum edge crossings per polygon with one product
+            self._edge_owner = np.zeros((len(owner), len(self.polygons)), dtype=np.int32)
+            self._edge_owner[np.arange(len(owner)), owner] = 1
+
+    @classmethod
+    def default(cls, frame_size):
+        width, height = frame_size
+        return cls([{"name": "center", "type": "line", "points": [[0, height // 2], [width, height // 2]]}])
+
+    @classmethod
+    def from_config(cls, zones, frame_size):
+        return cls(zones) if zones else cls.default(frame_size)
+
+    def crossings(self, previous, current):
+        """
+        (track index, direction, zone) of every zone crossed by a track moving from
+        `previous` to `current`, both (n, 2) arrays of positions, in track then zone order
+        """
+        previous = np.asarray(previous, dtype=np.float64).reshape(-1, 2)
+        current = np.asarray(current, dtype=np.float64).reshape(-1, 2)
+        if not len(previous):
+            return []
+        hits = []  # (track, zone, way)
+        if self.lines:
+            hits.extend(self._line_crossings(previous, current))
+        if self.polygons:
+            hits.extend(self._polygon_crossings(previous, current))
+        hits.sort(key=lambda hit: (hit[0], hit[1]["index"]))
+        crossings = []
+        for track, zone, way in hits:
+            direction = zone[way]
+            if direction is not None:
+                crossings.append((track, direction, zone))
+        return crossings
+
+    def _line_crossings(self, previous, current):
+        start, end = self._line_start[None], self._line_end[None]
+        along_x, along_y = (end - start)[..., 0], (end - start)[..., 1]
+        # Side of every line every track was and is on, as (tracks, lines); positive is right
+        side_before = _cross(along_x, along_y, previous[:, None, 0] - start[..., 0], previous[:, None, 1] - start[..., 1])
+        side_now = _cross(along_x, along_y, current[:, None, 0] - start[..., 0], current[:, None, 1] - start[..., 1])
+        # The move must pass between the line's ends, not beyond them
+        move_x, move_y = (current - previous)[:, None, 0], (current - previous)[:, None, 1]
+        start_side = _cross(move_x, move_y, start[..., 0] - previous[:, None, 0], start[..., 1] - previous[:, None, 1])
+        end_side = _cross(move_x, move_y, end[..., 0] - previous[:, None, 0], end[..., 1] - previous[:, None, 1])
+        between = start_side * end_side <= 0
+        forward = (side_before < 0) & (side_now >= 0) & between
+        backward = (side_before > 0) & (side_now <= 0) & between
+        hits = []
+        for mask, way in ((forward, "forward"), (backward, "backward")):
+            for track, line in zip(*np.nonzero(mask)):
+                hits.append((int(track), self.lines[line], way))
+        return hits
+
+    def _inside(self, points):
+        """(points, polygons) mask of which points lie inside which polygon"""
+        x, y = points[:, None, 0], points[:, None, 1]
+        x1, y1 = self._edge_start[None, :, 0], self._edge_start[None, :, 1]
+        x2, y2 = self._edge_end[None, :, 0], self._edge_end[None, :, 1]
+        straddles = (y1 > y) != (y2 > y)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            crossing_x = x1 + (y - y1) * (x2 - x1) / (y2 - y1)
+        crosses = straddles & (x < crossing_x)
+        return (crosses.astype(np.int32) @ self._edge_owner) % 2 == 1
+
+    def _polygon_crossings(self, previous, current):
+        inside = self._inside(np.concatenate([previous, current]))
+        was_inside, is_inside = inside[:len(previous)], inside[len(previous):]
+        hits = []
+        for mask, way in ((~was_inside & is_inside, "enter"), (was_inside & ~is_inside, "exit")):
+            for track, polygon in zip(*np.nonzero(mask)):
+                hits.append((int(track), self.polygons[polygon], way))
+        return hits
+
+    def track_crossings(self, tracker):
+        """(object id, direction, zone) of every zone crossing of the tracker's objects since their last positions"""
+        object_ids = list(tracker.objects)
+        if not object_ids:
+            return []
+        previous = [tracker.previous_positions[object_id] for object_id in object_ids]
+        current = [tracker.objects[object_id] for object_id in object_ids]
+        return [(object_ids[track], direction, zone) for track, direction, zone in self.crossings(previous, current)]
+
+    def draw(self, frame, color=(0, 0, 255), thickness=2):
+        for zone in self.zones:
+            points = np.round(zone["points"]).astype(np.int32)
+            cv2.polylines(frame, [points], zone["type"] == "polygon", color, thickness)
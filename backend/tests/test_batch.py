@@ -0,0 +1,53 @@
+import json
+
+import numpy as np
+import pytest
+
+from services import anpr
+from services.batch import PlateReader, load_ocr_settings
+
+STUB_TIERS = {
+    "tiers": [{"backend": "stub", "text": "MH12AB1234", "confidence": 0.3},
+              {"backend": "stub", "text": "MH12AB1284", "confidence": 0.95}],
+    "min_confidence": 0.6,
+}
+
+
+class WholeCropPlateDetector:
+    """Stand-in for the YOLO plate model: the whole car crop is the plate"""
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def detect_plates_batch(self, car_crops):
+        return [[(0, 0, crop.shape[1], crop.shape[0])] for crop in car_crops]
+
+
+@pytest.fixture
+def config_path(tmp_path):
+    path = tmp_path / "feeds_config.json"
+    path.write_text(json.dumps({
+        "anpr": {"ocr": STUB_TIERS},
+        "feeds": [{"id": 1}, {"id": 2, "ocr": {"tiers": ["stub"]}}],
+    }))
+    return str(path)
+
+
+def test_ocr_settings_of_the_anpr_block_or_a_feed(config_path):
+    assert load_ocr_settings(config_path=config_path) == STUB_TIERS
+    assert load_ocr_settings(1, config_path=config_path) == STUB_TIERS
+    assert load_ocr_settings(2, config_path=config_path) == {"tiers": ["stub"]}
+    with pytest.raises(ValueError):
+        load_ocr_settings(3, config_path=config_path)
+
+
+def test_batch_plates_escalate_through_the_ocr_tiers(tmp_path, monkeypatch):
+    monkeypatch.setattr(anpr, "PlateDetector", WholeCropPlateDetector)
+    reader = PlateReader(str(tmp_path), STUB_TIERS)
+
+    results = reader.read(np.full((60, 200, 3), 128, np.uint8), frame_index=7)
+
+    assert [text for text, _ in results] == ["MH12AB1284"]
+    ocr = reader.recognizer.ocr_for(STUB_TIERS)
+    assert ocr.backend(0).images_read == 1
+    assert ocr.backend(1).images_read == 1
+    assert (tmp_path / "plates" / results[0][1]).is_file()
@@ -0,0 +1,78 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from services.gemini_client import GeminiPlateClient, StubTransport, parse_plate
+
+
+class ReorderingTransport(StubTransport):
+    """Answers packed requests with their lines in reverse order, leaving out image `skip`"""
+    def __init__(self, skip=None, **kwargs):
+        super().__init__(**kwargs)
+        self.skip = skip
+        self.packs = []
+
+    async def generate(self, prompt, images):
+        text = await super().generate(prompt, images)
+        if len(images) == 1:
+            return text
+        self.packs.append(len(images))
+        lines = [line for n, line in enumerate(text.splitlines(), 1) if n != self.skip]
+        return "\n".join(reversed(lines))
+
+
+def plate_images(count):
+    return [np.full((20, 80, 3), n, np.uint8) for n in range(count)]
+
+
+def read_concurrently(client, images):
+    """Each image read by a caller of its own, all arriving within the coalescing window"""
+    async def callers():
+        return await asyncio.gather(*(client.read_many([image]) for image in images))
+    return asyncio.run_coroutine_threadsafe(callers(), client.loop).result(timeout=10)
+
+
+@pytest.fixture
+def make_client():
+    clients = []
+
+    def make(transport):
+        client = GeminiPlateClient(transport, rate=1000, burst=1000, retries=0, pack_size=4, coalesce_ms=30)
+        clients.append(client)
+        return client
+    yield make
+    for client in clients:
+        client.close()
+
+
+def test_packed_answers_go_back_to_their_callers(make_client):
+    transport = ReorderingTransport(latency=0.01)
+    client = make_client(transport)
+    images = plate_images(8)
+
+    answers = read_concurrently(client, images)
+
+    assert transport.packs == [4, 4]
+    assert transport.requests == 2
+    assert answers == [[parse_plate(transport._plate_for(image))] for image in images]
+
+
+def test_plate_missing_from_a_packed_answer_is_asked_alone(make_client):
+    transport = ReorderingTransport(skip=2, latency=0.01)
+    client = make_client(transport)
+    images = plate_images(4)
+
+    answers = read_concurrently(client, images)
+
+    assert transport.packs == [4]
+    assert transport.requests == 2
+    assert answers == [[parse_plate(transport._plate_for(image))] for image in images]
+
+
+def test_read_batch_from_one_caller(make_client):
+    transport = StubTransport(plate="MH12AB1234", latency=0.01)
+    client = make_client(transport)
+
+    assert client.read_batch(plate_images(6)) == ["MH12AB1234"] * 6
+    assert transport.requests == 2
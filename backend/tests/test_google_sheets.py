@@ -0,0 +1,61 @@
+import csv
+
+from services.google_sheets import LocalWorksheet, SheetsSync
+
+
+def make_sync(tmp_path, worksheet):
+    # A flush interval far beyond the test, so only the test's own flush() calls write
+    return SheetsSync(url="local://unused", outbox_path=str(tmp_path / "outbox.jsonl"), flush_interval=3600,
+                      open_worksheet=lambda url: worksheet)
+
+
+def sheet_rows(path):
+    with open(path, newline='') as f:
+        return list(csv.reader(f))
+
+
+def test_failed_append_keeps_outbox_and_replays_in_order(tmp_path):
+    worksheet = LocalWorksheet(str(tmp_path / "sheet.csv"))
+    sync = make_sync(tmp_path, worksheet)
+    try:
+        for plate in ["MH12AB1234", "MH14C1234", "22BH1234AA"]:
+            sync.add(plate, status="enter", location="Gate 1")
+        worksheet.fail_next(1)
+
+        assert sync.flush() is False
+        assert len(sync.outbox) == 3
+        assert worksheet.appends == 0
+
+        sync.add("MH01XY0001", status="exit", location="Gate 1")
+        assert sync.flush() is True
+        assert len(sync.outbox) == 0
+        assert sync.failures == 0
+        rows = sheet_rows(worksheet.path)
+        assert [row[1] for row in rows] == ["MH12AB1234", "MH14C1234", "22BH1234AA", "MH01XY0001"]
+        assert [row[0] for row in rows] == ["0", "1", "2", "3"]
+        assert rows[-1][4:] == ["exit", "Gate 1"]
+    finally:
+        sync.stop(flush=False)
+
+
+def test_outbox_survives_a_restart(tmp_path):
+    worksheet = LocalWorksheet(str(tmp_path / "sheet.csv"))
+    sync = make_sync(tmp_path, worksheet)
+    sync.add("MH12AB1234")
+    worksheet.fail_next(1)
+    assert sync.flush() is False
+    sync.stop(flush=False)
+
+    restarted = make_sync(tmp_path, worksheet)
+    try:
+        assert len(restarted.outbox) == 1
+        assert restarted.flush() is True
+        assert [row[1] for row in sheet_rows(worksheet.path)] == ["MH12AB1234"]
+    finally:
+        restarted.stop(flush=False)
+
+
+def test_backoff_stays_finite_through_a_long_outage(tmp_path):
+    sync = make_sync(tmp_path, LocalWorksheet(str(tmp_path / "sheet.csv")))
+    sync.failures = 5000
+    assert sync._backoff() <= sync.max_backoff
@@ -0,0 +1,42 @@
+import numpy as np
+
+from services.ocr_backends import tiered_ocr_from_settings
+
+
+def plate_images(count):
+    return [np.full((20, 80, 3), n, np.uint8) for n in range(count)]
+
+
+def stub_tiers(*tiers):
+    return tiered_ocr_from_settings({
+        "tiers": [dict(backend="stub", **tier) for tier in tiers],
+        "min_confidence": 0.6,
+    })
+
+
+def test_low_confidence_read_escalates_to_the_next_tier():
+    ocr = stub_tiers({"text": "MH12AB1234", "confidence": 0.3}, {"text": "MH12AB1284", "confidence": 0.95})
+
+    reads = ocr.read_batch(plate_images(3))
+
+    assert reads == [("MH12AB1284", 0.95)] * 3
+    assert ocr.backend(0).images_read == 3
+    assert ocr.backend(1).images_read == 3
+
+
+def test_only_unsettled_plates_escalate():
+    ocr = stub_tiers({"answers": ["MH12AB1234", "MH1"], "confidence": 0.9},
+                     {"text": "MH14C1234", "confidence": 0.8})
+
+    reads = ocr.read_batch(plate_images(4))
+
+    # Every second read of the first tier does not look like a plate, so only those go on
+    assert reads == [("MH12AB1234", 0.9), ("MH14C1234", 0.8)] * 2
+    assert ocr.backend(1).images_read == 2
+
+
+def test_best_read_wins_when_no_tier_settles():
+    ocr = stub_tiers({"text": "MH12AB1234", "confidence": 0.5}, {"text": "MH12AB1234", "confidence": 0.4},
+                     {"text": "", "confidence": 0.0})
+
+    assert ocr.read_batch(plate_images(1)) == [("MH12AB1234", 0.5)]